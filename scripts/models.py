@@ -1,9 +1,9 @@
-import requests
 from huggingface_hub import hf_hub_download
 from datetime import datetime, timedelta
-import json
 
 from src.config import VLLM_API_URL
+from src.utils.frame_encoder import to_data_uri
+from src.utils.model_client import chat_completion
 
 def __load_system_prompt(repo_id: str, filename: str, useDefault: bool = False) -> str:
     if useDefault:
@@ -43,7 +43,7 @@ def __buildMessages(model, prompt, image_base64_list: list):
             { "type": "text", "text": prompt }
         ]
         for image_base64 in image_base64_list:
-            content.append({ "type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_base64}"} })
+            content.append({ "type": "image_url", "image_url": {"url": to_data_uri(image_base64)} })
     else:
         content = [{ "type": "text", "text": prompt }]
 
@@ -54,18 +54,9 @@ def __buildMessages(model, prompt, image_base64_list: list):
     return messages
 
 def call_mistral_vllm(prompt, image_base64=None):
-    try:
-        model = "mistralai/Mistral-Small-3.1-24B-Instruct-2503"
-        messages = __buildMessages(model, prompt, image_base64)
+    model = "mistralai/Mistral-Small-3.1-24B-Instruct-2503"
+    messages = __buildMessages(model, prompt, image_base64)
 
-        data = { "model": model, "messages": messages, "temperature": 0.15 } # If want to limit response: "max_tokens": 128
-        headers = { "Content-Type": "application/json", "Authorization": "Bearer token" }
-        response = requests.post(
-            VLLM_API_URL, 
-            headers=headers, 
-            data=json.dumps(data)
-        )
-        return response.json()["choices"][0]["message"]["content"]
-    except Exception as e:
-        print(f"❌ Error calling vLLM server: {e}")
-        return "ERROR"
+    data = { "model": model, "messages": messages, "temperature": 0.15 } # If want to limit response: "max_tokens": 128
+    headers = { "Authorization": "Bearer token" }
+    return chat_completion(VLLM_API_URL, data, headers)
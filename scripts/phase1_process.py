@@ -1,11 +1,12 @@
 import cv2
-from PIL import Image
-from io import BytesIO
-import base64
 import json
 from yt_dlp import YoutubeDL
 
-from src.config import OUTPUT_DIR, FRAME_INTERVAL_SECONDS, VIDEO_DOWNLOAD_DIR, ERROR_DIR, SKIP_PROCESSED_VIDEOS
+from src.config import OUTPUT_DIR, FRAME_INTERVAL_SECONDS, VIDEO_DOWNLOAD_DIR, ERROR_DIR, SKIP_PROCESSED_VIDEOS, USE_FRAME_STORE, \
+    ANNOTATION_FRAME_MAX_SIDE, ANNOTATION_FRAME_PIXEL_BUDGET, VLM_IMAGE_TOKEN_PIXELS
+from src.utils.frame_encoder import encode_to_base64, encode_batch_to_base64
+from src.utils.frame_extractor import FrameExtractor
+from src.utils.frame_store import FrameStore
 
 # Download YouTube Video
 def _download_youtube_video(youtube_url, qid, video_id):
@@ -27,44 +28,75 @@ def _download_youtube_video(youtube_url, qid, video_id):
 
 # Extract frames every N seconds
 def _extract_frames(video_path, interval):
+    frames = []
+    timestamps = []
+    for frame, timestamp in _iter_frames(video_path, interval):
+        frames.append(frame)
+        timestamps.append(timestamp)
+    return frames, timestamps
+
+# Lazily yield (frame, timestamp) every N seconds
+def _iter_frames(video_path, interval):
     print("\tExtracting frames...")
 
     cap = cv2.VideoCapture(video_path)
     fps = cap.get(cv2.CAP_PROP_FPS)
-    frame_interval = int(fps * interval)
-    frames = []
-    timestamps = []
+    frame_interval = max(1, int(fps * interval))
 
     frame_id = 0
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        if frame_id % frame_interval == 0:
-            timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
-            frames.append(frame)
-            timestamps.append(timestamp)
-        frame_id += 1
-    cap.release()
-    return frames, timestamps
+    try:
+        while cap.grab():
+            if frame_id % frame_interval == 0:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                yield frame, timestamp
+            frame_id += 1
+    finally:
+        cap.release()
+
+# Lazily yield (frames, timestamps) batches of `batch_size` frames
+# (JPEG bytes served from the frame store on reruns when USE_FRAME_STORE is set)
+def _iter_frame_batches(video_path, interval, batch_size=10):
+    if USE_FRAME_STORE:
+        extractor = FrameExtractor(
+            interval, store=FrameStore(), max_side=ANNOTATION_FRAME_MAX_SIDE,
+            pixel_budget=ANNOTATION_FRAME_PIXEL_BUDGET, multiple_of=VLM_IMAGE_TOKEN_PIXELS
+        )
+        yield from extractor.iter_encoded_batches(video_path, batch_size)
+        return
+
+    frames, timestamps = [], []
+    for frame, timestamp in _iter_frames(video_path, interval):
+        frames.append(frame)
+        timestamps.append(timestamp)
+        if len(frames) == batch_size:
+            yield frames, timestamps
+            frames, timestamps = [], []
+    if frames:
+        yield frames, timestamps
 
 # Convert frame to base64 image string
 def __encode_frame_to_base64(frame):
-    pil_img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-    buffer = BytesIO()
-    pil_img.save(buffer, format="JPEG")
-    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+    return encode_to_base64(frame)
 
 # Annotate Frames
 def _annotate_frames(frames, timestamps, main_question, call_model, question_id, video_id, batch_size=10):
+    batches = (
+        (frames[i:i + batch_size], timestamps[i:i + batch_size])
+        for i in range(0, len(frames), batch_size)
+    )
+    return _annotate_frame_batches(batches, main_question, call_model, question_id, video_id)
+
+# Annotate a lazy stream of (frames, timestamps) batches
+def _annotate_frame_batches(batches, main_question, call_model, question_id, video_id):
     print("\tAnnotating Extracted Frames...")
     
     annotations = []
-    for i in range(0, len(frames), batch_size):
+    for i, (batch_frames, batch_ts) in enumerate(batches):
         print(f"\t\tProcessing batch {i}...")
-        batch_frames = frames[i:i + batch_size]
-        batch_ts = timestamps[i:i + batch_size]
-        batch_img_b64 = [__encode_frame_to_base64(f) for f in batch_frames]
+        batch_img_b64 = encode_batch_to_base64(batch_frames)
 
         # Building Prompt
         previous_annotation = annotations[-1] if annotations else None
@@ -92,11 +124,13 @@ def _annotate_frames(frames, timestamps, main_question, call_model, question_id,
         ]"""
 
         # Call Modal
+        response = None
+        batch_annotations = None
         try:
-            batch_annotations = call_model(prompt, batch_img_b64)
+            response = call_model(prompt, batch_img_b64)
 
             # Parse response
-            batch_annotations = batch_annotations.strip("```")
+            batch_annotations = response.strip("```")
             batch_annotations = batch_annotations.strip("json")
             batch_annotations = batch_annotations.strip("```")
             if not batch_annotations.startswith("[") or not "".endswith("]"):
@@ -115,12 +149,12 @@ def _annotate_frames(frames, timestamps, main_question, call_model, question_id,
             for a in batch_annotations:
                 annotations.append(a)
         except Exception as err:
+            # `response` is None when the request itself failed (ModelClientError)
             with open(ERROR_DIR / f"{question_id}_{video_id}.json", "w") as f:
-                print(batch_annotations)
                 error_msg = {
                     "error_type": "annotate frames error",
                     "err": str(err),
-                    "batch_annotations": str(batch_annotations)
+                    "batch_annotations": str(response)
                 }
                 json.dump(error_msg, f, indent=2)
 
@@ -204,11 +238,11 @@ def phase1_process_video(example, call_model):
         # 0. Download Youtube Video to local if doesn't exist
         video_path = _download_youtube_video(video_youtube_url, question_id, video_id)
 
-        # 1. Extract Frames
-        frames, timestamps = _extract_frames(video_path, interval=FRAME_INTERVAL_SECONDS)
+        # 1. Extract Frames (lazily, one batch at a time)
+        batches = _iter_frame_batches(video_path, interval=FRAME_INTERVAL_SECONDS)
 
         # 2a. Annotate Extracted Frames
-        frame_annotations = _annotate_frames(frames, timestamps, main_question, call_model, question_id, video_id)
+        frame_annotations = _annotate_frame_batches(batches, main_question, call_model, question_id, video_id)
 
         # 2b.Annotate Video as a Whole
         whole_video_annotation = _annotate_video_whole(main_question, frame_annotations, call_model)
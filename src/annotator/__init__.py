@@ -1,3 +1,4 @@
 from .frame_annotator import FrameAnnotator
 from .video_annotator import VideoAnnotator
-from .summarizer import AnnotationSummarizer
\ No newline at end of file
+from .summarizer import AnnotationSummarizer
+from .coarse_to_fine import CoarseToFineAnnotator
@@ -0,0 +1,112 @@
+from collections import Counter
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from src.config import MAX_MODEL_LEN, PROMPT_TEMPLATE_OVERHEAD_TOKENS, MISTRAL_TOKENIZER, ANNOTATION_OUTPUT_TOKENS_PER_FRAME
+from src.utils.frame_mosaic import mosaic_layout
+from src.utils.frame_resize import estimate_image_tokens, frame_size
+from src.utils.prompt_packer import get_tokenizer
+
+
+@lru_cache(maxsize=256)
+def image_tokens(width: int, height: int, tiles: int = 1) -> int:
+    """
+    Image tokens of one image slot: a (width, height) frame, or with `tiles` > 1 the
+    mosaic `pack_mosaic` builds from that many such frames.
+    """
+    if tiles > 1:
+        rows, cols, tile_w, tile_h = mosaic_layout(width, height, tiles)
+        width, height = cols * tile_w, rows * tile_h
+    return estimate_image_tokens(width, height)
+
+
+class BatchSizer:
+    """
+    Size each FrameAnnotator request to the server's context window:
+
+        overhead + text tokens + image tokens + output reserve <= max_model_len
+
+    with at most `max_images` images. Image tokens are estimated from the frames'
+    resolution (or, with tiles, the mosaics'). Text tokens are a per-request part
+    (instructions, questions, previous annotation) plus a per-frame part (its line),
+    counted once per video with the served model's tokenizer. `output_tokens_per_frame`
+    tokens per frame are kept free for the answer. Each request takes as many frames
+    as fit.
+    """
+    def __init__(
+        self,
+        max_images: int,
+        tiles_per_image: int = 1,
+        max_model_len: int = MAX_MODEL_LEN,
+        output_tokens_per_frame: int = ANNOTATION_OUTPUT_TOKENS_PER_FRAME,
+        overhead: int = PROMPT_TEMPLATE_OVERHEAD_TOKENS,
+        tokenizer_name: str = MISTRAL_TOKENIZER,
+    ):
+        self.max_images = max_images
+        self.tiles_per_image = tiles_per_image
+        self.max_model_len = max_model_len
+        self.output_tokens_per_frame = output_tokens_per_frame
+        self.overhead = overhead
+        self.tokenizer_name = tokenizer_name
+
+    def measure_prompt(self, render: Callable[[List[float], Optional[str]], Tuple[Optional[str], str]]) -> Tuple[int, int]:
+        """
+        (per-request, per-frame) text tokens of the (system, user) prompts
+        `render(batch_ts, previous)` builds, from a one- and a two-frame prompt whose
+        previous annotation is `output_tokens_per_frame` words long.
+        """
+        tokenizer = get_tokenizer(self.tokenizer_name)
+        previous = " ".join(["frame"] * self.output_tokens_per_frame)
+
+        def count(n: int) -> int:
+            system, user = render([9999.99] * n, previous)
+            return len(tokenizer.encode((system or "") + "\n" + user, add_special_tokens=False))
+
+        one, two = count(1), count(2)
+        return max(2 * one - two, 0), max(two - one, 0)
+
+    def request_tokens(self, frames: int, sizes: List[Tuple[int, int]], text_tokens: Tuple[int, int]) -> int:
+        """
+        Estimated context tokens of a request of `frames` frames whose images start with
+        frames of the given (width, height) sizes.
+        """
+        fixed, per_frame = text_tokens
+        last_tiles = frames - (len(sizes) - 1) * self.tiles_per_image
+        images = sum(image_tokens(w, h, self.tiles_per_image) for w, h in sizes[:-1])
+        images += image_tokens(*sizes[-1], last_tiles) if sizes else 0
+        return self.overhead + fixed + frames * (per_frame + self.output_tokens_per_frame) + images
+
+    def regroup(
+        self, batches: Iterable[Tuple[List, List[float]]], text_tokens: Tuple[int, int]
+    ) -> Iterator[Tuple[List, List[float]]]:
+        """
+        Regroup a stream of (frames, timestamps) batches into requests of as many frames
+        as fit (at least one each), and print the chosen sizes once the stream ends.
+        """
+        chosen = Counter()
+        largest = 0
+        frames, timestamps, sizes = [], [], []
+        for batch_f, batch_ts in batches:
+            for frame, ts in zip(batch_f, batch_ts):
+                new_image = len(frames) % self.tiles_per_image == 0
+                grown = sizes + [frame_size(frame)] if new_image else sizes
+                if frames and (len(grown) > self.max_images
+                               or self.request_tokens(len(frames) + 1, grown, text_tokens) > self.max_model_len):
+                    chosen[len(frames)] += 1
+                    largest = max(largest, self.request_tokens(len(frames), sizes, text_tokens))
+                    yield frames, timestamps
+                    frames, timestamps, grown = [], [], [frame_size(frame)]
+                frames.append(frame)
+                timestamps.append(ts)
+                sizes = grown
+        if frames:
+            chosen[len(frames)] += 1
+            largest = max(largest, self.request_tokens(len(frames), sizes, text_tokens))
+            yield frames, timestamps
+
+        if chosen:
+            counts = ", ".join(f"{n} frames x {k}" for n, k in sorted(chosen.items(), reverse=True))
+            print(f"\t📐 Batch sizes: {counts} (largest request ~{largest}/{self.max_model_len} tokens, "
+                  f"text {text_tokens[0]} + {text_tokens[1]}/frame, output {self.output_tokens_per_frame}/frame)")
+            if largest > self.max_model_len:
+                print(f"\t⚠️ A single frame does not fit in {self.max_model_len} tokens; lower ANNOTATION_FRAME_MAX_SIDE")
@@ -0,0 +1,164 @@
+import copy
+import math
+import re
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+from src.config import CLIP_SERVER_URL, COARSE_INTERVAL_SECONDS, FINE_INTERVAL_SECONDS, \
+    COARSE_TO_FINE_TOP_SEGMENTS, OUTPUT_DIR
+from src.utils.frame_extractor import FrameExtractor
+from .frame_annotator import FrameAnnotator
+
+
+class CoarseToFineAnnotator:
+    """
+    Question-guided frame annotation for long videos.
+
+    1. Annotate the whole video at a coarse rate (`coarse_interval_seconds`).
+    2. Embed the coarse frames, the main question and each sub-question with CLIP and
+       score every coarse segment [t, t + coarse_interval) by its best cosine similarity.
+    3. Re-extract only the `top_segments` best segments at `fine_interval_seconds`
+       and annotate those frames.
+    4. Merge coarse and fine annotations in time order (same `frame_annotations` schema).
+
+    This replaces both the dense fixed-rate annotation pass and the separate dense
+    CLIP keyframe pass (`video_vectorizer.py`) for long videos: the coarse frames,
+    ranked by similarity to the main question, are saved as the video's keyframe
+    parquet (`<qid>_<vid>_embeddings.parquet`, same columns as the vectorizer's).
+    """
+    def __init__(
+        self,
+        frame_annotator: FrameAnnotator,
+        extractor: FrameExtractor,
+        clip_server_url: str = CLIP_SERVER_URL,
+        coarse_interval_seconds: float = COARSE_INTERVAL_SECONDS,
+        fine_interval_seconds: float = FINE_INTERVAL_SECONDS,
+        top_segments: int = COARSE_TO_FINE_TOP_SEGMENTS,
+        output_dir: Path = OUTPUT_DIR,
+    ):
+        # clip_client is only installed on the vectorizer boxes (requirements_vec.txt)
+        from clip_client import Client
+
+        self.frame_annotator = frame_annotator
+        self.extractor = extractor
+        self.coarse_extractor = copy.copy(extractor)
+        self.coarse_extractor.interval_seconds = coarse_interval_seconds
+        self.coarse_extractor.sampling = "fixed"
+        self.client = Client(server=clip_server_url)
+        self.coarse_interval_seconds = coarse_interval_seconds
+        self.fine_interval_seconds = fine_interval_seconds
+        self.top_segments = top_segments
+        self.output_dir = output_dir
+
+    def annotate(
+        self, video_path: str, main_question: str, sub_questions, question_id: str, video_id: str
+    ) -> List[dict]:
+        # 1. Coarse pass (coarse frames are few, so keep their JPEGs for CLIP)
+        coarse = list(self.coarse_extractor.iter_encoded(video_path))
+        if not coarse:
+            return []
+        blobs = [blob for blob, _ in coarse]
+        coarse_ts = [ts for _, ts in coarse]
+        print(f"\t🔎 Coarse pass: {len(coarse_ts)} frames every {self.coarse_interval_seconds}s")
+        coarse_anns = self.frame_annotator.annotate(
+            blobs, coarse_ts, main_question, sub_questions, question_id, video_id
+        )
+
+        # 2. Score coarse segments against the questions, and keep the coarse frames
+        #    as the video's keyframes
+        frame_emb, similarity = self._score(blobs, [main_question, *self._split_questions(sub_questions)])
+        self._save_keyframes(question_id, video_id, coarse_ts, blobs, frame_emb, similarity[:, 0])
+        segments = self._top_segments(coarse_ts, similarity.max(axis=1))
+
+        # 3. Fine pass over the best segments only
+        fine_ts = self._fine_timestamps(segments, set(round(ts, 3) for ts in coarse_ts))
+        print(f"\t🔬 Fine pass: {len(segments)} segments, {len(fine_ts)} frames every {self.fine_interval_seconds}s")
+        fine_anns = self.frame_annotator.annotate_batches(
+            self.extractor.iter_batches_at(video_path, fine_ts, self.frame_annotator.frames_per_request),
+            main_question, sub_questions, question_id, video_id
+        )
+
+        # 4. Merge in time order
+        return sorted(coarse_anns + fine_anns, key=_timestamp_of)
+
+    def _score(self, blobs: List[bytes], queries: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (normalised frame embeddings, frames x queries cosine similarities).
+        """
+        from docarray import Document, DocumentArray
+
+        print("\tScoring coarse segments via CLIP...")
+        frames = self.client.encode(DocumentArray([Document(blob=b) for b in blobs]))
+        frame_emb = np.asarray(frames.embeddings, dtype=np.float32)
+        query_emb = np.asarray(self.client.encode(queries), dtype=np.float32)
+        frame_emb /= np.linalg.norm(frame_emb, axis=1, keepdims=True) + 1e-8
+        query_emb /= np.linalg.norm(query_emb, axis=1, keepdims=True) + 1e-8
+        return frame_emb, frame_emb @ query_emb.T
+
+    def _save_keyframes(
+        self, question_id: str, video_id: str, timestamps: List[float], blobs: List[bytes],
+        frame_emb: np.ndarray, similarity: np.ndarray,
+    ):
+        """
+        Write the coarse frames, most similar to the main question first, as the keyframe
+        parquet the Key Frames Processor / foi_combiner read. `similarity` is stored as a
+        cosine distance, like the vectorizer's docarray scores.
+        """
+        from datasets import Dataset
+
+        order = np.argsort(similarity)[::-1]
+        records = [{
+            'timestamp': timestamps[i],
+            'similarity': float(1 - similarity[i]),
+            'embedding': frame_emb[i].tolist(),
+            'frame': blobs[i],
+        } for i in order]
+        parquet_path = self.output_dir / f"{question_id}_{video_id}_embeddings.parquet"
+        Dataset.from_list(records).to_parquet(str(parquet_path))
+        print(f"\t✓ Saved {len(records)} coarse keyframes to: {parquet_path}")
+
+    def _top_segments(self, coarse_ts: List[float], scores: np.ndarray) -> List[Tuple[float, float]]:
+        """
+        Best-scoring coarse segments, with adjacent ones merged, in time order.
+        """
+        top = sorted(np.argsort(scores)[::-1][:self.top_segments].tolist())
+        segments: List[Tuple[float, float]] = []
+        for idx in top:
+            start = coarse_ts[idx]
+            end = coarse_ts[idx + 1] if idx + 1 < len(coarse_ts) else start + self.coarse_interval_seconds
+            if segments and math.isclose(segments[-1][1], start, abs_tol=1e-3):
+                segments[-1] = (segments[-1][0], end)
+            else:
+                segments.append((start, end))
+        return segments
+
+    def _fine_timestamps(self, segments: List[Tuple[float, float]], already: set) -> List[float]:
+        timestamps = []
+        for start, end in segments:
+            n = max(1, int(round((end - start) / self.fine_interval_seconds)))
+            for i in range(n):
+                ts = start + i * self.fine_interval_seconds
+                if round(ts, 3) not in already:
+                    timestamps.append(ts)
+        return timestamps
+
+    @staticmethod
+    def _split_questions(sub_questions) -> List[str]:
+        """
+        Sub-questions come back from the VLM as free text; keep each line that reads as a question.
+        """
+        if isinstance(sub_questions, (list, tuple)):
+            lines = [str(q) for q in sub_questions]
+        else:
+            lines = str(sub_questions or "").splitlines()
+        queries = [re.sub(r"^\s*(\d+[.)]|[-*•])\s*", "", line).strip() for line in lines]
+        return [q for q in queries if q.endswith("?")]
+
+
+def _timestamp_of(annotation: dict) -> float:
+    try:
+        return float(annotation.get("timestamp", 0.0))
+    except (TypeError, ValueError):
+        return 0.0
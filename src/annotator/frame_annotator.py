@@ -1,17 +1,60 @@
+import asyncio
+import contextvars
+import itertools
 import json
 import math
-from concurrent.futures import as_completed, ProcessPoolExecutor
-from typing import List, Callable, Any
-from src.utils.frame_encoder import encode_to_base64, encode_blob_to_base64
-from src.config import ERROR_DIR
+import re
+import threading
+import time
+from concurrent.futures import as_completed, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Callable, Any, Awaitable, Iterable, Iterator, Optional, Tuple
+from src.utils.frame_encoder import encode_batch_to_base64, encode_blob_to_base64
+from src.utils.frame_dedup import FrameDeduplicator
+from src.utils.frame_mosaic import pack_mosaics
+from src.utils.annotation_checkpoint import AnnotationCheckpoint
+from src.annotator.prompt_compiler import frame_batch_prompt
+from src.annotator.batch_sizer import BatchSizer
+from src.utils.model_client import ModelClientError, ModelHTTPError
+from src.utils.response_cache import model_stage
+from src.config import ERROR_DIR, FRAME_JPEG_QUALITY, MODEL_MAX_CONCURRENCY_PER_ENDPOINT, ANNOTATION_WINDOW_BATCHES, \
+    ANNOTATION_GUIDED_JSON, ANNOTATION_CHECKPOINTS, ANNOTATION_BATCH_ATTEMPTS, ANNOTATION_COMPACT_PROMPTS, \
+    ANNOTATION_DYNAMIC_BATCHING, ANNOTATION_MAX_IMAGES_PER_REQUEST, MAX_MODEL_LEN, ANNOTATION_OUTPUT_TOKENS_PER_FRAME
+
+# vLLM structured output for a batch: [{"timestamp": <number>, "annotation": <string>}, ...]
+ANNOTATIONS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "frame_annotations",
+        "schema": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"timestamp": {"type": "number"}, "annotation": {"type": "string"}},
+                "required": ["timestamp", "annotation"],
+            },
+        },
+    },
+}
 
 
 class FrameAnnotator:
-    def __init__(self, call_model: Callable[..., Any], batch_size: int = 10, processBlob: bool = False, vllm_url = ""):
+    def __init__(self, call_model: Callable[..., Any], batch_size: int = ANNOTATION_MAX_IMAGES_PER_REQUEST, processBlob: bool = False, vllm_url = "", jpeg_quality: int = FRAME_JPEG_QUALITY, dedup: bool = False, tiles_per_image: int = 1, acall_model: Optional[Callable[..., Awaitable[str]]] = None, stage: str = "frame_annotation", windows: int = 1, window_batches: int = ANNOTATION_WINDOW_BATCHES, guided_json: bool = ANNOTATION_GUIDED_JSON, checkpoint: bool = ANNOTATION_CHECKPOINTS, max_attempts: int = ANNOTATION_BATCH_ATTEMPTS, compact_prompts: bool = ANNOTATION_COMPACT_PROMPTS, dynamic_batching: bool = ANNOTATION_DYNAMIC_BATCHING):
         self.call_model = call_model
+        self.stage = stage
+        self.acall_model = acall_model
         self.batch_size = batch_size
         self.processBlob = processBlob
+        self.jpeg_quality = jpeg_quality
+        self.dedup = dedup
+        self.tiles_per_image = tiles_per_image
         self.vllm_url = vllm_url
+        self.windows = windows
+        self.window_batches = window_batches
+        self.guided_json = guided_json
+        self.checkpoint = checkpoint
+        self.max_attempts = max_attempts
+        self.compact_prompts = compact_prompts
+        self.dynamic_batching = dynamic_batching
         ERROR_DIR.mkdir(parents=True, exist_ok=True)
 
     def annotate(
@@ -23,35 +66,471 @@ class FrameAnnotator:
         question_id: str,
         video_id: str
     ) -> List[dict]:
+        step = self.frames_per_request
+        batches = (
+            (frames[i : i + step], timestamps[i : i + step])
+            for i in range(0, len(frames), step)
+        )
+        return self.annotate_batches(batches, main_question, sub_questions, question_id, video_id)
+
+    def annotate_batches(
+        self,
+        batches: Iterable[Tuple[List, List[float]]],
+        main_question: str,
+        sub_questions,
+        question_id: str,
+        video_id: str
+    ) -> List[dict]:
+        """
+        Annotate a (possibly lazy) stream of (frames, timestamps) batches, e.g. from
+        `FrameExtractor.iter_batches`. Each batch is released once it is annotated.
+
+        With `dedup`, near-duplicate frames are collapsed before they reach the VLM and
+        each annotation is fanned back out to the timestamps its frame stood in for.
+
+        With `tiles_per_image` > 1, each image slot carries a labelled grid of that many
+        frames, so one request annotates up to `frames_per_request` frames.
+
+        With `dynamic_batching`, batches are regrouped so each request carries as many
+        frames as fit the server's context and `batch_size` images (see `BatchSizer`).
+
+        With `windows` > 1, the batches are split into windows of `window_batches`
+        consecutive batches and up to `windows` of them are annotated at once (spread
+        over the servers when `vllm_url` is an `EndpointPool`). Within a window each
+        prompt still carries the previous batch's annotation; across windows continuity
+        comes from a text-only stitching call per boundary (see `_stitch`).
+
+        With `checkpoint`, every annotated batch is journaled (see `AnnotationCheckpoint`);
+        a rerun for the same (qid, vid) reuses journaled batches without encoding or
+        sending them and only requests the missing or failed ones. A failing batch is
+        attempted up to `max_attempts` times, counting attempts of earlier runs.
+        """
         print("\tAnnotating Extracted Frames...")
-        annotations: List[dict] = []
+        deduplicator = FrameDeduplicator() if self.dedup else None
+        if deduplicator:
+            batches = deduplicator.filter(batches, self.frames_per_request)
+        batches = self._sized(batches, main_question, sub_questions)
+
+        journal = self.open_checkpoint(question_id, video_id)
+        encoded = self._prefetch_encoded(iter(batches), journal)
+        if self.windows > 1:
+            annotations = self._annotate_windows(encoded, main_question, sub_questions, question_id, video_id, journal)
+        else:
+            annotations = self._annotate_chain(encoded, main_question, sub_questions, question_id, video_id, journal)
 
-        for i in range(0, len(frames), int(self.batch_size)):
-            print(f"\t\tProcessing batch {i}...")
-            batch_f = frames[i : i + self.batch_size]
-            batch_ts = timestamps[i : i + self.batch_size]
-            imgs_b64 = [encode_to_base64(f) if not self.processBlob else encode_blob_to_base64(f) for f in batch_f]
+        if deduplicator:
+            deduplicator.report(self.frames_per_request)
+            annotations = deduplicator.expand(annotations)
+        return annotations
+
+    def _annotate_chain(
+        self,
+        encoded: Iterable[Tuple[List[float], List[str]]],
+        main_question: str,
+        sub_questions,
+        question_id: str,
+        video_id: str,
+        journal: Optional[AnnotationCheckpoint] = None,
+        first_batch: int = 0,
+    ) -> List[dict]:
+        """
+        Annotate encoded batches one after another, each prompt carrying the last
+        annotation of the batch before it.
+        """
+        annotations: List[dict] = []
+        for batch_idx, (batch_ts, imgs_b64) in enumerate(encoded, first_batch):
+            done = journal.get(batch_ts) if journal else None
+            if done is not None:
+                annotations.extend(done)
+                continue
+            print(f"\t\tProcessing batch {batch_idx} ({len(batch_ts)} frames from {self._format_ts(batch_ts[0])})...")
             previous = annotations[-1]["annotation"] if annotations else None
 
-            prompt = self._build_prompt(batch_ts, main_question, sub_questions, previous)
+            system, prompt = self._batch_prompt(batch_ts, main_question, sub_questions, previous)
+            annotations.extend(self._annotate_batch(prompt, imgs_b64, batch_ts, question_id, video_id, journal, system))
+        return annotations
+
+    def _annotate_batch(
+        self,
+        prompt: str,
+        imgs_b64: List[str],
+        batch_ts: List[float],
+        question_id: str,
+        video_id: str,
+        journal: Optional[AnnotationCheckpoint] = None,
+        system_prompt: Optional[str] = None,
+    ) -> List[dict]:
+        """
+        Annotations of one batch; [] if it fails. Unusable output is retried right away
+        with a new sampling seed, up to `max_attempts` attempts. A `ModelClientError` has
+        already been through the client's retries, so with a journal the remaining
+        attempts are left to the next run.
+        """
+        failed = journal.failed_attempts(batch_ts) if journal else 0
+        for attempt in range(failed, self.max_attempts):
             try:
                 print('Frame annotator posting to', self.vllm_url)
-                raw = self.call_model(self.vllm_url, prompt, imgs_b64)
-                parsed = self._parse_response(raw)
-                annotations.extend(parsed)
+                parsed = self._request(prompt, imgs_b64, batch_ts, seed=attempt or None, system_prompt=system_prompt)
             except Exception as e:
-                self._write_error(e, question_id, video_id)
+                action = self._failure_action(e, attempt, journal)
+                self._write_error(e, question_id, video_id, batch_ts, action)
+                if journal:
+                    journal.record_failure(batch_ts, e)
+                if action == "retrying":
+                    continue
+                break
+            if journal:
+                journal.record(batch_ts, parsed)
+            return parsed
+        if failed >= self.max_attempts:
+            print(f"\t⚠️ Skipping batch at {self._format_ts(batch_ts[0])}: failed {failed} times in earlier runs")
+        return []
+
+    async def _aannotate_batch(
+        self,
+        prompt: str,
+        imgs_b64: List[str],
+        batch_ts: List[float],
+        question_id: str,
+        video_id: str,
+        journal: Optional[AnnotationCheckpoint] = None,
+        system_prompt: Optional[str] = None,
+    ) -> List[dict]:
+        """
+        Async `_annotate_batch` using `acall_model`.
+        """
+        failed = journal.failed_attempts(batch_ts) if journal else 0
+        for attempt in range(failed, self.max_attempts):
+            try:
+                parsed = await self._arequest(prompt, imgs_b64, batch_ts, seed=attempt or None, system_prompt=system_prompt)
+            except Exception as e:
+                action = self._failure_action(e, attempt, journal)
+                self._write_error(e, question_id, video_id, batch_ts, action)
+                if journal:
+                    journal.record_failure(batch_ts, e)
+                if action == "retrying":
+                    continue
+                break
+            if journal:
+                journal.record(batch_ts, parsed)
+            return parsed
+        if failed >= self.max_attempts:
+            print(f"\t⚠️ Skipping batch at {self._format_ts(batch_ts[0])}: failed {failed} times in earlier runs")
+        return []
+
+    def _failure_action(self, err: Exception, attempt: int, journal: Optional[AnnotationCheckpoint]) -> str:
+        """
+        What happens to a batch after failed attempt `attempt` (0-based).
+        """
+        if attempt + 1 >= self.max_attempts:
+            return "dropped"
+        if journal and isinstance(err, ModelClientError):
+            return "deferred to the next run"
+        return "retrying"
+
+    def open_checkpoint(self, question_id: str, video_id: str) -> Optional[AnnotationCheckpoint]:
+        """
+        This stage's batch journal for (qid, vid), or None with `checkpoint` off.
+        """
+        if not self.checkpoint:
+            return None
+        journal = AnnotationCheckpoint.open(question_id, video_id, self.stage, self.checkpoint_config())
+        done, missing = journal.batches_done(), journal.missing()
+        if done or missing:
+            print(f"\t⏯️ Resuming from {journal.path}: {done} batches done, {missing} failed before")
+        return journal
+
+    def checkpoint_config(self) -> dict:
+        """
+        Settings that decide how frames are grouped into batches, stored in the journal
+        header: a journal built with other settings has no matching batches.
+        """
+        config = {"batch_size": self.batch_size, "tiles_per_image": self.tiles_per_image, "dedup": self.dedup,
+                  "dynamic_batching": self.dynamic_batching}
+        if self.dynamic_batching:
+            config.update(compact_prompts=self.compact_prompts, max_model_len=MAX_MODEL_LEN,
+                          output_tokens_per_frame=ANNOTATION_OUTPUT_TOKENS_PER_FRAME)
+        return config
+
+    def retryable_batches(self, question_id: str, video_id: str) -> int:
+        """
+        Failed batches of (qid, vid) that a rerun would request again.
+        """
+        if not self.checkpoint:
+            return 0
+        journal = AnnotationCheckpoint.open(question_id, video_id, self.stage, self.checkpoint_config())
+        return journal.retryable(self.max_attempts)
+
+    def finish_checkpoint(self, question_id: str, video_id: str):
+        """
+        Drop the journal once the result is saved, unless some batches are still missing.
+        """
+        if not self.checkpoint:
+            return
+        journal = AnnotationCheckpoint.open(question_id, video_id, self.stage, self.checkpoint_config())
+        missing = journal.missing()
+        if missing:
+            print(f"\t⏸️ Keeping {journal.path}: {missing} batches missing, "
+                  f"{journal.retryable(self.max_attempts)} will be retried on the next run")
+        else:
+            journal.clear()
+
+    def _annotate_windows(
+        self,
+        encoded: Iterator[Tuple[List[float], List[str]]],
+        main_question: str,
+        sub_questions,
+        question_id: str,
+        video_id: str,
+        journal: Optional[AnnotationCheckpoint] = None,
+    ) -> List[dict]:
+        """
+        Annotate windows of `window_batches` encoded batches concurrently, then stitch
+        the boundaries. At most `windows` windows of encoded images are held at once.
+        """
+        print(f"\t\tAnnotating windows of {self.window_batches} batches, {self.windows} at once")
+        slots = threading.Semaphore(self.windows)
+
+        def run(window, first_batch):
+            try:
+                return self._annotate_chain(window, main_question, sub_questions, question_id, video_id, journal, first_batch)
+            finally:
+                slots.release()
+
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.windows, thread_name_prefix="annotation-window") as pool:
+            while True:
+                slots.acquire()
+                window = list(itertools.islice(encoded, self.window_batches))
+                if not window:
+                    slots.release()
+                    break
+                # Each job runs in a copy of this thread's context, so the qid / stage labels
+                # of its model calls (telemetry, response cache) carry over to the worker.
+                futures.append(pool.submit(contextvars.copy_context().run, run, window, len(futures) * self.window_batches))
+            windows = [future.result() for future in futures]
+
+            # Rewrite the first annotation of every window against the last one before it
+            boundaries = [(k, pool.submit(contextvars.copy_context().run, self._stitch, windows[k - 1][-1], windows[k][0], main_question, question_id, video_id))
+                          for k in range(1, len(windows)) if windows[k - 1] and windows[k]]
+            for k, future in boundaries:
+                stitched = future.result()
+                if stitched is not None:
+                    windows[k][0] = {**windows[k][0], "annotation": stitched}
+        return [ann for window in windows for ann in window]
+
+    def _stitch(self, before: dict, after: dict, main_question: str, question_id: str, video_id: str) -> Optional[str]:
+        """
+        Annotation of `after` (first frame of a window) rewritten for continuity with
+        `before` (last frame of the previous window), or None if the call fails.
+        """
+        prompt = (
+            "Instruction: The two frame annotations below come from consecutive frames of one video but were written independently. "
+            "Rewrite the annotation of Frame 0 so that entities keep the descriptive texts used for the previous frame, "
+            "and note changes from the previous frame in entity state, position, appearance and existence. "
+            "Keep every other detail of the Frame 0 annotation. Do not add anything that is not in either annotation.\n"
+            f"User main question: \"{main_question}\"\n"
+            f"Previous frame: {self._format_ts(before.get('timestamp'))}. {before.get('annotation')}\n"
+            f"Frame 0: {self._format_ts(after.get('timestamp'))}. {after.get('annotation')}\n"
+            "\nReturn as a JSON array: "
+            "[{\"timestamp\":0.0,\"annotation\":\"...\"}]"
+        )
+        try:
+            with model_stage("frame_stitching"):
+                raw = self.call_model(self.vllm_url, prompt)
+            parsed = self._parse_response(raw)
+            return str(parsed[-1]["annotation"]) if parsed else None
+        except Exception as e:
+            self._write_error(e, question_id, video_id, [after.get("timestamp")])
+            return None
+
+    @staticmethod
+    def _format_ts(ts) -> str:
+        try:
+            return f"{float(ts):.2f}s"
+        except (TypeError, ValueError):
+            return f"{ts}s"
+
+    async def aannotate_batches(
+        self,
+        batches: Iterable[Tuple[List, List[float]]],
+        main_question: str,
+        sub_questions,
+        question_id: str,
+        video_id: str,
+        max_in_flight: int = MODEL_MAX_CONCURRENCY_PER_ENDPOINT,
+    ) -> List[dict]:
+        """
+        Async `annotate_batches` using `acall_model`: up to `max_in_flight` batches are
+        annotated concurrently. Batches no longer wait on each other, so the prompt's
+        "Previous" annotation is left empty. Annotations are returned in batch order.
+        Journaled batches are reused as in `annotate_batches`.
+        """
+        print("\tAnnotating Extracted Frames (async)...")
+        deduplicator = FrameDeduplicator() if self.dedup else None
+        if deduplicator:
+            batches = deduplicator.filter(batches, self.frames_per_request)
+        batches = self._sized(batches, main_question, sub_questions)
+        journal = self.open_checkpoint(question_id, video_id)
+
+        async def annotate_one(batch_ts, imgs_b64) -> List[dict]:
+            try:
+                done = journal.get(batch_ts) if journal else None
+                if done is not None:
+                    return done
+                system, prompt = self._batch_prompt(batch_ts, main_question, sub_questions, None)
+                return await self._aannotate_batch(prompt, imgs_b64, batch_ts, question_id, video_id, journal, system)
+            finally:
+                in_flight.release()
+
+        # Decoding/encoding stays on the prefetch thread; only `max_in_flight` encoded
+        # batches are held in memory at once.
+        in_flight = asyncio.Semaphore(max_in_flight)
+        encoded = self._prefetch_encoded(iter(batches), journal)
+        tasks = []
+        while True:
+            await in_flight.acquire()
+            item = await asyncio.to_thread(next, encoded, None)
+            if item is None:
+                in_flight.release()
+                break
+            print(f"\t\tProcessing batch {len(tasks)} ({len(item[0])} frames from {self._format_ts(item[0][0])})...")
+            tasks.append(asyncio.create_task(annotate_one(*item)))
+
+        annotations = [ann for batch in await asyncio.gather(*tasks) for ann in batch]
+        if deduplicator:
+            deduplicator.report(self.frames_per_request)
+            annotations = deduplicator.expand(annotations)
         return annotations
 
+    def _request(self, prompt: str, imgs_b64: List[str], batch_ts: List[float], seed: Optional[int] = None, system_prompt: Optional[str] = None) -> List[dict]:
+        """
+        Validated annotations of one batch: schema-constrained output while the server
+        supports it, free text through the fallback parser otherwise.
+        """
+        snap_ts = batch_ts if self.tiles_per_image > 1 else None
+        options = {"seed": seed} if seed is not None else {}
+        if system_prompt:
+            options["system_prompt"] = system_prompt
+        if self.guided_json:
+            try:
+                with model_stage(self.stage):
+                    raw = self.call_model(self.vllm_url, prompt, imgs_b64, response_format=ANNOTATIONS_RESPONSE_FORMAT, **options)
+                return self._parse_response(raw, snap_ts, guided=True)
+            except ModelHTTPError as e:
+                if not self._guided_unsupported(e):
+                    raise
+        with model_stage(self.stage):
+            raw = self.call_model(self.vllm_url, prompt, imgs_b64, **options)
+        return self._parse_response(raw, snap_ts)
+
+    async def _arequest(self, prompt: str, imgs_b64: List[str], batch_ts: List[float], seed: Optional[int] = None, system_prompt: Optional[str] = None) -> List[dict]:
+        """
+        Async `_request` using `acall_model`.
+        """
+        snap_ts = batch_ts if self.tiles_per_image > 1 else None
+        options = {"seed": seed} if seed is not None else {}
+        if system_prompt:
+            options["system_prompt"] = system_prompt
+        if self.guided_json:
+            try:
+                with model_stage(self.stage):
+                    raw = await self.acall_model(self.vllm_url, prompt, imgs_b64, response_format=ANNOTATIONS_RESPONSE_FORMAT, **options)
+                return self._parse_response(raw, snap_ts, guided=True)
+            except ModelHTTPError as e:
+                if not self._guided_unsupported(e):
+                    raise
+        with model_stage(self.stage):
+            raw = await self.acall_model(self.vllm_url, prompt, imgs_b64, **options)
+        return self._parse_response(raw, snap_ts)
+
+    def _guided_unsupported(self, err: ModelHTTPError) -> bool:
+        """
+        True (and guided decoding switched off) if `err` is the server rejecting
+        `response_format`, rather than e.g. a prompt over the context length.
+        """
+        if err.status not in (400, 422) or not re.search(r"response_format|json_schema|guided|structured|grammar", err.body, re.I):
+            return False
+        if self.guided_json:
+            self.guided_json = False
+            print(f"\t⚠️ Server does not support guided JSON, falling back to text parsing: {err}")
+        return True
+
+    def _prefetch_encoded(
+        self, batches: Iterator[Tuple[List, List[float]]], journal: Optional[AnnotationCheckpoint] = None
+    ) -> Iterator[Tuple[List[float], Optional[List[str]]]]:
+        """
+        Yield (timestamps, base64 images) per batch while the next batch is already being
+        pulled from `batches` and encoded in the background, overlapping decode/encode of
+        batch i+1 with the in-flight VLM request for batch i. Batches already in `journal`
+        are not encoded (images None).
+        """
+        def load_next():
+            batch = next(batches, None)
+            if batch is None:
+                return None
+            batch_f, batch_ts = batch
+            if journal and journal.get(batch_ts) is not None:
+                return batch_ts, None
+            if self.tiles_per_image > 1:
+                mosaics = pack_mosaics(batch_f, batch_ts, self.tiles_per_image)
+                return batch_ts, encode_batch_to_base64(mosaics, self.jpeg_quality)
+            if self.processBlob:
+                return batch_ts, [encode_blob_to_base64(f) for f in batch_f]
+            return batch_ts, encode_batch_to_base64(batch_f, self.jpeg_quality)
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="frame-prefetch") as prefetcher:
+            pending = prefetcher.submit(load_next)
+            while True:
+                item = pending.result()
+                if item is None:
+                    return
+                pending = prefetcher.submit(load_next)
+                yield item
+
+    def _sized(self, batches: Iterable[Tuple[List, List[float]]], main_question: str, sub_questions) -> Iterable[Tuple[List, List[float]]]:
+        """
+        `batches` regrouped to fill each request's context budget, or as they are with
+        `dynamic_batching` off.
+        """
+        if not self.dynamic_batching:
+            return batches
+        sizer = BatchSizer(self.batch_size, self.tiles_per_image)
+        text_tokens = sizer.measure_prompt(lambda ts, previous: self._batch_prompt(ts, main_question, sub_questions, previous))
+        return sizer.regroup(batches, text_tokens)
+
+    @property
+    def frames_per_request(self) -> int:
+        return self.batch_size * self.tiles_per_image
+
+    def _batch_prompt(self, batch_ts, main_question, sub_questions, previous) -> Tuple[Optional[str], str]:
+        """
+        (system, user) prompt of one batch; the system part is None for the legacy prompt.
+        """
+        if self.compact_prompts:
+            return frame_batch_prompt(batch_ts, main_question, sub_questions, previous, self.tiles_per_image)
+        return None, self._build_prompt(batch_ts, main_question, sub_questions, previous)
+
     def _build_prompt(self, batch_ts, main_question, sub_questions, previous) -> str:
+        if self.tiles_per_image > 1:
+            shown = (
+                f"{math.ceil(len(batch_ts) / self.tiles_per_image)} images, each a grid of up to "
+                f"{self.tiles_per_image} video frames (tiles, left-to-right then top-to-bottom, each labelled "
+                f"\"#<frame> <timestamp>s\" in its top-left corner), {len(batch_ts)} frames in total. Treat every tile as its own frame"
+            )
+        else:
+            shown = f"{len(batch_ts)} frames from a video"
         p = (
-            f"Instruction: You are shown {len(batch_ts)} frames from a video. Briefly describe each, "
+            f"Instruction: You are shown {shown}. Briefly describe each, "
             "noting changes from the previous frame, specifically noting changes in entity state, position, appearance and existence based on its descriptive text. If the entity is a person, describe the gender and clothes of the person. If it is an item, describe the type and function of item. Do not hallucinate. Do not state anything you are unsure of. Only answer questions you are very sure about. Firstly, identify entities in the video, and give them descriptive texts for future references. Also identify interactions between entities. Next, answer the Subquestions. Identify the relevance of entities found with respect to the subquestions. Next, using the sub-question answers, answer the main-question. Then use your answers for the Subquestions to formulate your annotation for the frame, bearing in mind it will late be used for answering the main question eventually."
             f"User main question: \"{main_question}\"\n"
             f"Subquestions: {sub_questions}"
         )
         for idx, ts in enumerate(batch_ts):
-            p += f"Frame {idx}: {ts:.2f}s. Previous: {previous}\n"
+            if self.tiles_per_image > 1:
+                p += f"Frame {idx} (image {idx // self.tiles_per_image}, tile #{idx}): {ts:.2f}s. Previous: {previous}\n"
+            else:
+                p += f"Frame {idx}: {ts:.2f}s. Previous: {previous}\n"
         p += (
             "\nReturn as a JSON array: "
             "[{\"timestamp\":0.0,\"annotation\":\"...\"}, ...]"
@@ -59,16 +538,64 @@ class FrameAnnotator:
         return p
 
     @staticmethod
-    def _parse_response(raw: str) -> List[dict]:
-        txt = raw.strip("```").replace("json", "")
-        start = txt.find("[")
-        end = txt.rfind("]") + 1
-        if start < 0 or end < 0:
-            raise ValueError("Invalid response format")
-        return json.loads(txt[start:end])
+    def _parse_response(raw: str, batch_ts: Optional[List[float]] = None, guided: bool = False) -> List[dict]:
+        """
+        Parse the JSON array of {timestamp, annotation}. `guided` responses are plain
+        JSON; free text (or guided output cut off at the length limit) goes through the
+        fallback parser, which looks for the outermost [...] inside a ```json fence.
+        Entries without a numeric timestamp and a non-empty annotation are dropped;
+        raises ValueError if none is left.
+
+        With `batch_ts`, each returned timestamp is snapped to the nearest requested
+        frame timestamp (needed for tiled images, where the model reads timestamps off
+        the tile labels).
+        """
+        parsed = None
+        if guided:
+            try:
+                parsed = json.loads(raw)
+            except ValueError:
+                parsed = None
+        if parsed is None:
+            txt = re.sub(r"^```(?:json)?|```$", "", raw.strip()).strip()
+            start = txt.find("[")
+            end = txt.rfind("]") + 1
+            if start < 0 or end <= start:
+                raise ValueError("Invalid response format")
+            parsed = json.loads(txt[start:end])
+
+        annotations = FrameAnnotator._validate(parsed)
+        if batch_ts:
+            for ann in annotations:
+                ann["timestamp"] = min(batch_ts, key=lambda t: abs(t - ann["timestamp"]))
+        return annotations
 
     @staticmethod
-    def _write_error(err: Exception, qid: str, vid: str):
-        fp = ERROR_DIR / f"{qid}_{vid}.json"
-        with open(fp, "w") as f:
-            json.dump({"error": str(err)}, f, indent=2)
\ No newline at end of file
+    def _validate(parsed) -> List[dict]:
+        if not isinstance(parsed, list):
+            raise ValueError(f"Expected a JSON array of annotations, got {type(parsed).__name__}")
+        annotations = []
+        for ann in parsed:
+            if not isinstance(ann, dict):
+                continue
+            try:
+                ts = float(ann["timestamp"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            text = ann.get("annotation")
+            if isinstance(text, str) and text.strip():
+                annotations.append({**ann, "timestamp": ts, "annotation": text.strip()})
+        if not annotations:
+            raise ValueError("No valid {timestamp, annotation} entries in the response")
+        return annotations
+
+    def _write_error(self, err: Exception, qid: str, vid: str, batch_ts: Optional[List[float]] = None, action: str = "dropped"):
+        """
+        Append one JSON line per failed attempt to error/<qid>_<vid>.jsonl.
+        """
+        ts = [float(t) for t in batch_ts if t is not None] if batch_ts else []
+        where = f" at {ts[0]:.2f}s" if ts else ""
+        print(f"\t⚠️ Batch{where} ({len(ts)} frames) failed, {action}: {err}")
+        fp = ERROR_DIR / f"{qid}_{vid}.jsonl"
+        with open(fp, "a") as f:
+            f.write(json.dumps({"time": time.time(), "stage": self.stage, "timestamps": ts, "error": str(err)}) + "\n")
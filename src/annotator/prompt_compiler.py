@@ -0,0 +1,80 @@
+from typing import List, Optional, Tuple
+
+from src.utils.prompt_packer import frame_line
+
+# Static instructions go into the system message, so every request of a stage starts
+# with the same tokens (one vLLM prefix-cache entry per stage). Everything that varies
+# comes after them, in the user message, and each shared element appears once.
+
+FRAME_INSTRUCTIONS = (
+    "You annotate batches of frames from a video. For every frame:\n"
+    "- Identify the entities and give each a descriptive text to refer to it by. For a person, describe gender and clothes; for an item, its type and function.\n"
+    "- Note changes from the previous frame in entity state, position, appearance and existence, and interactions between entities.\n"
+    "- Answer the sub-questions, identify the relevance of the entities to them, then use those answers to answer the main question.\n"
+    "- Write the frame's annotation from those answers; it will later be used to answer the main question.\n"
+    "Do not hallucinate. Do not state anything you are unsure of.\n"
+    "Return as a JSON array with one entry per frame: [{\"timestamp\":0.0,\"annotation\":\"...\"}, ...]"
+)
+
+TILED_FRAME_INSTRUCTIONS = (
+    "Each image is a grid of up to {tiles} video frames (tiles, left-to-right then top-to-bottom, each labelled "
+    "\"#<frame> <timestamp>s\" in its top-left corner). Treat every tile as its own frame."
+)
+
+VIDEO_INSTRUCTIONS = (
+    "You are given the frame annotations of a video, along with sub-questions and the main question. "
+    "Use them to write a summary of the video that answers the sub-questions and the main question. "
+    "Identify entities (humans, objects, items) that may be relevant to the sub-questions / main question."
+)
+
+SUMMARY_INSTRUCTIONS = "Write a brief summary of the video described below."
+
+
+def frame_batch_prompt(
+    batch_ts: List[float],
+    main_question: str,
+    sub_questions,
+    previous: Optional[str],
+    tiles_per_image: int = 1,
+) -> Tuple[str, str]:
+    """
+    (system, user) prompt of one FrameAnnotator batch. The previous batch's last
+    annotation is given once rather than on every frame line.
+    """
+    system = FRAME_INSTRUCTIONS
+    if tiles_per_image > 1:
+        system += "\n" + TILED_FRAME_INSTRUCTIONS.format(tiles=tiles_per_image)
+    user = f"Main question: \"{main_question}\"\nSub-questions: {sub_questions}\n"
+    if previous:
+        user += f"Previous frame: {previous}\n"
+    for idx, ts in enumerate(batch_ts):
+        if tiles_per_image > 1:
+            user += f"Frame {idx} (image {idx // tiles_per_image}): {ts:.2f}s.\n"
+        else:
+            user += f"Frame {idx}: {ts:.2f}s.\n"
+    return system, user
+
+
+def video_annotation_prompt(main_question: str, subquestions, frame_annotations: List[dict]) -> Tuple[str, str]:
+    """
+    (system, user) prompt of the VideoAnnotator.
+    """
+    lines = "\n".join(frame_line(ann) for ann in frame_annotations)
+    user = (
+        f"Frame annotations:\n{lines}\n\n"
+        f"Main question: \"{main_question}\"\n"
+        f"Sub-questions: {subquestions}\n"
+    )
+    return VIDEO_INSTRUCTIONS, user
+
+
+def summary_prompt(frame_annotations: List[dict], whole_annotation: str) -> Tuple[str, str]:
+    """
+    (system, user) prompt of the AnnotationSummarizer.
+    """
+    lines = "\n".join(frame_line(ann) for ann in frame_annotations)
+    user = (
+        f"Frame-level descriptions:\n{lines}\n\n"
+        f"Video-level description:\n{whole_annotation}\n"
+    )
+    return SUMMARY_INSTRUCTIONS, user
@@ -1,13 +1,52 @@
-from typing import Callable, Any, List
+from typing import Callable, Any, Awaitable, List, Optional, Tuple
+
+from src.config import MISTRAL_TOKENIZER, ANNOTATION_COMPACT_PROMPTS
+from src.utils.prompt_packer import PromptPacker
+from src.utils.response_cache import model_stage
+from src.annotator.prompt_compiler import summary_prompt
 
 
 class AnnotationSummarizer:
-    def __init__(self, call_model: Callable[..., Any], vllm_url):
+    def __init__(self, call_model: Callable[..., Any], vllm_url, acall_model: Optional[Callable[..., Awaitable[str]]] = None, compact_prompts: bool = ANNOTATION_COMPACT_PROMPTS, packer: Optional[PromptPacker] = None):
         self.call_model = call_model
+        self.acall_model = acall_model
         self.vllm_url = vllm_url
+        self.compact_prompts = compact_prompts
+        self.packer = packer or PromptPacker(MISTRAL_TOKENIZER)
 
     def summarize(self, frame_annotations: List[dict], whole_annotation: str) -> str:
         print("\tSummarizing all annotations...")
+        system, prompt = self._packed_prompt(frame_annotations, whole_annotation)
+        with model_stage("summary"):
+            if system:
+                return self.call_model(self.vllm_url, prompt, system_prompt=system)
+            return self.call_model(self.vllm_url, prompt)
+
+    async def asummarize(self, frame_annotations: List[dict], whole_annotation: str) -> str:
+        print("\tSummarizing all annotations...")
+        system, prompt = self._packed_prompt(frame_annotations, whole_annotation)
+        with model_stage("summary"):
+            if system:
+                return await self.acall_model(self.vllm_url, prompt, system_prompt=system)
+            return await self.acall_model(self.vllm_url, prompt)
+
+    def _packed_prompt(self, frame_annotations: List[dict], whole_annotation: str) -> Tuple[Optional[str], str]:
+        """
+        (system, user) prompt with as many frame annotations as fit the context window,
+        preferring those closest to the whole-video annotation; the system part is None
+        for the legacy prompt.
+        """
+        if self.compact_prompts:
+            system, empty = summary_prompt([], whole_annotation)
+            frames = self.packer.pack_frames(frame_annotations, whole_annotation, f"{system}\n{empty}", line_overhead=1)
+            return summary_prompt(frames, whole_annotation)
+        frames = self.packer.pack_frames(
+            frame_annotations, whole_annotation, self._build_prompt([], whole_annotation)
+        )
+        return None, self._build_prompt(frames, whole_annotation)
+
+    @staticmethod
+    def _build_prompt(frame_annotations: List[dict], whole_annotation: str) -> str:
         lines = "\n".join(
             f"[{a['timestamp']:.1f}s]: {a['annotation']}"
             for a in frame_annotations
@@ -19,4 +58,4 @@ class AnnotationSummarizer:
             f"{whole_annotation}\n\n"
             "Write a brief summary."
         )
-        return self.call_model(self.vllm_url, prompt)
\ No newline at end of file
+        return prompt
\ No newline at end of file
@@ -1,14 +1,62 @@
-from typing import List, Callable, Any
+from typing import List, Callable, Any, Awaitable, Optional, Tuple
 
+from src.config import MISTRAL_TOKENIZER, ANNOTATION_COMPACT_PROMPTS
+from src.utils.prompt_packer import PromptPacker
+from src.utils.response_cache import model_stage
+from src.annotator.prompt_compiler import video_annotation_prompt
 
 
 class VideoAnnotator:
-    def __init__(self, call_model: Callable[..., Any], vllm_url):
+    def __init__(
+        self,
+        call_model: Callable[..., Any],
+        vllm_url,
+        acall_model: Optional[Callable[..., Awaitable[str]]] = None,
+        packer: Optional[PromptPacker] = None,
+        compact_prompts: bool = ANNOTATION_COMPACT_PROMPTS,
+    ):
         self.call_model = call_model
+        self.acall_model = acall_model
         self.vllm_url = vllm_url
+        self.packer = packer or PromptPacker(MISTRAL_TOKENIZER)
+        self.compact_prompts = compact_prompts
 
     def annotate(self, main_question: str, subquestions: str, frame_annotations: List[dict]) -> str:
         print("\tAnnotating video as a whole...")
+        system, prompt = self._packed_prompt(main_question, subquestions, frame_annotations)
+        with model_stage("video_annotation"):
+            if system:
+                return self.call_model(self.vllm_url, prompt, system_prompt=system)
+            return self.call_model(self.vllm_url, prompt)
+
+    async def aannotate(self, main_question: str, subquestions: str, frame_annotations: List[dict]) -> str:
+        print("\tAnnotating video as a whole...")
+        system, prompt = self._packed_prompt(main_question, subquestions, frame_annotations)
+        with model_stage("video_annotation"):
+            if system:
+                return await self.acall_model(self.vllm_url, prompt, system_prompt=system)
+            return await self.acall_model(self.vllm_url, prompt)
+
+    def _packed_prompt(self, main_question: str, subquestions: str, frame_annotations: List[dict]) -> Tuple[Optional[str], str]:
+        """
+        (system, user) prompt with as many frame annotations (most relevant first) as fit
+        the context window; the system part is None for the legacy prompt.
+        """
+        if self.compact_prompts:
+            system, empty = video_annotation_prompt(main_question, subquestions, [])
+            frames = self.packer.pack_frames(
+                frame_annotations, f"{main_question}\n{subquestions}", f"{system}\n{empty}", line_overhead=1
+            )
+            return video_annotation_prompt(main_question, subquestions, frames)
+        frames = self.packer.pack_frames(
+            frame_annotations,
+            f"{main_question}\n{subquestions}",
+            self._build_prompt(main_question, subquestions, []),
+        )
+        return None, self._build_prompt(main_question, subquestions, frames)
+
+    @staticmethod
+    def _build_prompt(main_question: str, subquestions: str, frame_annotations: List[dict]) -> str:
         content = "\n".join(
             f"[Frame {i} ({ann['timestamp']:.2f}s)] {ann['annotation']}"
             for i, ann in enumerate(frame_annotations)
@@ -19,4 +67,4 @@ class VideoAnnotator:
             f"User question: \"{main_question}\"\n"
             f"Sub-questions: {subquestions}\n"
         )
-        return self.call_model(self.vllm_url, prompt)
\ No newline at end of file
+        return prompt
\ No newline at end of file
@@ -0,0 +1,107 @@
+"""
+Prompt tokens per frame of the annotation stages (frame annotator, video annotator,
+summarizer) with the legacy prompts against the compiled ones
+(src/annotator/prompt_compiler.py), rebuilt from video processor outputs.
+
+Tokens are counted with the VLM's tokenizer on the system + user text of each
+request, plus the estimated image tokens of the frame annotator's images
+(`estimate_image_tokens` of a `--frame-size` source frame resized to
+ANNOTATION_FRAME_MAX_SIDE). Images follow the text and differ per request, so they
+are never served from the prefix cache. Prefill is what remains after a simulated
+block-level prefix cache (see prefix_cache).
+
+Usage (from the repo root, needs video processor outputs in OUTPUT_DIR, e.g. from
+`python -m src.benchmarks.load_generator ... --keep-outputs`):
+    python -m src.benchmarks.annotation_prompts [--limit 20] [--batch-size 10] [--frame-size 1920x1080]
+"""
+import argparse
+import json
+from collections import defaultdict
+
+from src.annotator import FrameAnnotator, VideoAnnotator, AnnotationSummarizer
+from src.annotator.prompt_compiler import frame_batch_prompt, video_annotation_prompt, summary_prompt
+from src.benchmarks.prefix_cache import simulate_ids
+from src.config import OUTPUT_DIR, MISTRAL_TOKENIZER, ANNOTATION_FRAME_MAX_SIDE
+from src.utils.call_mistral_model import mistral_request
+from src.utils.frame_resize import estimate_image_tokens, target_size
+from src.utils.prompt_packer import get_tokenizer
+
+STAGES = ("frame_annotation", "video_annotation", "summary")
+
+
+def request_text(prompt: str, system_prompt=None) -> str:
+    """
+    System and user text of the request `call_mistral_vllm` would send.
+    """
+    messages = mistral_request(prompt, system_prompt=system_prompt)[0]["messages"]
+    return messages[0]["content"] + "\n" + messages[1]["content"][0]["text"]
+
+
+def build_requests(data: dict, batch_size: int) -> dict:
+    """
+    {layout: {stage: [request text, ...]}} for one output file.
+    """
+    question, subqs = data["main_question"], data["sub_questions"]
+    frames = data["annotations"]["frame_annotations"]
+    whole = data["annotations"]["whole_video_annotation"]
+    legacy_annotator = FrameAnnotator(None, batch_size=batch_size, checkpoint=False)
+    requests = {"legacy": defaultdict(list), "compiled": defaultdict(list)}
+
+    previous = None
+    for i in range(0, len(frames), batch_size):
+        batch_ts = [float(f["timestamp"]) for f in frames[i:i + batch_size]]
+        requests["legacy"]["frame_annotation"].append(
+            request_text(legacy_annotator._build_prompt(batch_ts, question, subqs, previous)))
+        system, user = frame_batch_prompt(batch_ts, question, subqs, previous)
+        requests["compiled"]["frame_annotation"].append(request_text(user, system))
+        previous = frames[i:i + batch_size][-1]["annotation"]
+
+    requests["legacy"]["video_annotation"].append(request_text(VideoAnnotator._build_prompt(question, subqs, frames)))
+    system, user = video_annotation_prompt(question, subqs, frames)
+    requests["compiled"]["video_annotation"].append(request_text(user, system))
+
+    requests["legacy"]["summary"].append(request_text(AnnotationSummarizer._build_prompt(frames, whole)))
+    system, user = summary_prompt(frames, whole)
+    requests["compiled"]["summary"].append(request_text(user, system))
+    return requests
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limit", type=int, default=20, help="number of output files (videos) to use")
+    parser.add_argument("--batch-size", type=int, default=10, help="frames per annotator request")
+    parser.add_argument("--frame-size", default="1920x1080", help="source video resolution, WxH")
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.frame_size.lower().split("x"))
+    frame_tokens = estimate_image_tokens(*target_size(width, height, max_side=ANNOTATION_FRAME_MAX_SIDE))
+
+    paths = sorted(OUTPUT_DIR.glob("*.json"))[:args.limit]
+    if not paths:
+        raise SystemExit(f"No video processor outputs in {OUTPUT_DIR}")
+    tokenizer = get_tokenizer(MISTRAL_TOKENIZER)
+
+    frames = 0
+    texts = {"legacy": defaultdict(list), "compiled": defaultdict(list)}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        frames += len(data["annotations"]["frame_annotations"])
+        for layout, by_stage in build_requests(data, args.batch_size).items():
+            for stage, stage_texts in by_stage.items():
+                texts[layout][stage] += stage_texts
+    print(f"{len(paths)} videos, {frames} frames, ~{frame_tokens} image tokens per frame")
+
+    print(f"\n{'stage':<18} {'layout':<9} {'requests':>9} {'prompt tok':>11} {'tok/frame':>10} {'prefill tok':>12} {'prefill/frame':>14}")
+    for stage in STAGES:
+        results = {}
+        for layout in ("legacy", "compiled"):
+            ids = [tokenizer.encode(text, add_special_tokens=False) for text in texts[layout][stage]]
+            r = results[layout] = simulate_ids(ids)
+            if stage == "frame_annotation":
+                # Every frame is sent once as an image in both layouts and always prefilled
+                r["prompt_tokens"] += frames * frame_tokens
+                r["prefill_tokens"] += frames * frame_tokens
+            print(f"{stage:<18} {layout:<9} {r['requests']:>9} {r['prompt_tokens']:>11} {r['prompt_tokens'] / max(frames, 1):>10.1f} "
+                  f"{r['prefill_tokens']:>12} {r['prefill_tokens'] / max(frames, 1):>14.1f}")
+        change = {key: results["compiled"][key] / max(results["legacy"][key], 1) - 1 for key in ("prompt_tokens", "prefill_tokens")}
+        print(f"{'':<18} compiled: prompt tokens {change['prompt_tokens']:+.0%}, prefill tokens {change['prefill_tokens']:+.0%}")
@@ -0,0 +1,63 @@
+"""
+Compare requests/second of the sync model client (one blocking call at a time, as
+the pipeline stages issue them) against the async client (many requests in flight,
+under the adaptive per-endpoint limit) on a local stub chat-completions server.
+
+Usage (from the repo root):
+    python -m src.benchmarks.async_throughput [--requests 200] [--latency 0.2] [--concurrency 10]
+"""
+import argparse
+import asyncio
+import time
+
+from src.utils.async_model_client import AsyncModelClient
+from src.utils.model_client import ModelClient
+from src.utils.stub_server import StubServer
+
+PAYLOAD = {"model": "stub", "messages": [{"role": "user", "content": "Describe the frame."}]}
+
+
+def start_stub_server(latency: float, max_num_seqs: int) -> str:
+    """
+    Stub server where each request takes `latency` seconds and at most `max_num_seqs`
+    are served at once (like vLLM's --max-num-seqs).
+    """
+    stub = StubServer(
+        latency=f"fixed:{latency}", tokens_per_second=None, prefill_tokens_per_second=None,
+        max_num_seqs=max_num_seqs, batch_slowdown=0.0,
+    )
+    return stub.start()
+
+
+def measure_sync(url: str, n: int) -> float:
+    client = ModelClient()
+    start = time.perf_counter()
+    for _ in range(n):
+        client.chat(url, PAYLOAD)
+    client.close()
+    return n / (time.perf_counter() - start)
+
+
+async def measure_async(url: str, n: int, concurrency: int):
+    async with AsyncModelClient(max_concurrency=concurrency) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client.chat(url, PAYLOAD) for _ in range(n)))
+        return n / (time.perf_counter() - start), client.limiter_stats()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.2, help="stub server seconds per request")
+    parser.add_argument("--concurrency", type=int, default=10, help="stub --max-num-seqs and the client's starting limit")
+    args = parser.parse_args()
+
+    url = start_stub_server(args.latency, args.concurrency)
+    sync_rps = measure_sync(url, max(1, args.requests // args.concurrency))
+    async_rps, limits = asyncio.run(measure_async(url, args.requests, args.concurrency))
+
+    print(f"\n{'path':<8} {'req/s':>8}")
+    print(f"{'sync':<8} {sync_rps:>8.1f}")
+    print(f"{'async':<8} {async_rps:>8.1f}  ({async_rps / sync_rps:.1f}x)")
+    for endpoint, stats in limits.items():
+        print(f"\nadaptive limit {endpoint}: {stats['limit']} in flight, p95 {stats['latency_p95']:.3f}s")
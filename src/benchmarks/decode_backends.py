@@ -0,0 +1,46 @@
+"""
+Benchmark the FrameExtractor decode backends against the legacy read() loop.
+
+Usage (from the repo root):
+    python -m src.benchmarks.decode_backends videos/0008_abc.mp4 [more.mp4 ...] [--interval 0.5]
+"""
+import argparse
+import time
+
+from src.config import FRAME_INTERVAL_SECONDS
+from src.utils.frame_extractor import FrameExtractor
+
+
+def benchmark(video_paths, interval_seconds: float, repeats: int = 1):
+    extractors = {}
+    for backend in FrameExtractor.BACKENDS:
+        try:
+            extractors[backend] = FrameExtractor(interval_seconds, backend=backend)
+        except RuntimeError as e:  # e.g. ffmpeg / ffprobe not installed
+            print(f"\t⚠️ Skipping {backend}: {e}")
+    results = {b: {"seconds": 0.0, "frames": 0} for b in extractors}
+
+    for video_path in video_paths:
+        for backend, extractor in extractors.items():
+            for _ in range(repeats):
+                start = time.perf_counter()
+                frames, _ = extractor.extract(video_path)
+                results[backend]["seconds"] += time.perf_counter() - start
+                results[backend]["frames"] += len(frames)
+
+    baseline = results["read"]["seconds"] or float("nan")
+    print(f"\n{'backend':<8} {'seconds':>9} {'frames':>8} {'frames/s':>10} {'speedup':>8}")
+    for backend, r in results.items():
+        fps = r["frames"] / r["seconds"] if r["seconds"] else 0.0
+        speedup = baseline / r["seconds"] if r["seconds"] else float("nan")
+        print(f"{backend:<8} {r['seconds']:>9.2f} {r['frames']:>8} {fps:>10.1f} {speedup:>7.2f}x")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("videos", nargs="+")
+    parser.add_argument("--interval", type=float, default=FRAME_INTERVAL_SECONDS)
+    parser.add_argument("--repeats", type=int, default=1)
+    args = parser.parse_args()
+    benchmark(args.videos, args.interval, args.repeats)
@@ -0,0 +1,195 @@
+"""
+Drive VideoProcessor and VideoAnswering end to end against local stub servers
+(src/utils/stub_server.py), to reproduce throughput and concurrency behaviour
+without GPU servers.
+
+Every local video becomes one synthetic example (alternating MCQ and open-ended
+questions). The response cache is bypassed and telemetry is kept in memory; the
+outputs and annotation checkpoints of the "loadtest-*" qids are removed afterwards unless
+--keep-outputs is given.
+
+Usage (from the repo root):
+    python -m src.benchmarks.load_generator videos/*.mp4 [--servers 2] [--concurrency 4] [--async]
+        [--latency lognormal:0.3,0.4] [--tokens-per-second 40] [--max-num-seqs 10] [--error-rate 0.02]
+"""
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from src.config import OUTPUT_DIR, CHECKPOINT_DIR
+from src.utils.async_model_client import AsyncModelClient
+from src.utils.call_mistral_model import mistral_request
+from src.utils.call_qwen2_model import qwen2_request
+from src.utils.endpoint_pool import EndpointPool
+from src.utils.model_client import ModelClient
+from src.utils.stub_server import StubServer
+from src.utils.telemetry import Telemetry, summarize_servers
+from src.video_answering import VideoAnswering
+from src.video_processor import VideoProcessor
+
+MCQ_PROMPT = "Options:\n(A) Walking\n(B) Running\n(C) Sitting\n(D) Driving\n(E) Talking"
+OE_PROMPT = "Answer in one sentence."
+
+
+class RecordingTelemetry(Telemetry):
+    """
+    In-memory telemetry: keeps every record for the report instead of writing JSONL.
+    """
+    def __init__(self):
+        super().__init__(path=None)
+        self.records = []
+
+    def emit(self, record: dict):
+        super().emit(record)
+        self.records.append(record)
+
+
+class LocalVideos:
+    """
+    Stands in for `VideoDownloader`: serves the local file of each load-test qid.
+    """
+    def __init__(self, paths_by_qid: dict):
+        self.paths_by_qid = paths_by_qid
+
+    def download(self, youtube_url: str, qid: str, video_id: str) -> str:
+        return self.paths_by_qid[qid]
+
+
+def make_examples(video_paths) -> list:
+    examples = []
+    for i, path in enumerate(video_paths):
+        examples.append({
+            "qid": f"loadtest-{i}",
+            "video_id": Path(path).stem,
+            "youtube_url": "",
+            "question": "What is the person in the dark jacket doing?",
+            "question_prompt": MCQ_PROMPT if i % 2 == 0 else OE_PROMPT,
+            "duration": None,
+        })
+    return examples
+
+
+def run_sync(examples, paths_by_qid, target, telemetry, concurrency: int):
+    client = ModelClient(telemetry=telemetry)
+
+    def call_vlm(url, prompt, image_base64=None, stop_when=None, **options):
+        data, headers = mistral_request(prompt, image_base64, **options)
+        return client.chat(url, data, headers, stop_when)
+
+    def call_llm(prompt, stop_when=None):
+        return client.chat(target, qwen2_request(prompt), stop_when=stop_when)
+
+    processor = VideoProcessor(call_vlm, target, coarse_to_fine=False)
+    processor.downloader = LocalVideos(paths_by_qid)
+    answering = VideoAnswering(call_llm, examples=examples)
+
+    def guarded(step):
+        def run(example):
+            try:
+                return step(example)
+            except Exception as e:
+                print(f"❌ {example['qid']}: {e}")
+        return run
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(guarded(processor.process), examples))
+        answers = list(pool.map(guarded(answering.process), examples))
+    client.close()
+    return answers
+
+
+async def run_async(examples, paths_by_qid, target, telemetry, concurrency: int):
+    async with AsyncModelClient(telemetry=telemetry) as client:
+        async def acall_vlm(url, prompt, image_base64=None, stop_when=None, **options):
+            data, headers = mistral_request(prompt, image_base64, **options)
+            return await client.chat(url, data, headers, stop_when)
+
+        async def acall_llm(prompt, stop_when=None):
+            return await client.chat(target, qwen2_request(prompt), stop_when=stop_when)
+
+        processor = VideoProcessor(None, target, coarse_to_fine=False, acall_model=acall_vlm)
+        processor.downloader = LocalVideos(paths_by_qid)
+        await processor.aprocess_many(examples, max_videos=concurrency)
+
+        answering = VideoAnswering(None, acall_model=acall_llm, examples=examples)
+        slots = asyncio.Semaphore(concurrency)
+
+        async def answer(example):
+            async with slots:
+                return await answering.aprocess(example)
+
+        return await asyncio.gather(*(answer(example) for example in examples), return_exceptions=True)
+
+
+def report(records, elapsed: float, examples: list, answers: list, stubs: dict):
+    by_stage = defaultdict(list)
+    for r in records:
+        by_stage[r["stage"]].append(r)
+    answered = sum(1 for a in answers if isinstance(a, str) and a)
+    print(f"\n{len(examples)} videos, {answered} answered in {elapsed:.1f}s ({len(examples) / elapsed:.2f} videos/s)")
+
+    print(f"\n{'stage':<22} {'reqs':>6} {'errs':>5} {'p50 s':>7} {'p95 s':>7} {'prompt tok':>11} {'compl tok':>10}")
+    for stage, rs in sorted(by_stage.items()):
+        walls = [r["wall"] for r in rs if r["error"] is None] or [0.0]
+        print(f"{stage:<22} {len(rs):>6} {sum(r['error'] is not None for r in rs):>5} "
+              f"{np.percentile(walls, 50):>7.2f} {np.percentile(walls, 95):>7.2f} "
+              f"{sum(r['prompt_tokens'] or 0 for r in rs):>11} {sum(r['completion_tokens'] or 0 for r in rs):>10}")
+
+    print(f"\n{'endpoint':<40} {'reqs':>6} {'errs':>5} {'gen tok/s':>10} {'tok/s':>8} {'peak run':>9} {'peak wait':>10}")
+    servers = summarize_servers(records)
+    for endpoint, s in sorted(servers.items()):
+        stats = next(stub.stats() for url, stub in stubs.items() if url.startswith(endpoint))
+        print(f"{endpoint:<40} {s['requests']:>6} {s['errors']:>5} {s['gen_tokens_per_s']:>10.1f} "
+              f"{s['throughput_tokens_per_s']:>8.1f} {stats['peak_running']:>9} {stats['peak_waiting']:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("videos", nargs="+", help="local video files, one synthetic example each")
+    parser.add_argument("--servers", type=int, default=1, help="stub servers behind an EndpointPool")
+    parser.add_argument("--concurrency", type=int, default=4, help="videos / questions in flight")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="use the asyncio pipeline")
+    parser.add_argument("--latency", default="lognormal:0.3,0.4")
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--max-num-seqs", type=int, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--overload-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep-outputs", action="store_true")
+    args = parser.parse_args()
+
+    stubs = [
+        StubServer(
+            latency=args.latency, tokens_per_second=args.tokens_per_second, max_num_seqs=args.max_num_seqs,
+            error_rate=args.error_rate, overload_rate=args.overload_rate, seed=args.seed + i,
+        )
+        for i in range(args.servers)
+    ]
+    stubs = {stub.start(): stub for stub in stubs}
+    urls = list(stubs)
+    target = urls[0] if len(urls) == 1 else EndpointPool(urls, probe_interval=None)
+
+    examples = make_examples(args.videos)
+    paths_by_qid = {ex["qid"]: path for ex, path in zip(examples, args.videos)}
+    out_paths = [OUTPUT_DIR / f"{ex['qid']}_{ex['video_id']}.json" for ex in examples]
+    out_paths += [path for ex in examples for path in CHECKPOINT_DIR.glob(f"{ex['qid']}_{ex['video_id']}.*.jsonl")]
+    for path in out_paths:
+        path.unlink(missing_ok=True)
+
+    telemetry = RecordingTelemetry()
+    start = time.perf_counter()
+    try:
+        if args.use_async:
+            answers = asyncio.run(run_async(examples, paths_by_qid, target, telemetry, args.concurrency))
+        else:
+            answers = run_sync(examples, paths_by_qid, target, telemetry, args.concurrency)
+        report(telemetry.records, time.perf_counter() - start, examples, answers, stubs)
+    finally:
+        if not args.keep_outputs:
+            for path in out_paths + list(CHECKPOINT_DIR.glob("loadtest-*.jsonl")):
+                path.unlink(missing_ok=True)
@@ -0,0 +1,81 @@
+"""
+Measure frame-annotation throughput (frames annotated per second) against a live
+vLLM endpoint for different mosaic tile sizes, i.e. how many frames are packed
+into each image slot of an annotation request.
+
+Requests bypass the response cache and the annotator runs without checkpoints and
+with fixed `--batch-size` batches, so every run sends every frame to the model.
+Requests are counted from in-memory telemetry (every attempt actually sent).
+
+Usage (from the repo root):
+    python -m src.benchmarks.mosaic_throughput videos/*.mp4 [--tiles 1 2 4 6 9] [--url http://host:port/v1/chat/completions]
+"""
+import argparse
+import time
+from pathlib import Path
+
+from src.annotator.frame_annotator import FrameAnnotator
+from src.config import ANNOTATION_FRAME_MAX_SIDE, ANNOTATION_FRAME_PIXEL_BUDGET, VLM_IMAGE_TOKEN_PIXELS, VLLM_API_URL
+from src.utils.call_mistral_model import mistral_request
+from src.utils.frame_extractor import FrameExtractor
+from src.utils.frame_mosaic import pack_mosaics
+from src.utils.frame_resize import estimate_image_tokens
+from src.utils.model_client import ModelClient
+from src.utils.telemetry import Telemetry
+
+
+def measure(video_paths, extractor: FrameExtractor, url: str, tiles_per_image: int, batch_size: int = 10) -> dict:
+    telemetry = Telemetry(path=None)
+    client = ModelClient(telemetry=telemetry)
+
+    def call_model(url, prompt, image_base64=None, stop_when=None, **options):
+        data, headers = mistral_request(prompt, image_base64, **options)
+        return client.chat(url, data, headers, stop_when)
+
+    annotator = FrameAnnotator(
+        call_model, batch_size=batch_size, vllm_url=url, tiles_per_image=tiles_per_image,
+        checkpoint=False, dynamic_batching=False,
+    )
+    frames = 0
+    annotated = 0
+    image_tokens = 0
+    start = time.perf_counter()
+    for video_path in video_paths:
+        batches = list(extractor.iter_batches(video_path, annotator.frames_per_request))
+        for batch, timestamps in batches:
+            images = pack_mosaics(batch, timestamps, tiles_per_image) if tiles_per_image > 1 else batch
+            image_tokens += sum(estimate_image_tokens(img.shape[1], img.shape[0]) for img in images)
+            frames += len(batch)
+        anns = annotator.annotate_batches(batches, "Describe the video.", "", "benchmark", Path(video_path).stem)
+        annotated += len({round(float(a.get("timestamp", -1)), 2) for a in anns})
+    elapsed = time.perf_counter() - start
+    client.close()
+    requests = int(sum(c["requests"] for c in telemetry.counters.values()))
+    return {
+        "frames": frames,
+        "annotated": annotated,
+        "requests": requests,
+        "frames_per_second": annotated / elapsed if elapsed else 0.0,
+        "image_tokens_per_frame": image_tokens / max(frames, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("videos", nargs="+")
+    parser.add_argument("--url", default=VLLM_API_URL)
+    parser.add_argument("--tiles", type=int, nargs="+", default=[1, 2, 4, 6, 9])
+    parser.add_argument("--batch-size", type=int, default=10)
+    args = parser.parse_args()
+
+    extractor = FrameExtractor(
+        max_side=ANNOTATION_FRAME_MAX_SIDE, pixel_budget=ANNOTATION_FRAME_PIXEL_BUDGET, multiple_of=VLM_IMAGE_TOKEN_PIXELS
+    )
+    results = {tiles: measure(args.videos, extractor, args.url, tiles, args.batch_size) for tiles in args.tiles}
+
+    print(f"\n{'tiles':>5} {'frames':>7} {'annotated':>10} {'requests':>9} {'frames/s':>9} {'img tok/frame':>14}")
+    for tiles, r in results.items():
+        print(
+            f"{tiles:>5} {r['frames']:>7} {r['annotated']:>10} {r['requests']:>9} "
+            f"{r['frames_per_second']:>9.2f} {r['image_tokens_per_frame']:>14.1f}"
+        )
@@ -0,0 +1,165 @@
+"""
+Prefill tokens of the Video Answering prompts (0/1/2-shot calls for every question)
+with the previous layout, where each stage put the video context at a different
+position, against the shared-prefix layout (system prompt + video context first,
+stage-specific text after it).
+
+By default the prefix cache is simulated: prompts are tokenized with the served
+model's tokenizer (chat template applied) and pass through an unbounded block-level
+prefix cache like vLLM's `--enable-prefix-caching` (16-token blocks). With `--url`,
+the prompts are sent (max_tokens=1) to a vLLM server started with
+`--enable-prefix-caching` and prefill is read from its `/metrics`.
+
+Usage (from the repo root, needs video processor outputs in OUTPUT_DIR):
+    python -m src.benchmarks.prefix_cache [--limit 50] [--question-type OE] [--url http://host:port/v1/chat/completions]
+"""
+import argparse
+import json
+import re
+import uuid
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import requests
+
+from src.config import OUTPUT_DIR, QWEN_TOKENIZER
+from src.utils.call_qwen2_model import qwen2_request
+from src.utils.model_client import ModelClient
+from src.utils.prompt_packer import PromptPacker
+from src.video_answering import VideoAnswering
+
+BLOCK_SIZE = 16
+SENSE_CHECK = "The question makes sense; the entities it asks about appear in the video."
+
+
+def legacy_prompts(question: str, context: str, sub_questions: str, q_type: str) -> list:
+    """
+    0/1/2-shot prompts as laid out before the shared prefix.
+    """
+    zero = f"""Goal: Figure out the type of question\n
+      Is the question Open-Ended or MCQ? If it is Open-Ended, answer 'OE'. If it is MCQ, answer it as 'MCQ'.\n
+      Question={question}
+      
+      Follow the following format strictly. Do not include the square brackets '[' and ']'
+      Answer=[MCQ / OE]"""
+    one = f"""Goal: Determine whether this question makes sense in the context of the video.\n
+      Context:\n{context}\n
+      Question:\n{question}\n
+      Does the question makes sense and does the question ask for exist in the video? If not, what is the most relevant entity that exists in the video instead."""
+    if q_type == "MCQ":
+        two = f"""Context:\n{context}\nMain Question:\n{question}\nSub-Questions:\n{sub_questions}\nInstructions: State your multiple-choice answer and explain in a step-by-step manner in the explanation section. Follow the format strictly when responding:\nEXPLANATION:\n[EXPLANATION]\nANSWER:\n[OPTION]\n"""
+    else:
+        two = f"""Context:\n{context}\nMain Question:\n{question}\nSense Check:{SENSE_CHECK}\nSub-Questions:\n{sub_questions}\nInstructions: First answer the sub-questions, then use your answers from the sub-questions to help you answer the main question. Explain your answers in a step by step manner in the explanation section. Follow the format strictly when responding:\nEXPLANATION:\n[EXPLANATION]\nANSWER:\n[OPEN-ENDED ANSWER]\n"""
+    return [zero, one, two] if q_type == "OE" else [zero, two]
+
+
+def shared_prefix_prompts(question: str, context: str, sub_questions: str, q_type: str) -> list:
+    zero = VideoAnswering._zero_shot_prompt(question, context)
+    one = VideoAnswering._one_shot_prompt(question, context)
+    two = VideoAnswering._two_shot_prompt(q_type, question, context, sub_questions, SENSE_CHECK)
+    return [zero, one, two] if q_type == "OE" else [zero, two]
+
+
+def load_examples(limit: int, packer: PromptPacker) -> list:
+    """
+    (video_id, question, packed context, sub-questions) per output file, grouped by video
+    so questions on the same video run back to back, as in the pipeline.
+    """
+    by_video = defaultdict(list)
+    for path in sorted(OUTPUT_DIR.glob("*.json"))[:limit]:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        question, sub_questions = data["main_question"], str(data["sub_questions"])
+        context = packer.pack_annotations(
+            data["annotations"], f"{question}\n{sub_questions}",
+            VideoAnswering._two_shot_prompt("OE", question, "", sub_questions, SENSE_CHECK),
+        )
+        by_video[data["video_id"]].append((question, context, sub_questions))
+    return [(vid, *example) for vid, examples in by_video.items() for example in examples]
+
+
+def simulate(prompts: list, tokenizer) -> dict:
+    """
+    Prompt and prefill tokens through an unbounded block-level prefix cache.
+    """
+    return simulate_ids(
+        tokenizer.apply_chat_template(qwen2_request(prompt)["messages"], tokenize=True, add_generation_prompt=True)
+        for prompt in prompts
+    )
+
+
+def simulate_ids(token_ids) -> dict:
+    """
+    `simulate` for prompts that are already tokenized, in request order.
+    """
+    cached = set()
+    requests = prompt_tokens = prefill_tokens = 0
+    for ids in token_ids:
+        requests += 1
+        parent, hit = None, True
+        for start in range(0, len(ids) - len(ids) % BLOCK_SIZE, BLOCK_SIZE):
+            parent = hash((parent, tuple(ids[start:start + BLOCK_SIZE])))
+            if hit and parent in cached:
+                prefill_tokens -= BLOCK_SIZE
+            else:
+                hit = False
+                cached.add(parent)
+        prompt_tokens += len(ids)
+        prefill_tokens += len(ids)
+    return {"requests": requests, "prompt_tokens": prompt_tokens, "prefill_tokens": prefill_tokens}
+
+
+def measure_live(prompts: list, url: str) -> dict:
+    """
+    Send `prompts` to a prefix-caching vLLM server and read prefill from its metrics.
+    A fresh marker at the start of the system prompt keeps runs from hitting each other's cache.
+    """
+    parts = urlsplit(url)
+    metrics_url = f"{parts.scheme}://{parts.netloc}/metrics"
+    marker = f"[run {uuid.uuid4().hex[:8]}]\n"
+    client = ModelClient()
+    before = _read_metrics(metrics_url)
+    for prompt in prompts:
+        payload = qwen2_request(prompt)
+        payload["messages"][0]["content"] = marker + payload["messages"][0]["content"]
+        client.chat(url, {**payload, "max_tokens": 1})
+    after = _read_metrics(metrics_url)
+    client.close()
+    prompt_tokens = after["vllm:prompt_tokens_total"] - before["vllm:prompt_tokens_total"]
+    hits = after["vllm:prefix_cache_hits_total"] - before["vllm:prefix_cache_hits_total"]
+    return {"requests": len(prompts), "prompt_tokens": int(prompt_tokens), "prefill_tokens": int(prompt_tokens - hits)}
+
+
+def _read_metrics(metrics_url: str) -> dict:
+    totals = defaultdict(float)
+    for line in requests.get(metrics_url, timeout=10).text.splitlines():
+        match = re.match(r"^(vllm:[a-z_]+)(?:\{[^}]*\})? ([0-9.e+-]+)$", line)
+        if match:
+            totals[match.group(1)] += float(match.group(2))
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limit", type=int, default=50, help="number of output files (questions) to use")
+    parser.add_argument("--question-type", choices=["OE", "MCQ"], default="OE", help="OE runs all three stages")
+    parser.add_argument("--url", help="prefix-caching vLLM endpoint; simulated when omitted")
+    args = parser.parse_args()
+
+    packer = PromptPacker(QWEN_TOKENIZER)
+    examples = load_examples(args.limit, packer)
+    if not examples:
+        raise SystemExit(f"No video processor outputs in {OUTPUT_DIR}")
+    videos = len({vid for vid, *_ in examples})
+    print(f"{len(examples)} questions on {videos} videos, {args.question_type} stages")
+
+    results = {}
+    for layout, build in (("legacy", legacy_prompts), ("shared prefix", shared_prefix_prompts)):
+        prompts = [p for _, q, context, subqs in examples for p in build(q, context, subqs, args.question_type)]
+        results[layout] = measure_live(prompts, args.url) if args.url else simulate(prompts, packer.tokenizer)
+
+    print(f"\n{'layout':<14} {'requests':>9} {'prompt tok':>11} {'prefill tok':>12}")
+    for layout, r in results.items():
+        print(f"{layout:<14} {r['requests']:>9} {r['prompt_tokens']:>11} {r['prefill_tokens']:>12}")
+    legacy, shared = results["legacy"]["prefill_tokens"], results["shared prefix"]["prefill_tokens"]
+    print(f"\nprefill tokens: {1 - shared / max(legacy, 1):.0%} fewer with the shared prefix")
@@ -0,0 +1,61 @@
+"""
+Report bytes-per-request (and image tokens / JPEG encode time) for frame annotation
+requests at native resolution versus the extraction-time target resolution.
+
+Usage (from the repo root):
+    python -m src.benchmarks.request_bytes videos/*.mp4 [--max-side 1540] [--pixel-budget 200704]
+"""
+import argparse
+import json
+import time
+
+from src.config import ANNOTATION_FRAME_MAX_SIDE, ANNOTATION_FRAME_PIXEL_BUDGET, VLM_IMAGE_TOKEN_PIXELS
+from src.utils.frame_encoder import encode_to_base64
+from src.utils.frame_extractor import FrameExtractor
+from src.utils.frame_resize import estimate_image_tokens
+
+
+def measure(video_paths, extractor: FrameExtractor, batch_size: int = 10) -> dict:
+    requests = 0
+    total_bytes = 0
+    image_tokens = 0
+    frames = 0
+    encode_seconds = 0.0
+    for video_path in video_paths:
+        for batch, _ in extractor.iter_batches(video_path, batch_size):
+            start = time.perf_counter()
+            imgs_b64 = [encode_to_base64(f) for f in batch]
+            encode_seconds += time.perf_counter() - start
+            content = [{"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}} for b64 in imgs_b64]
+            total_bytes += len(json.dumps({"messages": [{"role": "user", "content": content}]}))
+            image_tokens += sum(estimate_image_tokens(f.shape[1], f.shape[0]) for f in batch)
+            frames += len(batch)
+            requests += 1
+    return {
+        "requests": requests,
+        "bytes_per_request": total_bytes / max(requests, 1),
+        "image_tokens_per_request": image_tokens / max(requests, 1),
+        "encode_ms_per_frame": 1000 * encode_seconds / max(frames, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("videos", nargs="+")
+    parser.add_argument("--max-side", type=int, default=ANNOTATION_FRAME_MAX_SIDE)
+    parser.add_argument("--pixel-budget", type=int, default=ANNOTATION_FRAME_PIXEL_BUDGET)
+    parser.add_argument("--batch-size", type=int, default=10)
+    args = parser.parse_args()
+
+    before = measure(args.videos, FrameExtractor(), args.batch_size)
+    after = measure(
+        args.videos,
+        FrameExtractor(max_side=args.max_side, pixel_budget=args.pixel_budget, multiple_of=VLM_IMAGE_TOKEN_PIXELS),
+        args.batch_size,
+    )
+
+    print(f"\n{'':<26} {'native':>12} {'target':>12} {'ratio':>7}")
+    for key in ("bytes_per_request", "image_tokens_per_request", "encode_ms_per_frame"):
+        ratio = after[key] / before[key] if before[key] else float("nan")
+        print(f"{key:<26} {before[key]:>12.1f} {after[key]:>12.1f} {ratio:>6.2f}x")
+    print(f"{'requests':<26} {before['requests']:>12} {after['requests']:>12}")
@@ -2,6 +2,40 @@ from pathlib import Path
 
 # Settings
 FRAME_INTERVAL_SECONDS = 1/2 # seconds
+FRAME_DECODE_BACKEND = "grab" # "read" | "grab" | "seek" | "ffmpeg" (see FrameExtractor)
+FRAME_SAMPLING = "fixed" # "fixed" (every FRAME_INTERVAL_SECONDS) | "adaptive" (see AdaptiveSampler)
+ADAPTIVE_FRAMES_PER_SECOND = 1.0 # adaptive sampling: average frame budget per second of video
+ADAPTIVE_PROBE_INTERVAL_SECONDS = 1/4 # adaptive sampling: thumbnail probe rate for shot detection
+ADAPTIVE_SHOT_THRESHOLD = 6.0 # adaptive sampling: shot cut = frame diff > median + k * MAD
+VLM_IMAGE_MAX_SIDE = 1540 # Mistral-Small-3.1 vision encoder: larger images are downscaled server-side
+VLM_IMAGE_TOKEN_PIXELS = 28 # 14px patches merged 2x2 -> one image token per 28x28 pixels
+ANNOTATION_FRAME_MAX_SIDE = VLM_IMAGE_MAX_SIDE # pixels, None = native resolution
+ANNOTATION_FRAME_PIXEL_BUDGET = None # pixels per frame (e.g. 448*448), None = no budget
+EMBEDDING_FRAME_INTERVAL_SECONDS = FRAME_INTERVAL_SECONDS # seconds, CLIP embedding tier (video_vectorizer)
+EMBEDDING_FRAME_MAX_SIDE = 448 # pixels, CLIP resizes to 224 on the short side anyway
+FRAME_JPEG_QUALITY = 75 # JPEG quality of frames sent to the VLM
+FRAME_ENCODE_WORKERS = 4 # threads used to JPEG-encode a frame batch
+FRAME_DEDUP = False # collapse near-duplicate frames before annotation (see FrameDeduplicator); changes outputs
+FRAME_DEDUP_HASH_BITS = 4 # max differing dHash bits (of 64) for two frames to count as duplicates
+FRAME_DEDUP_HIST_DISTANCE = 0.1 # max grey-histogram distance (0-1) for two frames to count as duplicates
+FRAME_DEDUP_MAX_SPAN_SECONDS = 10 # re-annotate a static shot at least this often
+COARSE_TO_FINE = False # question-guided coarse-to-fine annotation for long videos (see CoarseToFineAnnotator)
+COARSE_TO_FINE_MIN_DURATION_SECONDS = 180 # videos at least this long use coarse-to-fine when enabled
+COARSE_INTERVAL_SECONDS = 4 # coarse-to-fine: first-pass sampling interval
+FINE_INTERVAL_SECONDS = FRAME_INTERVAL_SECONDS # coarse-to-fine: re-sampling interval inside top segments
+COARSE_TO_FINE_TOP_SEGMENTS = 8 # coarse-to-fine: number of coarse segments re-sampled at the fine rate
+CLIP_SERVER_URL = 'grpc://0.0.0.0:51000' # clip-as-service server (video_vectorizer, coarse-to-fine)
+ANNOTATION_TILES_PER_IMAGE = 1 # >1 packs that many frames into one labelled mosaic per image slot (see frame_mosaic)
+ANNOTATION_PARALLEL_WINDOWS = 1 # time windows annotated at once; 1 = one serial "Previous" chain over the whole video, >1 changes outputs
+ANNOTATION_WINDOW_BATCHES = 6 # annotator batches per window; window boundaries are stitched afterwards
+ANNOTATION_GUIDED_JSON = False # request schema-constrained frame annotations (vLLM response_format), text parsing as fallback; changes outputs
+ANNOTATION_COMPACT_PROMPTS = False # static annotator instructions in the system prompt, shared elements once per request (see prompt_compiler); changes outputs
+ANNOTATION_DYNAMIC_BATCHING = True # size each annotator request to MAX_MODEL_LEN from its image, prompt and output tokens (see BatchSizer)
+ANNOTATION_MAX_IMAGES_PER_REQUEST = 10 # vLLM --limit_mm_per_prompt image=N of the Mistral server
+ANNOTATION_OUTPUT_TOKENS_PER_FRAME = 150 # context tokens kept free per frame for its annotation
+ANNOTATION_CHECKPOINTS = True # journal every annotated batch to CHECKPOINT_DIR and resume from it (see AnnotationCheckpoint)
+ANNOTATION_BATCH_ATTEMPTS = 3 # attempts per annotator batch, counted across resumed runs
+USE_FRAME_STORE = True # cache encoded frames on disk across reruns (see FrameStore)
 SKIP_PROCESSED_VIDEOS = False
 
 # Outputs Directory
@@ -16,10 +50,17 @@ SUBMISSION_DIR.mkdir(exist_ok=True)
 ERROR_DIR = Path("error")
 ERROR_DIR.mkdir(exist_ok=True)
 
+# Per-batch annotation journals of unfinished videos
+CHECKPOINT_DIR = Path("checkpoints")
+
 # YouTube Downloads Directory
 VIDEO_DOWNLOAD_DIR = Path("videos")
 VIDEO_DOWNLOAD_DIR.mkdir(exist_ok=True)
 
+# Encoded Frame Store Directory
+FRAME_STORE_DIR = Path("frame_store")
+FRAME_STORE_MAX_MB = 20 * 1024 # least recently used videos are evicted beyond this, None = unbounded
+
 # VLLM Settings
 USE_GH200 = False
 VLLM_API_URL = "http://198.145.126.237:27004/v1/chat/completions"
@@ -34,4 +75,50 @@ VLLM_API_URL_6 = "http://198.145.126.233:22370/v1/chat/completions" # x2 ssh -i
 VLLM_API_URL_7 = "http://198.145.126.235:24425/v1/chat/completions" # ssh -i ~/.ssh/id_rsa -p 25293 root@198.145.126.235
 VLLM_API_URL_8 = "http://198.145.126.239:40157/v1/chat/completions" # ssh -i ~/.ssh/id_rsa -p 40059 root@198.145.126.239
 VLLM_API_URL_9 = "http://198.145.126.236:25429/v1/chat/completions" # ssh -i ~/.ssh/id_rsa -p 20794 root@198.145.126.236
-VLLM_API_URL_4 = "http://198.145.126.232:31242/v1/chat/completions" #2 ssh -i ~/.ssh/id_rsa -p 39300 root@198.145.126.232
\ No newline at end of file
+VLLM_API_URL_4 = "http://198.145.126.232:31242/v1/chat/completions" #2 ssh -i ~/.ssh/id_rsa -p 39300 root@198.145.126.232
+
+# Endpoint Pool Settings (see EndpointPool): (url, weight), weight ~ relative capacity
+VLLM_ENDPOINTS = [
+    (VLLM_API_URL_1, 1), (VLLM_API_URL_2, 1), (VLLM_API_URL_3, 2), (VLLM_API_URL_4, 1), (VLLM_API_URL_5, 1),
+    (VLLM_API_URL_6, 2), (VLLM_API_URL_7, 1), (VLLM_API_URL_8, 1), (VLLM_API_URL_9, 1),
+]
+QWEN_ENDPOINTS = [(QWEN_GH200_API_URL, 1)] # answering (Qwen) servers pooled by get_qwen_pool(), same format
+ENDPOINT_PROBE_INTERVAL_SECONDS = 15 # GET /v1/models on every endpoint this often
+ENDPOINT_PROBE_TIMEOUT_SECONDS = 3
+ENDPOINT_EJECT_AFTER_FAILURES = 3 # consecutive failed requests before an endpoint is taken out of rotation
+
+# Model Client Settings (see model_client)
+MODEL_CONNECT_TIMEOUT_SECONDS = 5
+MODEL_READ_TIMEOUT_SECONDS = 300 # long multi-image annotation requests
+MODEL_MAX_RETRIES = 4 # retries on 5xx / connection errors / timeouts
+MODEL_BACKOFF_BASE_SECONDS = 0.5 # first retry waits up to this long, doubling each retry
+MODEL_BACKOFF_MAX_SECONDS = 30
+MODEL_POOL_CONNECTIONS = 16 # keep-alive connections kept open per endpoint
+MODEL_MAX_CONCURRENCY_PER_ENDPOINT = 10 # starting in-flight limit per endpoint (vLLM --max-num-seqs), adapted by ConcurrencyLimiter
+MODEL_LIMIT_MIN = 1 # adaptive concurrency: never go below this many in-flight requests per endpoint
+MODEL_LIMIT_MAX = 64 # adaptive concurrency: never go above this
+MODEL_LIMIT_WINDOW = 20 # adaptive concurrency: completed requests per latency window
+MODEL_LIMIT_LATENCY_TOLERANCE = 1.5 # adaptive concurrency: back off when window p95 > this x baseline p95
+MODEL_LIMIT_BACKOFF = 0.7 # adaptive concurrency: multiplicative decrease factor
+
+# Response Cache Settings (see ResponseCache)
+RESPONSE_CACHE_MODE = "off" # "off" | "readwrite" | "replay" (serve cached responses only, never call the model)
+RESPONSE_CACHE_PATH = Path("cache/responses.sqlite")
+RESPONSE_CACHE_TTL_SECONDS = 30 * 24 * 3600 # None = never expire
+RESPONSE_CACHE_MAX_MB = 1024 # least recently used responses are evicted beyond this, None = unbounded
+
+# Prompt Packing Settings (see PromptPacker)
+MAX_MODEL_LEN = 12000 # vLLM --max-model-len of the Mistral and Qwen servers
+PROMPT_OUTPUT_RESERVE_TOKENS = 1024 # context tokens kept free for the model's answer
+PROMPT_TEMPLATE_OVERHEAD_TOKENS = 300 # system prompt + chat template tokens added around the user prompt
+MISTRAL_TOKENIZER = "mistralai/Mistral-Small-3.1-24B-Instruct-2503" # HF repo or local path of the served model's tokenizer
+QWEN_TOKENIZER = "Qwen/Qwen2.5-72B-Instruct-GPTQ-Int4"
+ANSWER_SENSE_CHECK_RESERVE_TOKENS = 512 # video answering: one-shot sense check kept to this many tokens in the two-shot prompt
+
+# Telemetry Settings (see Telemetry)
+TELEMETRY_PATH = Path("logs/model_calls.jsonl") # one JSON line per model request, None = off
+TELEMETRY_MAX_MB = 50 # rotate the JSONL file beyond this
+TELEMETRY_BACKUPS = 5 # rotated files kept (model_calls.jsonl.1, .2, ...)
+TELEMETRY_PROMETHEUS_PORT = None # e.g. 9400 to serve counters at http://host:9400/metrics
+TELEMETRY_PROMPT_PRICE_PER_1K = 0.0002 # cost per 1k prompt tokens for the per-qid cost report (GPU $/h / measured tokens/h)
+TELEMETRY_COMPLETION_PRICE_PER_1K = 0.0008 # cost per 1k completion tokens
@@ -0,0 +1,110 @@
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+from src.config import ADAPTIVE_FRAMES_PER_SECOND, ADAPTIVE_PROBE_INTERVAL_SECONDS, ADAPTIVE_SHOT_THRESHOLD
+
+
+class AdaptiveSampler:
+    """
+    Plan per-video sample timestamps from cheap frame-difference statistics instead
+    of a fixed interval.
+
+    1. Probe the video every `probe_interval_seconds` at thumbnail size (32x18 grey).
+    2. Mark a shot boundary wherever the mean absolute difference between consecutive
+       probes is an outlier (> median + `shot_threshold` * MAD).
+    3. Split a budget of `frames_per_second` * duration frames across shots, in
+       proportion to shot length x motion energy (mean probe difference inside the
+       shot), with at least one frame per shot.
+    4. Spread each shot's frames evenly across it.
+
+    Static scenes get few frames, fast action and short shots get more.
+    """
+    THUMB_SIZE = (32, 18)
+
+    def __init__(
+        self,
+        frames_per_second: float = ADAPTIVE_FRAMES_PER_SECOND,
+        probe_interval_seconds: float = ADAPTIVE_PROBE_INTERVAL_SECONDS,
+        shot_threshold: float = ADAPTIVE_SHOT_THRESHOLD,
+    ):
+        self.frames_per_second = frames_per_second
+        self.probe_interval_seconds = probe_interval_seconds
+        self.shot_threshold = shot_threshold
+
+    @property
+    def key(self) -> str:
+        return f"adaptive:{self.frames_per_second}:{self.probe_interval_seconds}:{self.shot_threshold}"
+
+    def plan(self, video_path: str) -> List[float]:
+        """
+        Sorted timestamps (seconds) to sample from `video_path`.
+        """
+        probe_ts, thumbs = self._probe(video_path)
+        if len(probe_ts) < 2:
+            return probe_ts
+
+        diffs = np.abs(np.diff(thumbs, axis=0)).mean(axis=(1, 2)) / 255.0  # (n-1,)
+        shots = self._shots(probe_ts, diffs)
+        duration = probe_ts[-1] + self.probe_interval_seconds
+        budget = max(len(shots), int(round(duration * self.frames_per_second)))
+        counts = self._allocate(shots, budget)
+
+        timestamps = []
+        for (start, end, _), n in zip(shots, counts):
+            step = (end - start) / n
+            timestamps.extend(start + (i + 0.5) * step for i in range(n))
+        print(f"\t🎬 Adaptive sampling: {len(shots)} shots, {len(timestamps)} frames over {duration:.1f}s")
+        return timestamps
+
+    def _probe(self, video_path: str) -> Tuple[List[float], np.ndarray]:
+        cap = cv2.VideoCapture(video_path)
+        step = max(1, int(cap.get(cv2.CAP_PROP_FPS) * self.probe_interval_seconds))
+        probe_ts, thumbs = [], []
+        try:
+            frame_id = 0
+            while cap.grab():
+                if frame_id % step == 0:
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        break
+                    probe_ts.append(cap.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+                    grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                    thumbs.append(cv2.resize(grey, self.THUMB_SIZE, interpolation=cv2.INTER_AREA))
+                frame_id += 1
+        finally:
+            cap.release()
+        return probe_ts, np.asarray(thumbs, dtype=np.float32)
+
+    def _shots(self, probe_ts: List[float], diffs: np.ndarray) -> List[Tuple[float, float, float]]:
+        """
+        (start, end, motion_energy) per shot.
+        """
+        median = np.median(diffs)
+        mad = np.median(np.abs(diffs - median)) + 1e-6
+        cuts = np.flatnonzero(diffs > median + self.shot_threshold * mad) + 1  # probe index starting a new shot
+
+        end_ts = probe_ts[-1] + self.probe_interval_seconds
+        bounds = [0, *cuts.tolist(), len(probe_ts)]
+        shots = []
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            inner = diffs[a:b - 1]  # differences within the shot, excluding the cut itself
+            motion = float(inner.mean()) if len(inner) else 0.0
+            start = probe_ts[a]
+            end = probe_ts[b] if b < len(probe_ts) else end_ts
+            shots.append((start, end, motion))
+        return shots
+
+    @staticmethod
+    def _allocate(shots: List[Tuple[float, float, float]], budget: int) -> List[int]:
+        """
+        One frame per shot, then the rest proportional to length x motion (largest remainder).
+        """
+        weights = np.array([(end - start) * (motion + 1e-3) for start, end, motion in shots])
+        spare = budget - len(shots)
+        share = spare * weights / weights.sum()
+        counts = np.floor(share).astype(int)
+        leftover = spare - counts.sum()
+        counts[np.argsort(share - counts)[::-1][:leftover]] += 1
+        return (counts + 1).tolist()
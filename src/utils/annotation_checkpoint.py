@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from src.config import CHECKPOINT_DIR
+
+
+class AnnotationCheckpoint:
+    """
+    Append-only journal of the annotator batches of one (qid, vid, stage), so an
+    interrupted or partly failed run resumes where it stopped.
+
+    One JSON line per event, keyed by the batch's frame timestamps:
+    - {"config": {...}} first: the batching settings the batches were built with
+    - {"batch": [...], "annotations": [...]} once a batch is annotated
+    - {"batch": [...], "error": "..."} for every failed attempt
+
+    Batch keys only match when batches are built the same way, so a journal written
+    with a different `config` (batch size, dedup, dynamic batching, ...) is discarded
+    on open.
+
+    Lines are flushed to disk as they are written; a truncated last line (a crash
+    mid-write) is ignored on load. Safe to share between threads: every read and
+    write holds a lock.
+    """
+    def __init__(self, path: Path, config: Optional[dict] = None):
+        self.path = Path(path)
+        self.config = config or {}
+        self.done: Dict[tuple, List[dict]] = {}
+        self.failures: Dict[tuple, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        if self.path.exists():
+            self._load()
+
+    @classmethod
+    def open(cls, qid: str, vid: str, stage: str, config: Optional[dict] = None) -> "AnnotationCheckpoint":
+        return cls(CHECKPOINT_DIR / f"{qid}_{vid}.{stage}.jsonl", config)
+
+    @staticmethod
+    def key(timestamps: Iterable) -> tuple:
+        return tuple(round(float(t), 3) for t in timestamps)
+
+    def get(self, timestamps: Iterable) -> Optional[List[dict]]:
+        """
+        Annotations journaled for the batch with these timestamps, or None.
+        """
+        key = self.key(timestamps)
+        with self._lock:
+            return self.done.get(key)
+
+    def failed_attempts(self, timestamps: Iterable) -> int:
+        key = self.key(timestamps)
+        with self._lock:
+            return self.failures.get(key, 0)
+
+    def batches_done(self) -> int:
+        with self._lock:
+            return len(self.done)
+
+    def retryable(self, max_attempts: int) -> int:
+        """
+        Batches that failed and have attempts left, i.e. that a rerun would request again.
+        """
+        with self._lock:
+            return sum(1 for key, n in self.failures.items() if key not in self.done and n < max_attempts)
+
+    def missing(self) -> int:
+        """
+        Batches that failed and were never annotated, whether or not attempts are left.
+        """
+        with self._lock:
+            return sum(1 for key in self.failures if key not in self.done)
+
+    def record(self, timestamps: Iterable, annotations: List[dict]):
+        key = self.key(timestamps)
+        with self._lock:
+            self.done[key] = annotations
+            self._append({"batch": list(key), "annotations": annotations})
+
+    def record_failure(self, timestamps: Iterable, error: Exception):
+        key = self.key(timestamps)
+        with self._lock:
+            self.failures[key] += 1
+            self._append({"batch": list(key), "error": str(error)})
+
+    def clear(self):
+        """
+        Drop the journal once the result it fed into has been saved.
+        """
+        with self._lock:
+            self.path.unlink(missing_ok=True)
+            self.done.clear()
+            self.failures.clear()
+
+    def _append(self, entry: dict):
+        """
+        Write one journal line, after the config header if the file is new (call with the lock held).
+        """
+        lines = [json.dumps(entry) + "\n"]
+        if not self.path.exists():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            lines.insert(0, json.dumps({"config": self.config}) + "\n")
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _load(self):
+        config = None  # journals written before the header existed have none
+        with open(self.path, "r", encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                try:
+                    entry = json.loads(line)
+                    if i == 0 and "config" in entry:
+                        config = entry["config"]
+                        continue
+                    key = self.key(entry["batch"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if "annotations" in entry:
+                    self.done[key] = entry["annotations"]
+                else:
+                    self.failures[key] += 1
+        if self.done or self.failures:
+            if config != self.config:
+                print(f"\t🧹 Discarding {self.path}: batches were built with {config}, now {self.config}")
+                self.path.unlink(missing_ok=True)
+                self.done.clear()
+                self.failures.clear()
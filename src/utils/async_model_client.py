@@ -0,0 +1,247 @@
+import asyncio
+import random
+import time
+import weakref
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, TypeVar, Union
+
+import aiohttp
+
+from src.config import MODEL_CONNECT_TIMEOUT_SECONDS, MODEL_READ_TIMEOUT_SECONDS, MODEL_MAX_RETRIES, \
+    MODEL_BACKOFF_BASE_SECONDS, MODEL_BACKOFF_MAX_SECONDS, MODEL_MAX_CONCURRENCY_PER_ENDPOINT
+from src.utils.concurrency_limiter import AsyncConcurrencyLimiter
+from src.utils.endpoint_pool import EndpointPool
+from src.utils.response_cache import ResponseCache, get_response_cache
+from src.utils.telemetry import Telemetry, get_telemetry
+from src.utils.model_client import ModelConnectionError, ModelHTTPError, ModelResponseError, OVERLOAD_STATUSES, \
+    _SSE_DONE, _delta, _emit_record, _endpoint, _parse_sse, _percentiles, _record_usage, _start_record
+
+T = TypeVar("T")
+
+
+class AsyncModelClient:
+    """
+    asyncio counterpart of `ModelClient` (same retries, timeouts and typed errors).
+
+    Requests to one endpoint are capped by an adaptive in-flight limit
+    (`AsyncConcurrencyLimiter`, starting at `max_concurrency`), so callers can fire
+    many requests at once and let the client queue them per server.
+
+    A client is bound to the event loop it is first used on; use `get_async_client()`
+    inside a coroutine and `close_async_client()` before the loop ends.
+    """
+    def __init__(
+        self,
+        max_concurrency: int = MODEL_MAX_CONCURRENCY_PER_ENDPOINT,
+        connect_timeout: float = MODEL_CONNECT_TIMEOUT_SECONDS,
+        read_timeout: float = MODEL_READ_TIMEOUT_SECONDS,
+        max_retries: int = MODEL_MAX_RETRIES,
+        backoff_base: float = MODEL_BACKOFF_BASE_SECONDS,
+        backoff_max: float = MODEL_BACKOFF_MAX_SECONDS,
+        cache: Optional[ResponseCache] = None,
+        telemetry: Optional[Telemetry] = None,
+    ):
+        self.cache = cache
+        self.telemetry = telemetry
+        self.max_concurrency = max_concurrency
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._limiters: Dict[str, AsyncConcurrencyLimiter] = {}
+        self._ttfts: Dict[str, deque] = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def limiter(self, url: str) -> AsyncConcurrencyLimiter:
+        endpoint = _endpoint(url)
+        if endpoint not in self._limiters:
+            self._limiters[endpoint] = AsyncConcurrencyLimiter(initial=self.max_concurrency)
+        return self._limiters[endpoint]
+
+    def limiter_stats(self) -> Dict[str, dict]:
+        return {endpoint: limiter.stats() for endpoint, limiter in self._limiters.items()}
+
+    async def post_json(self, url: Union[str, EndpointPool], payload: dict, headers: Optional[dict] = None) -> dict:
+        async def read(response: aiohttp.ClientResponse, url: str, record: dict) -> dict:
+            try:
+                body = await response.json(content_type=None)
+            except ValueError as e:
+                raise ModelResponseError(f"Invalid JSON body: {e}", url) from e
+            _record_usage(record, body.get("usage") if isinstance(body, dict) else None)
+            return body
+
+        return await self._with_retries(url, lambda u: self._send(u, payload, headers, read))
+
+    async def stream_chat(
+        self,
+        url: Union[str, EndpointPool],
+        payload: dict,
+        headers: Optional[dict] = None,
+        stop_when: Optional[Callable[[str], bool]] = None,
+    ) -> str:
+        """
+        Streamed chat completion, closing the connection (vLLM aborts the request) as soon
+        as `stop_when(text_so_far)` is True. See `ModelClient.stream_chat`.
+        """
+        payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+
+        async def read(response: aiohttp.ClientResponse, url: str, record: dict) -> str:
+            text = ""
+            chunks = 0
+            async for line in response.content:
+                chunk = _parse_sse(line.strip(), url)
+                if chunk is None:
+                    continue
+                if chunk is _SSE_DONE:
+                    break
+                _record_usage(record, chunk.get("usage"))
+                delta = _delta(chunk)
+                if not delta:
+                    continue
+                if not text:
+                    record["ttft"] = time.monotonic() - record["sent"]
+                    self._ttfts.setdefault(_endpoint(url), deque(maxlen=200)).append(record["ttft"])
+                text += delta
+                chunks += 1
+                if stop_when is not None and stop_when(text):
+                    response.close()
+                    break
+            if record["completion_tokens"] is None:
+                record["completion_tokens"] = chunks
+            return text
+
+        return await self._with_retries(url, lambda u: self._send(u, payload, headers, read))
+
+    async def chat(
+        self,
+        url: Union[str, EndpointPool],
+        payload: dict,
+        headers: Optional[dict] = None,
+        stop_when: Optional[Callable[[str], bool]] = None,
+    ) -> str:
+        if self.cache is not None:
+            return await self.cache.afetch(
+                {**payload, "stream": True} if stop_when else payload,
+                lambda: self._chat(url, payload, headers, stop_when),
+            )
+        return await self._chat(url, payload, headers, stop_when)
+
+    def ttft_stats(self) -> Dict[str, dict]:
+        return {endpoint: _percentiles(list(values)) for endpoint, values in self._ttfts.items()}
+
+    async def _chat(self, url, payload: dict, headers: Optional[dict], stop_when) -> str:
+        if stop_when is not None:
+            return await self.stream_chat(url, payload, headers, stop_when)
+        body = await self.post_json(url, payload, headers)
+        try:
+            return body["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError) as e:
+            raise ModelResponseError(f"Unexpected chat completion body: {str(body)[:200]}", url) from e
+
+    async def _with_retries(self, target: Union[str, EndpointPool], attempt_fn: Callable[[str], Awaitable[T]]) -> T:
+        if self._session is None:
+            # Connections are capped per endpoint by the semaphores, not by the connector.
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=0, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        attempt = 0
+        while True:
+            url = target.acquire() if isinstance(target, EndpointPool) else target
+            endpoint_ok = True
+            try:
+                return await attempt_fn(url)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                endpoint_ok = False
+                error = ModelConnectionError(f"{type(e).__name__}: {e}", url)
+                error.__cause__ = e
+            except ModelHTTPError as e:
+                if not e.retryable:
+                    raise
+                endpoint_ok = False
+                error = e
+            finally:
+                if isinstance(target, EndpointPool):
+                    target.release(url, endpoint_ok)
+
+            if attempt >= self.max_retries:
+                raise error
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+            print(f"\t⚠️ {error} — retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _send(self, url: str, payload: dict, headers: Optional[dict], read: Callable):
+        record = _start_record(self.telemetry, url, payload, payload.get("stream", False))
+        async with self.limiter(url).slot() as slot:
+            record["sent"] = time.monotonic()
+            try:
+                async with self._session.post(url, json=payload, headers=headers) as response:
+                    record["status"] = response.status
+                    slot.overloaded = response.status in OVERLOAD_STATUSES
+                    if response.status >= 400:
+                        raise ModelHTTPError(response.status, await response.text(), url)
+                    return await read(response, url, record)
+            except asyncio.TimeoutError as e:
+                slot.overloaded = True
+                record["error"] = f"TimeoutError: {e}"
+                raise
+            except aiohttp.ClientConnectionError as e:
+                slot.dropped = True
+                record["error"] = f"{type(e).__name__}: {e}"[:300]
+                raise
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"[:300]
+                raise
+            finally:
+                _emit_record(self.telemetry, record)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncModelClient]" = weakref.WeakKeyDictionary()
+
+
+def get_async_client() -> AsyncModelClient:
+    """
+    Shared client for the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _CLIENTS.get(loop)
+    if client is None:
+        client = _CLIENTS[loop] = AsyncModelClient(cache=get_response_cache(), telemetry=get_telemetry())
+    return client
+
+
+async def close_async_client():
+    client = _CLIENTS.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+
+async def achat_completion(
+    url: Union[str, EndpointPool],
+    payload: dict,
+    headers: Optional[dict] = None,
+    stop_when: Optional[Callable[[str], bool]] = None,
+) -> str:
+    return await get_async_client().chat(url, payload, headers, stop_when)
+
+
+def run_async(coro):
+    """
+    `asyncio.run(coro)`, closing the loop's shared client afterwards.
+    """
+    async def main():
+        try:
+            return await coro
+        finally:
+            await close_async_client()
+    return asyncio.run(main())
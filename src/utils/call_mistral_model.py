@@ -1,10 +1,11 @@
-import json
 from datetime import datetime, timedelta
 
-import requests
 from huggingface_hub import hf_hub_download
 
 from src.config import VLLM_API_URL
+from src.utils.frame_encoder import to_data_uri
+from src.utils.model_client import chat_completion
+from src.utils.async_model_client import achat_completion
 
 
 def __load_system_prompt(repo_id: str, filename: str, useDefault: bool = False) -> str:
@@ -34,14 +35,16 @@ You cannot read nor transcribe audio files or videos.
 """
         return system_prompt
 
-def __buildMessages(model, prompt, image_base64_list: list):
+def __buildMessages(model, prompt, image_base64_list: list, system_prompt=None):
     SYSTEM_PROMPT = __load_system_prompt(model, "SYSTEM_PROMPT.txt", useDefault=False)
+    if system_prompt:
+        SYSTEM_PROMPT += f"\n# TASK INSTRUCTIONS\n\n{system_prompt}\n" # static per stage, so it stays in the prefix cache
     if image_base64_list:
         content = [
             { "type": "text", "text": prompt }
         ]
         for image_base64 in image_base64_list:
-            content.append({ "type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_base64}"} })
+            content.append({ "type": "image_url", "image_url": {"url": to_data_uri(image_base64)} })
     else:
         content = [{ "type": "text", "text": prompt }]
 
@@ -51,20 +54,39 @@ def __buildMessages(model, prompt, image_base64_list: list):
         ]
     return messages
 
-def call_mistral_vllm(url: str, prompt, image_base64=None):
-    try:
-        model = "mistralai/Mistral-Small-3.1-24B-Instruct-2503"
-        messages = __buildMessages(model, prompt, image_base64)
-
-        data = { "model": model, "messages": messages, "temperature": 0.15 } # If want to limit response: "max_tokens": 128
-        headers = { "Content-Type": "application/json", "Authorization": "Bearer token" }
-        print('posting to url:', url)
-        response = requests.post(
-            url,
-            headers=headers,
-            data=json.dumps(data)
-        )
-        return response.json()["choices"][0]["message"]["content"]
-    except Exception as e:
-        print(f"❌ Error calling vLLM server: {e}")
-        return "ERROR"
\ No newline at end of file
+def __buildRequest(prompt, image_base64=None, response_format=None, seed=None, system_prompt=None):
+    model = "mistralai/Mistral-Small-3.1-24B-Instruct-2503"
+    messages = __buildMessages(model, prompt, image_base64, system_prompt)
+
+    data = { "model": model, "messages": messages, "temperature": 0.15 } # If want to limit response: "max_tokens": 128
+    if response_format:
+        data["response_format"] = response_format # vLLM structured output (json_schema)
+    if seed is not None:
+        data["seed"] = seed # e.g. a fresh sample (and cache key) when retrying a batch
+    headers = { "Authorization": "Bearer token" }
+    return data, headers
+
+def mistral_request(prompt, image_base64=None, response_format=None, seed=None, system_prompt=None):
+    """
+    (payload, headers) `call_mistral_vllm` sends for `prompt` (e.g. for benchmarks).
+    """
+    return __buildRequest(prompt, image_base64, response_format, seed, system_prompt)
+
+def call_mistral_vllm(url, prompt, image_base64=None, stop_when=None, response_format=None, seed=None, system_prompt=None):
+    """
+    `url` is an endpoint URL or an `EndpointPool`.
+    Raises `ModelClientError` (see model_client) once retries are exhausted.
+    With `stop_when(text)`, the answer is streamed and generation stops once it returns True.
+    `response_format` (e.g. {"type": "json_schema", ...}) constrains the output to a schema.
+    `system_prompt` is appended to the system message (static stage instructions).
+    """
+    data, headers = __buildRequest(prompt, image_base64, response_format, seed, system_prompt)
+    print('posting to url:', url)
+    return chat_completion(url, data, headers, stop_when)
+
+async def acall_mistral_vllm(url, prompt, image_base64=None, stop_when=None, response_format=None, seed=None, system_prompt=None):
+    """
+    Async `call_mistral_vllm`; concurrent calls are capped per endpoint (see async_model_client).
+    """
+    data, headers = __buildRequest(prompt, image_base64, response_format, seed, system_prompt)
+    return await achat_completion(url, data, headers, stop_when)
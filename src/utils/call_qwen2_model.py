@@ -1,7 +1,7 @@
-import json
-import requests
-
 from src.config import QWEN_GH200_API_URL
+from src.utils.model_client import chat_completion
+from src.utils.async_model_client import achat_completion
+from src.utils.endpoint_pool import get_qwen_pool
 
 
 def __load_qwen2_system_prompt():
@@ -24,27 +24,50 @@ def __buildQwen2Messages(prompt: str) -> list:
     return messages
 
 
-def call_qwen2_model(prompt: str):
-    try:
-        model = "Qwen/Qwen2.5-72B-Instruct-GPTQ-Int4"
-        messages = __buildQwen2Messages(prompt)
-
-        data = {
-            "model": model,
-            # "prompt": messages[0]['content'] + messages[1]['content']
-            "messages": messages,
-            "temperature": 0.2,
-            # "max_tokens": 1024
-        }
-
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        print("\tMaking request to GH200")
-        response = requests.post(QWEN_GH200_API_URL, headers=headers, data=json.dumps(data))
-        return response.json()["choices"][0]["message"]["content"]
-
-    except Exception as e:
-        print(f"❌ Error calling Qwen2 GH200 server: {e}")
-        return "ERROR"
+def __buildQwen2Request(prompt: str) -> dict:
+    model = "Qwen/Qwen2.5-72B-Instruct-GPTQ-Int4"
+    messages = __buildQwen2Messages(prompt)
+
+    return {
+        "model": model,
+        # "prompt": messages[0]['content'] + messages[1]['content']
+        "messages": messages,
+        "temperature": 0.2,
+        # "max_tokens": 1024
+    }
+
+
+def qwen2_request(prompt: str) -> dict:
+    """
+    Request body `call_qwen2_model` sends for `prompt` (e.g. for benchmarks).
+    """
+    return __buildQwen2Request(prompt)
+
+
+def call_qwen2_model(prompt: str, stop_when=None, url=None):
+    """
+    `url` is an endpoint URL or an `EndpointPool` (e.g. `get_qwen_pool()`), QWEN_GH200_API_URL by default.
+    Raises `ModelClientError` (see model_client) once retries are exhausted.
+    With `stop_when(text)`, the answer is streamed and generation stops once it returns True.
+    """
+    print("\tMaking request to GH200")
+    return chat_completion(url or QWEN_GH200_API_URL, __buildQwen2Request(prompt), stop_when=stop_when)
+
+
+async def acall_qwen2_model(prompt: str, stop_when=None, url=None):
+    """
+    Async `call_qwen2_model`; concurrent calls are capped per endpoint (see async_model_client).
+    """
+    return await achat_completion(url or QWEN_GH200_API_URL, __buildQwen2Request(prompt), stop_when=stop_when)
+
+
+def call_qwen2_pooled(prompt: str, stop_when=None):
+    """
+    `call_qwen2_model` routed over `QWEN_ENDPOINTS` (a module-level function, so it
+    pickles into worker processes, which each open their own pool).
+    """
+    return call_qwen2_model(prompt, stop_when=stop_when, url=get_qwen_pool())
+
+
+async def acall_qwen2_pooled(prompt: str, stop_when=None):
+    return await acall_qwen2_model(prompt, stop_when=stop_when, url=get_qwen_pool())
@@ -0,0 +1,181 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+import numpy as np
+
+from src.config import MODEL_MAX_CONCURRENCY_PER_ENDPOINT, MODEL_LIMIT_MIN, MODEL_LIMIT_MAX, MODEL_LIMIT_WINDOW, \
+    MODEL_LIMIT_LATENCY_TOLERANCE, MODEL_LIMIT_BACKOFF
+
+
+class AdaptiveLimit:
+    """
+    AIMD in-flight request limit for one endpoint.
+
+    Every `window` completed requests the window's p95 latency is compared with a
+    baseline (the smoothed p95 of healthy windows):
+
+    - p95 within `tolerance` x baseline and callers had to wait for a slot → limit + 1
+    - p95 above `tolerance` x baseline → limit x `backoff`
+    - an overload signal (429, 503, timeout) → limit x `backoff` immediately, at most
+      once per p95 latency so one burst of errors does not collapse the limit.
+
+    Thread-safe; `ConcurrencyLimiter` and `AsyncConcurrencyLimiter` add the waiting.
+    """
+    def __init__(
+        self,
+        initial: int = MODEL_MAX_CONCURRENCY_PER_ENDPOINT,
+        min_limit: int = MODEL_LIMIT_MIN,
+        max_limit: int = MODEL_LIMIT_MAX,
+        window: int = MODEL_LIMIT_WINDOW,
+        tolerance: float = MODEL_LIMIT_LATENCY_TOLERANCE,
+        backoff: float = MODEL_LIMIT_BACKOFF,
+    ):
+        self.limit = max(min_limit, min(initial, max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.window = window
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.in_flight = 0
+        self.waiting = 0
+        self.baseline_p95: Optional[float] = None
+        self.latencies = deque(maxlen=200)  # recent latencies, for stats
+        self.queue_waits = deque(maxlen=200)
+        self.increases = 0
+        self.decreases = 0
+        self._window = []
+        self._saturated = False
+        self._last_decrease = 0.0
+        self._state_lock = threading.Lock()
+
+    def record(self, latency: float, overloaded: bool = False):
+        """
+        Feed one completed request: its latency and whether the server signalled overload.
+        """
+        with self._state_lock:
+            now = time.monotonic()
+            if overloaded:
+                if now - self._last_decrease > (self.baseline_p95 or 1.0):
+                    self._decrease(now, "overload")
+                return
+            self.latencies.append(latency)
+            self._window.append(latency)
+            if len(self._window) < self.window:
+                return
+
+            p95 = float(np.percentile(self._window, 95))
+            saturated = self._saturated or self.waiting > 0
+            self._window = []
+            self._saturated = False
+            if self.baseline_p95 is None:
+                self.baseline_p95 = p95
+            elif p95 > self.tolerance * self.baseline_p95:
+                self._decrease(now, f"p95 {p95:.2f}s > {self.tolerance} x {self.baseline_p95:.2f}s")
+                return
+            else:
+                self.baseline_p95 = min(p95, 0.9 * self.baseline_p95 + 0.1 * p95)
+            if saturated and self.limit < self.max_limit:
+                self.limit += 1
+                self.increases += 1
+
+    def stats(self) -> dict:
+        with self._state_lock:
+            latencies = np.asarray(self.latencies) if self.latencies else np.zeros(1)
+            waits = np.asarray(self.queue_waits) if self.queue_waits else np.zeros(1)
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "latency_p50": float(np.percentile(latencies, 50)),
+                "latency_p95": float(np.percentile(latencies, 95)),
+                "baseline_p95": self.baseline_p95,
+                "queue_wait_p95": float(np.percentile(waits, 95)),
+                "increases": self.increases,
+                "decreases": self.decreases,
+            }
+
+    def _decrease(self, now: float, reason: str):
+        new_limit = max(self.min_limit, int(self.limit * self.backoff))
+        if new_limit < self.limit:
+            print(f"\t🚦 Concurrency limit {self.limit} → {new_limit} ({reason})")
+            self.limit = new_limit
+            self.decreases += 1
+        self._last_decrease = now
+        self._window = []
+        self._saturated = False
+
+
+class ConcurrencyLimiter(AdaptiveLimit):
+    """
+    Blocking (thread) limiter: `with limiter.slot() as slot: ...; slot.overloaded = True`.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        queued = time.monotonic()
+        with self._cond:
+            if self.in_flight >= self.limit:
+                self._saturated = True
+                self.waiting += 1
+                self._cond.wait_for(lambda: self.in_flight < self.limit)
+                self.waiting -= 1
+            self.in_flight += 1
+        start = time.monotonic()
+        self.queue_waits.append(start - queued)
+        outcome = _Outcome()
+        try:
+            yield outcome
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify(max(1, self.limit - self.in_flight))  # the limit may have grown
+            if not outcome.dropped:
+                self.record(time.monotonic() - start, outcome.overloaded)
+
+
+class AsyncConcurrencyLimiter(AdaptiveLimit):
+    """
+    asyncio limiter: `async with limiter.slot() as slot: ...`. Bound to one event loop.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cond = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self):
+        queued = time.monotonic()
+        async with self._cond:
+            if self.in_flight >= self.limit:
+                self._saturated = True
+                self.waiting += 1
+                await self._cond.wait_for(lambda: self.in_flight < self.limit)
+                self.waiting -= 1
+            self.in_flight += 1
+        start = time.monotonic()
+        self.queue_waits.append(start - queued)
+        outcome = _Outcome()
+        try:
+            yield outcome
+        finally:
+            async with self._cond:
+                self.in_flight -= 1
+                self._cond.notify(max(1, self.limit - self.in_flight))  # the limit may have grown
+            if not outcome.dropped:
+                self.record(time.monotonic() - start, outcome.overloaded)
+
+
+class _Outcome:
+    """
+    Set by the caller inside a slot: `overloaded` for 429/503/timeouts, `dropped` for
+    failures that say nothing about server load (e.g. connection refused).
+    """
+    def __init__(self):
+        self.overloaded = False
+        self.dropped = False
@@ -0,0 +1,178 @@
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+
+from src.config import ENDPOINT_PROBE_INTERVAL_SECONDS, ENDPOINT_PROBE_TIMEOUT_SECONDS, ENDPOINT_EJECT_AFTER_FAILURES, \
+    VLLM_ENDPOINTS, QWEN_ENDPOINTS
+
+
+class Endpoint:
+    """
+    One vLLM server in an `EndpointPool`.
+    """
+    def __init__(self, url: str, weight: float = 1.0):
+        self.url = url
+        self.weight = weight
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def models_url(self) -> str:
+        parts = urlsplit(self.url)
+        return f"{parts.scheme}://{parts.netloc}/v1/models"
+
+    @property
+    def load(self) -> float:
+        return (self.outstanding + 1) / self.weight
+
+    def __repr__(self):
+        state = "up" if self.healthy else "down"
+        return f"Endpoint({self.url}, weight={self.weight}, outstanding={self.outstanding}, {state})"
+
+
+class EndpointPool:
+    """
+    Route requests across several OpenAI-compatible servers.
+
+    - Least outstanding requests: each request goes to the healthy endpoint with the
+      lowest (in-flight + 1) / weight, so a slow server naturally receives less work.
+    - Passive ejection: `ENDPOINT_EJECT_AFTER_FAILURES` consecutive failures (connection
+      errors, timeouts, 5xx) take an endpoint out of rotation.
+    - Active probes: a daemon thread GETs `/v1/models` on every endpoint each
+      `probe_interval` seconds, ejecting endpoints that fail and re-admitting ones that answer.
+    - If every endpoint is down, requests still go to the least-loaded one rather than failing.
+
+    Pass a pool wherever a `vllm_url` is expected: the model clients resolve it per
+    attempt, so retries move to another server.
+    """
+    def __init__(
+        self,
+        endpoints: Iterable[Union[str, Tuple[str, float]]],
+        probe_interval: Optional[float] = ENDPOINT_PROBE_INTERVAL_SECONDS,
+        probe_timeout: float = ENDPOINT_PROBE_TIMEOUT_SECONDS,
+        eject_after_failures: int = ENDPOINT_EJECT_AFTER_FAILURES,
+    ):
+        self.endpoints: List[Endpoint] = [
+            Endpoint(e) if isinstance(e, str) else Endpoint(*e) for e in endpoints
+        ]
+        if not self.endpoints:
+            raise ValueError("EndpointPool needs at least one endpoint")
+        self.probe_timeout = probe_timeout
+        self.eject_after_failures = eject_after_failures
+        self._by_url: Dict[str, Endpoint] = {e.url: e for e in self.endpoints}
+        self._lock = threading.Lock()
+        self._turn = 0
+        self._stop = threading.Event()
+        self._prober = None
+        if probe_interval:
+            self._prober = threading.Thread(
+                target=self._probe_loop, args=(probe_interval,), daemon=True, name="endpoint-probe"
+            )
+            self._prober.start()
+
+    def acquire(self) -> str:
+        """
+        Reserve the least-loaded healthy endpoint; pair with `release`.
+        """
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.healthy] or self.endpoints
+            # Rotate the start so ties (e.g. an idle pool) are broken round-robin
+            self._turn = (self._turn + 1) % len(candidates)
+            endpoint = min(candidates[self._turn:] + candidates[:self._turn], key=lambda e: e.load)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint.url
+
+    def release(self, url: str, ok: bool = True):
+        with self._lock:
+            endpoint = self._by_url[url]
+            endpoint.outstanding -= 1
+            if ok:
+                endpoint.consecutive_failures = 0
+                return
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.healthy and endpoint.consecutive_failures >= self.eject_after_failures:
+                endpoint.healthy = False
+                print(f"\t🔌 Ejecting {url} after {endpoint.consecutive_failures} consecutive failures")
+
+    @contextmanager
+    def lease(self):
+        """
+        `with pool.lease() as url:` — releases as failed if the block raises.
+        """
+        url = self.acquire()
+        ok = False
+        try:
+            yield url
+            ok = True
+        finally:
+            self.release(url, ok)
+
+    def probe(self):
+        """
+        Check every endpoint's `/v1/models` once and eject / re-admit accordingly.
+        """
+        for endpoint in self.endpoints:
+            try:
+                up = requests.get(endpoint.models_url, timeout=self.probe_timeout).status_code == 200
+            except requests.RequestException:
+                up = False
+            with self._lock:
+                if up and not endpoint.healthy:
+                    print(f"\t🔌 Re-admitting {endpoint.url}")
+                    endpoint.consecutive_failures = 0
+                elif not up and endpoint.healthy:
+                    print(f"\t🔌 Ejecting {endpoint.url} (health probe failed)")
+                endpoint.healthy = up
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            return [
+                {
+                    "url": e.url, "weight": e.weight, "healthy": e.healthy,
+                    "outstanding": e.outstanding, "requests": e.requests, "failures": e.failures,
+                }
+                for e in self.endpoints
+            ]
+
+    def close(self):
+        self._stop.set()
+
+    def _probe_loop(self, interval: float):
+        while not self._stop.wait(interval):
+            self.probe()
+
+    def __repr__(self):
+        healthy = sum(e.healthy for e in self.endpoints)
+        return f"EndpointPool({healthy}/{len(self.endpoints)} healthy)"
+
+
+_DEFAULT_POOL: Optional[EndpointPool] = None
+_QWEN_POOL: Optional[EndpointPool] = None
+
+
+def get_vllm_pool() -> EndpointPool:
+    """
+    Shared pool over `VLLM_ENDPOINTS` (see config).
+    """
+    global _DEFAULT_POOL
+    if _DEFAULT_POOL is None:
+        _DEFAULT_POOL = EndpointPool(VLLM_ENDPOINTS)
+    return _DEFAULT_POOL
+
+
+def get_qwen_pool() -> EndpointPool:
+    """
+    Shared pool over `QWEN_ENDPOINTS` (see config), for the answering stages.
+    """
+    global _QWEN_POOL
+    if _QWEN_POOL is None:
+        _QWEN_POOL = EndpointPool(QWEN_ENDPOINTS)
+    return _QWEN_POOL
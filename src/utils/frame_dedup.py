@@ -0,0 +1,125 @@
+from typing import Iterable, Iterator, List, Tuple
+
+import cv2
+import numpy as np
+
+from src.config import FRAME_DEDUP_HASH_BITS, FRAME_DEDUP_HIST_DISTANCE, FRAME_DEDUP_MAX_SPAN_SECONDS
+
+
+class FrameDeduplicator:
+    """
+    Collapse runs of near-identical frames (static shots, slides, talking heads)
+    into one representative frame before annotation, then fan the representative's
+    annotation back out to every timestamp it covers.
+
+    Two frames are near-duplicates when their 64-bit difference hashes differ in at
+    most `hash_bits` bits AND their grey-level histograms are within `hist_distance`
+    (L1 / 2, in [0, 1]). Frames are compared against the run's representative, not
+    the previous frame, so slow drift still starts a new run. A run never spans
+    more than `max_span_seconds`.
+
+    One instance covers one video: create a new one per `annotate` call.
+    """
+    def __init__(
+        self,
+        hash_bits: int = FRAME_DEDUP_HASH_BITS,
+        hist_distance: float = FRAME_DEDUP_HIST_DISTANCE,
+        max_span_seconds: float = FRAME_DEDUP_MAX_SPAN_SECONDS,
+    ):
+        self.hash_bits = hash_bits
+        self.hist_distance = hist_distance
+        self.max_span_seconds = max_span_seconds
+        self.spans: List[Tuple[float, List[float]]] = []  # (representative ts, covered ts)
+        self.frames_in = 0
+
+    def filter(
+        self, batches: Iterable[Tuple[List, List[float]]], batch_size: int
+    ) -> Iterator[Tuple[List, List[float]]]:
+        """
+        Lazily re-batch a stream of (frames, timestamps) batches into batches of
+        representative frames only, recording the span each representative covers.
+        """
+        out_f, out_ts = [], []
+        rep_hash = rep_hist = None
+        for frames, timestamps in batches:
+            hashes, hists = self._signatures(frames)
+            for frame, ts, h, hist in zip(frames, timestamps, hashes, hists):
+                self.frames_in += 1
+                if rep_hash is not None and self._is_duplicate(h, hist, rep_hash, rep_hist, ts):
+                    self.spans[-1][1].append(ts)
+                    continue
+                rep_hash, rep_hist = h, hist
+                self.spans.append((ts, [ts]))
+                out_f.append(frame)
+                out_ts.append(ts)
+                if len(out_f) == batch_size:
+                    yield out_f, out_ts
+                    out_f, out_ts = [], []
+        if out_f:
+            yield out_f, out_ts
+
+    def expand(self, annotations: List[dict]) -> List[dict]:
+        """
+        Copy each representative's annotation to every timestamp in its span.
+        Annotation timestamps are matched to the nearest representative, since the
+        model echoes them back with arbitrary rounding.
+        """
+        if not self.spans or not annotations:
+            return annotations
+        reps = np.array([rep for rep, _ in self.spans])
+        expanded, seen = [], set()
+        for ann in annotations:
+            try:
+                idx = int(np.abs(reps - float(ann["timestamp"])).argmin())
+            except (KeyError, TypeError, ValueError):
+                expanded.append(ann)
+                continue
+            if idx in seen:
+                continue
+            seen.add(idx)
+            for ts in self.spans[idx][1]:
+                expanded.append({**ann, "timestamp": ts})
+        return expanded
+
+    def report(self, batch_size: int) -> dict:
+        frames_out = len(self.spans)
+        calls_before = -(-self.frames_in // batch_size)
+        calls_after = -(-frames_out // batch_size)
+        stats = {
+            "frames_in": self.frames_in,
+            "frames_out": frames_out,
+            "vlm_calls_saved": calls_before - calls_after,
+        }
+        print(
+            f"\t♻️ Dedup: {self.frames_in} → {frames_out} frames, "
+            f"saved {stats['vlm_calls_saved']} of {calls_before} VLM calls"
+        )
+        return stats
+
+    def _is_duplicate(self, h, hist, rep_hash, rep_hist, ts) -> bool:
+        if ts - self.spans[-1][0] > self.max_span_seconds:
+            return False
+        if np.count_nonzero(h != rep_hash) > self.hash_bits:
+            return False
+        return 0.5 * np.abs(hist - rep_hist).sum() <= self.hist_distance
+
+    @staticmethod
+    def _signatures(frames: List) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (n, 64) difference-hash bits and (n, 32) normalised grey histograms for a batch.
+        """
+        thumbs = np.stack([_grey_thumb(f) for f in frames]).astype(np.float32)  # (n, 32, 36)
+        small = thumbs.reshape(len(frames), 8, 4, 9, 4).mean(axis=(2, 4))      # (n, 8, 9)
+        hashes = (small[:, :, 1:] > small[:, :, :-1]).reshape(len(frames), -1)
+        bins = np.minimum((thumbs.reshape(len(frames), -1) // 8).astype(np.int64), 31)
+        offsets = np.arange(len(frames))[:, None] * 32
+        hists = np.bincount((bins + offsets).ravel(), minlength=32 * len(frames)).reshape(len(frames), 32)
+        return hashes, hists / hists.sum(axis=1, keepdims=True)
+
+
+def _grey_thumb(frame) -> np.ndarray:
+    if isinstance(frame, (bytes, bytearray, memoryview)):
+        grey = cv2.imdecode(np.frombuffer(frame, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    else:
+        grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(grey, (36, 32), interpolation=cv2.INTER_AREA)
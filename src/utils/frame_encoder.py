@@ -1,18 +1,68 @@
 import base64
-from io import BytesIO
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+
 import cv2
 
+from src.config import FRAME_JPEG_QUALITY, FRAME_ENCODE_WORKERS
+
+# cv2.imencode releases the GIL, so a thread pool encodes a batch in parallel
+# and keeps encoding while the caller is blocked on an HTTP request.
+_ENCODE_POOL = ThreadPoolExecutor(max_workers=FRAME_ENCODE_WORKERS, thread_name_prefix="frame-encode")
+
+_MAGIC_MIME_TYPES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+    (b"RIFF", "image/webp"),
+)
+
+
+def encode_frame(frame, quality: int = FRAME_JPEG_QUALITY) -> bytes:
+    """
+    JPEG-encode an OpenCV BGR frame directly with cv2 (no RGB/PIL round trip).
+    Already-encoded bytes (e.g. from the FrameStore) are returned unchanged.
+    """
+    if isinstance(frame, (bytes, bytearray, memoryview)):
+        return bytes(frame)
+    success, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not success:
+        raise ValueError("Failed to JPEG-encode frame")
+    return buf.tobytes()
+
 
-def encode_to_base64(frame) -> str:
+def encode_to_base64(frame, quality: int = FRAME_JPEG_QUALITY) -> str:
     """
     Convert an OpenCV BGR frame to a base64-encoded JPEG.
+    Already-encoded JPEG bytes (e.g. from the FrameStore) are passed through without decoding.
     """
-    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    pil_img = Image.fromarray(rgb)
-    buffer = BytesIO()
-    pil_img.save(buffer, format="JPEG")
-    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+    return encode_blob_to_base64(encode_frame(frame, quality))
+
+
+def encode_batch_to_base64(
+    frames: Sequence, quality: int = FRAME_JPEG_QUALITY, executor: Optional[ThreadPoolExecutor] = None
+) -> List[str]:
+    """
+    Base64-encode a whole batch of frames in parallel on the shared encode pool, preserving order.
+    """
+    pool = executor or _ENCODE_POOL
+    return list(pool.map(lambda f: encode_to_base64(f, quality), frames))
+
 
 def encode_blob_to_base64(frame_blob: bytes) -> str:
-    return base64.b64encode(frame_blob).decode("utf-8")
\ No newline at end of file
+    return base64.b64encode(frame_blob).decode("utf-8")
+
+
+def image_mime_type(image_base64: str) -> str:
+    """
+    MIME type of a base64-encoded image, sniffed from its magic bytes (defaults to JPEG).
+    """
+    head = base64.b64decode(image_base64[:16])
+    for magic, mime in _MAGIC_MIME_TYPES:
+        if head.startswith(magic):
+            return mime
+    return "image/jpeg"
+
+
+def to_data_uri(image_base64: str) -> str:
+    return f"data:{image_mime_type(image_base64)};base64,{image_base64}"
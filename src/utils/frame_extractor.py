@@ -1,33 +1,327 @@
+import shutil
+import subprocess
+import zlib
+from typing import Iterator, List, Optional, Tuple
+
 import cv2
-from typing import List, Tuple
-from src.config import FRAME_INTERVAL_SECONDS
+import numpy as np
+
+from src.config import FRAME_INTERVAL_SECONDS, FRAME_DECODE_BACKEND, FRAME_JPEG_QUALITY
+from src.utils.adaptive_sampler import AdaptiveSampler
+from src.utils.frame_encoder import encode_frame
+from src.utils.frame_resize import resize_frame
+from src.utils.frame_store import FrameStore
 
 
 class FrameExtractor:
-    def __init__(self, interval_seconds: float = FRAME_INTERVAL_SECONDS):
+    """
+    Sample one frame every `interval_seconds` from a video.
+
+    Decode backends (selectable per instance or per call):
+      - "read":   decode every frame with `cap.read()` and keep every Nth (legacy loop)
+      - "grab":   `cap.grab()` every frame, `cap.retrieve()` only the kept ones
+      - "seek":   seek straight to each sample timestamp (best for long videos / sparse sampling)
+      - "ffmpeg": let ffmpeg's `fps` filter pick the frames and pipe rawvideo into NumPy
+
+    Sampling modes:
+      - "fixed":    one frame every `interval_seconds` (decoded with the backend above)
+      - "adaptive": shot-boundary / motion-driven timestamps from `AdaptiveSampler`
+
+    `max_side` / `pixel_budget` downscale larger frames right after decoding (aspect
+    ratio kept, longest side snapped to `multiple_of` pixels), so nothing downstream
+    pays for pixels the VLM never sees.
+
+    With a `FrameStore`, `iter_encoded` serves JPEG frames of previously
+    extracted videos straight from the store without decoding them.
+    """
+    BACKENDS = ("read", "grab", "seek", "ffmpeg")
+    SAMPLINGS = ("fixed", "adaptive")
+
+    def __init__(
+        self,
+        interval_seconds: float = FRAME_INTERVAL_SECONDS,
+        backend: str = FRAME_DECODE_BACKEND,
+        store: Optional[FrameStore] = None,
+        jpeg_quality: int = FRAME_JPEG_QUALITY,
+        max_side: Optional[int] = None,
+        pixel_budget: Optional[int] = None,
+        multiple_of: int = 1,
+        sampling: str = "fixed",
+        sampler: Optional[AdaptiveSampler] = None,
+    ):
+        if sampling not in self.SAMPLINGS:
+            raise ValueError(f"Unknown sampling mode '{sampling}'. Expected one of {self.SAMPLINGS}")
         self.interval_seconds = interval_seconds
+        self.backend = self._check_backend(backend)
+        self.max_side = max_side
+        self.pixel_budget = pixel_budget
+        self.multiple_of = multiple_of
+        self.sampling = sampling
+        self.sampler = sampler or AdaptiveSampler()
+        self.store = store
+        self.jpeg_quality = jpeg_quality
 
-    def extract(self, video_path: str) -> Tuple[List, List[float]]:
+    def extract(self, video_path: str, backend: Optional[str] = None) -> Tuple[List, List[float]]:
         """
         Read through the video at `video_path` and grab one frame every
         `interval_seconds`. Returns lists of (frame, timestamp).
+
+        Holds every sampled frame in memory; prefer `iter_batches` for long videos.
+        """
+        frames, timestamps = [], []
+        for frame, ts in self.iter_frames(video_path, backend):
+            frames.append(frame)
+            timestamps.append(ts)
+        return frames, timestamps
+
+    def iter_frames(self, video_path: str, backend: Optional[str] = None) -> Iterator[Tuple[np.ndarray, float]]:
+        """
+        Lazily yield (frame, timestamp) pairs; only the current frame is held in memory.
+        """
+        backend = self._check_backend(backend or self.backend)
+        if self.sampling == "adaptive":
+            print("\tExtracting frames (adaptive)...")
+            decoded = self._iter_at(video_path, self.sampler.plan(video_path))
+        else:
+            print(f"\tExtracting frames ({backend})...")
+            decoded = getattr(self, f"_iter_{backend}")(video_path)
+        for frame, ts in decoded:
+            yield resize_frame(frame, self.max_side, self.pixel_budget, self.multiple_of), ts
+
+    def iter_batches(
+        self, video_path: str, batch_size: int, backend: Optional[str] = None
+    ) -> Iterator[Tuple[List, List[float]]]:
+        """
+        Lazily yield (frames, timestamps) batches of at most `batch_size` frames,
+        so peak memory is bounded by the batch size rather than the video length.
+        """
+        return _batched(self.iter_frames(video_path, backend), batch_size)
+
+    def iter_frames_at(self, video_path: str, timestamps: List[float]) -> Iterator[Tuple[np.ndarray, float]]:
+        """
+        Lazily yield the frame at (or just after) each of `timestamps`, resized like `iter_frames`.
+        Seeks to each timestamp with the "seek" backend, otherwise makes one grab/retrieve pass.
+        """
+        print(f"\tExtracting {len(timestamps)} frames at given timestamps...")
+        if self.backend == "seek":
+            decoded = self._iter_seek_to(video_path, timestamps)
+        else:
+            decoded = self._iter_at(video_path, timestamps)
+        for frame, ts in decoded:
+            yield resize_frame(frame, self.max_side, self.pixel_budget, self.multiple_of), ts
+
+    def iter_batches_at(
+        self, video_path: str, timestamps: List[float], batch_size: int
+    ) -> Iterator[Tuple[List, List[float]]]:
+        return _batched(self.iter_frames_at(video_path, timestamps), batch_size)
+
+    def encode_at(self, video_path: str, timestamps: List[float]) -> List[Optional[bytes]]:
+        """
+        JPEG bytes of the frame at each of `timestamps`: from the `FrameStore` where a
+        run with these settings already stored it, otherwise decoded (see `iter_frames_at`)
+        and matched to the nearest decoded timestamp.
+        """
+        blobs = [None] * len(timestamps)
+        if self.store is not None and timestamps:
+            video_hash = self.store.video_hash(video_path)
+            blobs = self.store.get_many(video_hash, timestamps, self.resolution_key, self.jpeg_quality)
+        missing = [ts for ts, blob in zip(timestamps, blobs) if blob is None]
+        if missing:
+            decoded = {ts: self._encode(frame) for frame, ts in self.iter_frames_at(video_path, missing)}
+            for i, ts in enumerate(timestamps):
+                if blobs[i] is None and decoded:
+                    blobs[i] = decoded[min(decoded, key=lambda t: abs(t - ts))]
+        return blobs
+
+    def iter_encoded(self, video_path: str, backend: Optional[str] = None) -> Iterator[Tuple[bytes, float]]:
+        """
+        Lazily yield (jpeg_bytes, timestamp) pairs. If a `FrameStore` is attached and
+        this video was already extracted with the same settings, frames are read from
+        the store and the video is not decoded at all; otherwise they are decoded,
+        encoded and written to the store for next time.
         """
-        print("\tExtracting frames...")
+        backend = self._check_backend(backend or self.backend)
+        if self.store is None:
+            for frame, ts in self.iter_frames(video_path, backend):
+                yield self._encode(frame), ts
+            return
+
+        video_hash = self.store.video_hash(video_path)
+        resolution = self.resolution_key
+        mode = self.sampler.key if self.sampling == "adaptive" else backend
+        run_key = self.store.run_key(video_hash, self.interval_seconds, mode, resolution, self.jpeg_quality)
+        cached_ts = self.store.get_run(run_key)
+        if cached_ts is not None:
+            blobs = self.store.get_many(video_hash, cached_ts, resolution, self.jpeg_quality)
+            if all(blob is not None for blob in blobs):
+                print(f"\t✅ Serving {len(blobs)} frames from frame store")
+                yield from zip(blobs, cached_ts)
+                return
+
+        timestamps = []
+        for frame, ts in self.iter_frames(video_path, backend):
+            jpeg = self._encode(frame)
+            self.store.put(video_hash, ts, resolution, self.jpeg_quality, jpeg)
+            timestamps.append(ts)
+            yield jpeg, ts
+        self.store.put_run(run_key, timestamps)
+
+    def iter_encoded_batches(
+        self, video_path: str, batch_size: int, backend: Optional[str] = None
+    ) -> Iterator[Tuple[List[bytes], List[float]]]:
+        return _batched(self.iter_encoded(video_path, backend), batch_size)
+
+    @property
+    def resolution_key(self) -> int:
+        """
+        FrameStore resolution key for this extractor's target size (0 = native).
+        """
+        if not self.max_side and not self.pixel_budget:
+            return 0
+        spec = f"{self.max_side}:{self.pixel_budget}:{self.multiple_of}:aspect"  # ":aspect": sizes keep the aspect ratio
+        return zlib.crc32(spec.encode()) & 0x7FFFFFFF
+
+    def _encode(self, frame: np.ndarray) -> bytes:
+        return encode_frame(frame, self.jpeg_quality)
+
+    def _check_backend(self, backend: str) -> str:
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown decode backend '{backend}'. Expected one of {self.BACKENDS}")
+        if backend == "ffmpeg":
+            missing = [tool for tool in ("ffmpeg", "ffprobe") if shutil.which(tool) is None]
+            if missing:
+                raise RuntimeError(f"The 'ffmpeg' decode backend requires {' and '.join(missing)} on PATH")
+        return backend
+
+    def _frame_step(self, fps: float) -> int:
+        return max(1, int(fps * self.interval_seconds))
+
+    def _iter_read(self, video_path: str) -> Iterator[Tuple[np.ndarray, float]]:
         cap = cv2.VideoCapture(video_path)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_interval = int(fps * self.interval_seconds)
+        frame_interval = self._frame_step(cap.get(cv2.CAP_PROP_FPS))
+        try:
+            frame_id = 0
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if frame_id % frame_interval == 0:
+                    yield frame, cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                frame_id += 1
+        finally:
+            cap.release()
 
-        frames, timestamps = [], []
-        frame_id = 0
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            if frame_id % frame_interval == 0:
+    def _iter_grab(self, video_path: str) -> Iterator[Tuple[np.ndarray, float]]:
+        # grab() still decodes every frame; what it skips is retrieve(), the colour
+        # conversion and copy out of the decoder, which dropped frames never need.
+        cap = cv2.VideoCapture(video_path)
+        frame_interval = self._frame_step(cap.get(cv2.CAP_PROP_FPS))
+        try:
+            frame_id = 0
+            while cap.grab():
+                if frame_id % frame_interval == 0:
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        break
+                    yield frame, cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                frame_id += 1
+        finally:
+            cap.release()
+
+    def _iter_seek(self, video_path: str) -> Iterator[Tuple[np.ndarray, float]]:
+        cap = cv2.VideoCapture(video_path)
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+            duration = frame_count / fps if fps else 0.0
+            ts = 0.0
+            while ts < duration:
+                cap.set(cv2.CAP_PROP_POS_MSEC, ts * 1000)
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                yield frame, ts
+                ts += self.interval_seconds
+        finally:
+            cap.release()
+
+    def _iter_at(self, video_path: str, targets: List[float]) -> Iterator[Tuple[np.ndarray, float]]:
+        """
+        Yield the first frame at or after each target timestamp (grab/retrieve, single pass).
+        """
+        cap = cv2.VideoCapture(video_path)
+        try:
+            pending = iter(sorted(targets))
+            target = next(pending, None)
+            while target is not None and cap.grab():
                 ts = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
-                frames.append(frame)
-                timestamps.append(ts)
-            frame_id += 1
+                if ts + 1e-6 < target:
+                    continue
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                yield frame, ts
+                while target is not None and target <= ts + 1e-6:
+                    target = next(pending, None)
+        finally:
+            cap.release()
+
+    def _iter_seek_to(self, video_path: str, targets: List[float]) -> Iterator[Tuple[np.ndarray, float]]:
+        cap = cv2.VideoCapture(video_path)
+        try:
+            for ts in sorted(targets):
+                cap.set(cv2.CAP_PROP_POS_MSEC, ts * 1000)
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                yield frame, ts
+        finally:
+            cap.release()
+
+    def _iter_ffmpeg(self, video_path: str) -> Iterator[Tuple[np.ndarray, float]]:
+        width, height = self._probe_size(video_path)
+        frame_bytes = width * height * 3
+        cmd = [
+            "ffmpeg", "-v", "error", "-noautorotate", "-i", video_path,
+            "-vf", f"fps=1/{self.interval_seconds}",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-",
+        ]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=frame_bytes)
+        try:
+            idx = 0
+            while True:
+                buf = bytearray(frame_bytes)
+                if proc.stdout.readinto(buf) < frame_bytes:
+                    break
+                frame = np.frombuffer(buf, dtype=np.uint8).reshape(height, width, 3)
+                yield frame, idx * self.interval_seconds
+                idx += 1
+        finally:
+            proc.stdout.close()
+            proc.kill()
+            proc.wait()
+
+    @staticmethod
+    def _probe_size(video_path: str) -> Tuple[int, int]:
+        out = subprocess.run(
+            [
+                "ffprobe", "-v", "error", "-select_streams", "v:0",
+                "-show_entries", "stream=width,height", "-of", "csv=p=0", video_path,
+            ],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        width, height = out.strip().splitlines()[0].split(",")[:2]
+        return int(width), int(height)
+
+
+def _batched(pairs: Iterator[Tuple], batch_size: int) -> Iterator[Tuple[List, List[float]]]:
+    items, timestamps = [], []
+    for item, ts in pairs:
+        items.append(item)
+        timestamps.append(ts)
+        if len(items) == batch_size:
+            yield items, timestamps
+            items, timestamps = [], []
+    if items:
+        yield items, timestamps
 
-        cap.release()
-        return frames, timestamps
@@ -0,0 +1,71 @@
+import math
+from typing import List, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from src.config import VLM_IMAGE_MAX_SIDE, VLM_IMAGE_TOKEN_PIXELS
+
+
+def pack_mosaic(
+    frames: Sequence,
+    timestamps: Sequence[float],
+    max_side: int = VLM_IMAGE_MAX_SIDE,
+    first_index: int = 0,
+) -> np.ndarray:
+    """
+    Tile `frames` into one near-square grid image (row-major) no larger than `max_side`
+    on its longest side, each tile labelled "#<index> <timestamp>s" in its top-left corner
+    so the VLM can tell the tiles apart and echo their timestamps back.
+
+    Frames may be BGR arrays or encoded JPEG bytes.
+    """
+    images = [_as_array(f) for f in frames]
+    h0, w0 = images[0].shape[:2]
+    rows, cols, tile_w, tile_h = mosaic_layout(w0, h0, len(images), max_side)
+
+    mosaic = np.zeros((rows * tile_h, cols * tile_w, 3), dtype=np.uint8)
+    for i, (img, ts) in enumerate(zip(images, timestamps)):
+        r, c = divmod(i, cols)
+        tile = cv2.resize(img, (tile_w, tile_h), interpolation=cv2.INTER_AREA)
+        _label(tile, f"#{first_index + i} {ts:.2f}s")
+        mosaic[r * tile_h:(r + 1) * tile_h, c * tile_w:(c + 1) * tile_w] = tile
+    return mosaic
+
+
+def mosaic_layout(width: int, height: int, tiles: int, max_side: int = VLM_IMAGE_MAX_SIDE) -> Tuple[int, int, int, int]:
+    """
+    (rows, cols, tile_w, tile_h) of a mosaic of `tiles` frames of size (width, height):
+    a near-square grid whose tiles follow the frames' aspect ratio, snapped to the
+    image-token grid. The mosaic is rows * tile_h by cols * tile_w pixels.
+    """
+    cols = math.ceil(math.sqrt(tiles))
+    rows = math.ceil(tiles / cols)
+    scale = min(max_side / (cols * width), max_side / (rows * height), 1.0)
+    tile_w = max(VLM_IMAGE_TOKEN_PIXELS, int(width * scale) // VLM_IMAGE_TOKEN_PIXELS * VLM_IMAGE_TOKEN_PIXELS)
+    tile_h = max(VLM_IMAGE_TOKEN_PIXELS, int(height * scale) // VLM_IMAGE_TOKEN_PIXELS * VLM_IMAGE_TOKEN_PIXELS)
+    return rows, cols, tile_w, tile_h
+
+
+def pack_mosaics(frames: Sequence, timestamps: Sequence[float], tiles_per_image: int) -> List[np.ndarray]:
+    """
+    Split a batch into consecutive groups of `tiles_per_image` frames and pack each group.
+    """
+    return [
+        pack_mosaic(frames[i:i + tiles_per_image], timestamps[i:i + tiles_per_image], first_index=i)
+        for i in range(0, len(frames), tiles_per_image)
+    ]
+
+
+def _label(tile: np.ndarray, text: str):
+    scale = max(0.4, tile.shape[0] / 400)
+    thickness = max(1, int(round(scale * 2)))
+    (tw, th), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+    cv2.rectangle(tile, (0, 0), (tw + 8, th + baseline + 8), (0, 0, 0), thickness=-1)
+    cv2.putText(tile, text, (4, th + 4), cv2.FONT_HERSHEY_SIMPLEX, scale, (255, 255, 255), thickness, cv2.LINE_AA)
+
+
+def _as_array(frame) -> np.ndarray:
+    if isinstance(frame, (bytes, bytearray, memoryview)):
+        return cv2.imdecode(np.frombuffer(frame, np.uint8), cv2.IMREAD_COLOR)
+    return frame
@@ -0,0 +1,95 @@
+import math
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+from src.config import VLM_IMAGE_MAX_SIDE, VLM_IMAGE_TOKEN_PIXELS
+
+
+def target_size(
+    width: int,
+    height: int,
+    max_side: Optional[int] = None,
+    pixel_budget: Optional[int] = None,
+    multiple_of: int = 1,
+) -> Tuple[int, int]:
+    """
+    Size a (width, height) frame should be downscaled to so that its longest side is
+    at most `max_side` and its area at most `pixel_budget`. When the frame is
+    downscaled, the scale factor is snapped down so the longest side is a multiple of
+    `multiple_of` pixels and the aspect ratio is kept. Never upscales; frames within
+    the limits keep their native size.
+    """
+    scale = 1.0
+    if max_side:
+        scale = min(scale, max_side / max(width, height))
+    if pixel_budget:
+        scale = min(scale, math.sqrt(pixel_budget / (width * height)))
+    if scale >= 1.0:
+        return width, height
+    long_side = max(width, height)
+    if multiple_of > 1:
+        snapped = int(long_side * scale) // multiple_of * multiple_of
+        scale = max(snapped, multiple_of) / long_side
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def resize_frame(
+    frame: np.ndarray,
+    max_side: Optional[int] = None,
+    pixel_budget: Optional[int] = None,
+    multiple_of: int = 1,
+) -> np.ndarray:
+    """
+    Downscale `frame` to `target_size(...)` with area interpolation; returns it untouched if already small enough.
+    """
+    if not max_side and not pixel_budget:
+        return frame
+    height, width = frame.shape[:2]
+    size = target_size(width, height, max_side, pixel_budget, multiple_of)
+    if size == (width, height):
+        return frame
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+
+def estimate_image_tokens(
+    width: int,
+    height: int,
+    max_side: int = VLM_IMAGE_MAX_SIDE,
+    token_pixels: int = VLM_IMAGE_TOKEN_PIXELS,
+) -> int:
+    """
+    Image tokens the VLM spends on a (width, height) image: the server first fits the
+    image inside `max_side`, then emits one token per `token_pixels` x `token_pixels`
+    cell plus one row-break token per row (Pixtral-style tokenizer).
+    """
+    w, h = target_size(width, height, max_side=max_side)
+    cols = math.ceil(w / token_pixels)
+    rows = math.ceil(h / token_pixels)
+    return rows * cols + rows
+
+
+def frame_size(frame) -> Tuple[int, int]:
+    """
+    (width, height) of a BGR array or of encoded JPEG bytes, read from the JPEG's
+    start-of-frame header without decoding the image.
+    """
+    if isinstance(frame, np.ndarray):
+        return frame.shape[1], frame.shape[0]
+    data = bytes(frame)
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+            i += 1 if marker == 0xFF else 2
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = int.from_bytes(data[i + 5:i + 7], "big"), int.from_bytes(data[i + 7:i + 9], "big")
+            return width, height
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    return image.shape[1], image.shape[0]
@@ -0,0 +1,269 @@
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from src.config import FRAME_STORE_DIR, FRAME_STORE_MAX_MB
+
+# One fixed-size record per stored frame, appended to `<video>/frames.idx`.
+INDEX_DTYPE = np.dtype([
+    ("ts_ms", "<i8"),       # frame timestamp in milliseconds
+    ("resolution", "<i4"),  # target-size key (0 = native, see FrameExtractor.resolution_key)
+    ("quality", "<i2"),     # JPEG quality
+    ("offset", "<u8"),      # byte offset into `frames.blob`
+    ("length", "<u4"),      # JPEG byte length
+])
+
+# Files of the earlier single-directory layout, removed on open.
+LEGACY_FILES = ("frames.blob", "frames.idx", "runs.json")
+
+
+class _Shard:
+    """
+    Memory maps of one video's index and blob.
+    """
+    def __init__(self):
+        self.index = np.empty(0, dtype=INDEX_DTYPE)
+        self.blob = None
+        self.blob_file = None
+
+    def close(self):
+        if self.blob is not None:
+            self.blob.close()
+            self.blob_file.close()
+        self.blob = self.blob_file = None
+
+
+class FrameStore:
+    """
+    Persistent, content-addressed store of encoded JPEG frames.
+
+    Frames are keyed by (video file hash, timestamp, resolution, JPEG quality). Each
+    video has its own directory: JPEG bytes live in an append-only `frames.blob`,
+    `frames.idx` is an append-only array of INDEX_DTYPE records that is memory-mapped
+    for lookups, and `runs/` holds one small file per completed extraction (video,
+    sampling, resolution, quality), so a rerun can serve every frame without decoding
+    the video. Evenly spaced runs are stored as (start, step, count).
+
+    The store is capped at `max_mb`: after each completed run, the least recently
+    used videos are deleted until it fits.
+
+    Safe for several processes sharing one directory: appends and evictions hold an
+    exclusive `flock`, and a frame's blob is written before its index record. Within a
+    process one store can be shared between threads: remapping the index / blob and
+    reading from them hold an in-process lock.
+    """
+    def __init__(self, root: Path = FRAME_STORE_DIR, max_mb: Optional[float] = FRAME_STORE_MAX_MB):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_mb * 1024 * 1024) if max_mb else None
+        self.lock_path = self.root / ".lock"
+        for name in LEGACY_FILES:
+            if (self.root / name).exists():
+                print(f"\t🧹 Frame store: removing {self.root / name} (old single-file layout)")
+                (self.root / name).unlink(missing_ok=True)
+
+        self._shards: Dict[str, _Shard] = {}
+        self._hashes: Dict[tuple, str] = {}
+        self._mutex = threading.Lock()
+
+    # ---- keys -------------------------------------------------------------
+
+    def video_hash(self, video_path: str) -> str:
+        """
+        blake2b-128 of the file contents, memoised per (path, size, mtime).
+        """
+        st = os.stat(video_path)
+        memo_key = (str(video_path), st.st_size, st.st_mtime_ns)
+        if memo_key not in self._hashes:
+            h = hashlib.blake2b(digest_size=16)
+            with open(video_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            self._hashes[memo_key] = h.hexdigest()
+        return self._hashes[memo_key]
+
+    @staticmethod
+    def run_key(video_hash: str, interval_seconds: float, backend: str, resolution: int, quality: int) -> str:
+        return f"{video_hash}:{interval_seconds:.6f}:{backend}:{resolution}:{quality}"
+
+    # ---- reads ------------------------------------------------------------
+
+    def get(self, video_hash: str, ts: float, resolution: int, quality: int) -> Optional[bytes]:
+        """
+        Encoded JPEG bytes for one frame, or None if it is not stored.
+        """
+        return self.get_many(video_hash, [ts], resolution, quality)[0]
+
+    def get_many(self, video_hash: str, timestamps: List[float], resolution: int, quality: int) -> List[Optional[bytes]]:
+        """
+        Encoded JPEG bytes for each timestamp (None where missing), in one index scan.
+        """
+        rows = self._rows(video_hash, resolution, quality)
+        by_ts = {int(r["ts_ms"]): r for r in rows}
+        return [
+            self._read_blob(video_hash, by_ts[_to_ms(ts)]) if _to_ms(ts) in by_ts else None
+            for ts in timestamps
+        ]
+
+    def get_run(self, run_key: str) -> Optional[List[float]]:
+        """
+        Timestamps of a completed extraction run, or None if it was never completed.
+        Marks the video as recently used either way (it is about to be read or written).
+        """
+        video_hash = run_key.split(":", 1)[0]
+        self._touch(video_hash)
+        try:
+            with open(self._run_path(run_key), "r") as f:
+                run = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if run.get("key") != run_key:
+            return None
+        if "timestamps" in run:
+            return run["timestamps"]
+        return [round(run["start"] + i * run["step"], 6) for i in range(run["count"])]
+
+    # ---- writes -----------------------------------------------------------
+
+    def put(self, video_hash: str, ts: float, resolution: int, quality: int, jpeg: bytes):
+        record = np.zeros(1, dtype=INDEX_DTYPE)
+        record["ts_ms"] = _to_ms(ts)
+        record["resolution"] = resolution
+        record["quality"] = quality
+        record["length"] = len(jpeg)
+        shard = self.root / video_hash
+        with self._locked():
+            shard.mkdir(exist_ok=True)
+            with open(shard / "frames.blob", "ab") as blob:
+                record["offset"] = blob.tell()
+                blob.write(jpeg)
+            with open(shard / "frames.idx", "ab") as index:
+                index.write(record.tobytes())
+
+    def put_run(self, run_key: str, timestamps: List[float]):
+        """
+        Mark a run complete, then evict least recently used videos beyond `max_mb`.
+        """
+        video_hash = run_key.split(":", 1)[0]
+        path = self._run_path(run_key)
+        with self._locked():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            with open(tmp, "w") as f:
+                json.dump({"key": run_key, **_compact(timestamps)}, f)
+            os.replace(tmp, path)
+            self._touch(video_hash)
+            self._evict(keep=video_hash)
+
+    # ---- internals --------------------------------------------------------
+
+    def _run_path(self, run_key: str) -> Path:
+        video_hash = run_key.split(":", 1)[0]
+        digest = hashlib.blake2b(run_key.encode(), digest_size=8).hexdigest()
+        return self.root / video_hash / "runs" / f"{digest}.json"
+
+    def _touch(self, video_hash: str):
+        shard = self.root / video_hash
+        if shard.is_dir():
+            os.utime(shard)
+
+    def _evict(self, keep: str):
+        """
+        Delete least recently used video directories until the store fits `max_bytes`.
+        Call with the file lock held.
+        """
+        if self.max_bytes is None:
+            return
+        shards = []
+        for shard in self.root.iterdir():
+            if not shard.is_dir():
+                continue
+            size = sum(f.stat().st_size for f in shard.rglob("*") if f.is_file())
+            shards.append((shard.stat().st_mtime, size, shard))
+        total = sum(size for _, size, _ in shards)
+        for last_used, size, shard in sorted(shards):
+            if total <= self.max_bytes:
+                break
+            if shard.name == keep:
+                continue
+            shutil.rmtree(shard, ignore_errors=True)
+            total -= size
+            with self._mutex:
+                stale = self._shards.pop(shard.name, None)
+                if stale:
+                    stale.close()
+            print(f"\t🧹 Frame store: evicted {shard.name} ({size / 1e6:.0f} MB, last used {time.ctime(last_used)})")
+
+    def _rows(self, video_hash: str, resolution: int, quality: int) -> np.ndarray:
+        index = self._refresh_index(video_hash)
+        mask = (index["resolution"] == resolution) & (index["quality"] == quality)
+        return index[mask]
+
+    def _refresh_index(self, video_hash: str) -> np.ndarray:
+        path = self.root / video_hash / "frames.idx"
+        with self._mutex:
+            shard = self._shards.setdefault(video_hash, _Shard())
+            try:
+                n = path.stat().st_size // INDEX_DTYPE.itemsize
+            except FileNotFoundError:  # never stored, or evicted by another process
+                shard.close()
+                shard.index = np.empty(0, dtype=INDEX_DTYPE)
+                return shard.index
+            if n != len(shard.index):
+                shard.index = np.memmap(path, dtype=INDEX_DTYPE, mode="r", shape=(n,)) if n else shard.index
+            return shard.index
+
+    def _read_blob(self, video_hash: str, row) -> Optional[bytes]:
+        end = int(row["offset"]) + int(row["length"])
+        with self._mutex:
+            shard = self._shards.setdefault(video_hash, _Shard())
+            if shard.blob is None or len(shard.blob) < end:
+                shard.close()
+                try:
+                    shard.blob_file = open(self.root / video_hash / "frames.blob", "rb")
+                except FileNotFoundError:
+                    return None
+                shard.blob = mmap.mmap(shard.blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+            return shard.blob[int(row["offset"]):end]
+
+    def _locked(self):
+        return _FileLock(self.lock_path)
+
+
+class _FileLock:
+    def __init__(self, path: Path):
+        self.path = path
+
+    def __enter__(self):
+        self.f = open(self.path, "a")
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
+def _compact(timestamps: List[float]) -> dict:
+    """
+    {"start", "step", "count"} when the timestamps are evenly spaced (to the ms), else the list.
+    """
+    ts = [float(t) for t in timestamps]
+    if len(ts) >= 2:
+        step = (ts[-1] - ts[0]) / (len(ts) - 1)
+        if step > 0 and all(_to_ms(t) == _to_ms(ts[0] + i * step) for i, t in enumerate(ts)):
+            return {"start": ts[0], "step": step, "count": len(ts)}
+    return {"timestamps": ts}
+
+
+def _to_ms(ts: float) -> int:
+    return int(round(ts * 1000))
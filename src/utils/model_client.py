@@ -0,0 +1,382 @@
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional, TypeVar, Union
+from urllib.parse import urlsplit
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.config import MODEL_CONNECT_TIMEOUT_SECONDS, MODEL_READ_TIMEOUT_SECONDS, MODEL_MAX_RETRIES, \
+    MODEL_BACKOFF_BASE_SECONDS, MODEL_BACKOFF_MAX_SECONDS, MODEL_POOL_CONNECTIONS
+from src.utils.concurrency_limiter import ConcurrencyLimiter
+from src.utils.endpoint_pool import EndpointPool
+from src.utils.response_cache import ResponseCache, get_response_cache
+from src.utils.telemetry import Telemetry, get_telemetry
+
+OVERLOAD_STATUSES = (429, 503)
+T = TypeVar("T")
+
+
+class ModelClientError(Exception):
+    """
+    Base class for failed model calls. `url` is the endpoint that was called.
+    """
+    def __init__(self, message: str, url: str = ""):
+        super().__init__(f"{message} ({url})" if url else message)
+        self.url = url
+
+
+class ModelConnectionError(ModelClientError):
+    """
+    The endpoint could not be reached, or did not answer within the timeout.
+    """
+
+
+class ModelHTTPError(ModelClientError):
+    """
+    The endpoint answered with a non-2xx status.
+    """
+    def __init__(self, status: int, body: str, url: str = ""):
+        super().__init__(f"HTTP {status}: {body[:200]}", url)
+        self.status = status
+        self.body = body
+
+    @property
+    def retryable(self) -> bool:
+        return self.status >= 500 or self.status == 429
+
+
+class ModelResponseError(ModelClientError):
+    """
+    The endpoint answered 2xx but the body is not a chat completion.
+    """
+
+
+class ModelClient:
+    """
+    Shared HTTP client for the OpenAI-compatible chat endpoints (vLLM).
+
+    - One `requests.Session` per endpoint (scheme://host:port), with a keep-alive
+      connection pool of `pool_connections`, so requests reuse TCP connections.
+    - (connect, read) timeouts on every request.
+    - Jittered exponential backoff ("full jitter") on connection errors, timeouts,
+      5xx and 429, up to `max_retries` retries.
+    - An adaptive (AIMD) in-flight limit per endpoint (`ConcurrencyLimiter`); see
+      `limiter_stats()` for current limits and latencies.
+    - Optional `ResponseCache` in front of `chat` (the shared client uses one).
+    - Streaming with early stop (`stream_chat` / `chat(stop_when=...)`), recording
+      time to first token.
+    - Optional `Telemetry`: one record per attempt (latency, TTFT, token usage, images,
+      endpoint, stage).
+    - Failures raise a `ModelClientError` subclass instead of returning a sentinel.
+
+    `url` may be an `EndpointPool` instead of a URL: each attempt is routed to the
+    pool's least-loaded healthy endpoint and reports back whether that endpoint failed.
+
+    Sessions are safe to share across threads; use one client per process.
+    """
+    def __init__(
+        self,
+        connect_timeout: float = MODEL_CONNECT_TIMEOUT_SECONDS,
+        read_timeout: float = MODEL_READ_TIMEOUT_SECONDS,
+        max_retries: int = MODEL_MAX_RETRIES,
+        backoff_base: float = MODEL_BACKOFF_BASE_SECONDS,
+        backoff_max: float = MODEL_BACKOFF_MAX_SECONDS,
+        pool_connections: int = MODEL_POOL_CONNECTIONS,
+        cache: Optional[ResponseCache] = None,
+        telemetry: Optional[Telemetry] = None,
+    ):
+        self.cache = cache
+        self.telemetry = telemetry
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_connections = pool_connections
+        self._sessions: Dict[str, requests.Session] = {}
+        self._limiters: Dict[str, ConcurrencyLimiter] = {}
+        self._ttfts: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def session(self, url: str) -> requests.Session:
+        endpoint = _endpoint(url)
+        session = self._sessions.get(endpoint)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(endpoint)
+                if session is None:
+                    session = requests.Session()
+                    # Retries are handled in `post_json` so backoff applies to status codes too.
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_connections, max_retries=0)
+                    session.mount(endpoint, adapter)
+                    self._sessions[endpoint] = session
+        return session
+
+    def limiter(self, url: str) -> ConcurrencyLimiter:
+        endpoint = _endpoint(url)
+        with self._lock:
+            if endpoint not in self._limiters:
+                self._limiters[endpoint] = ConcurrencyLimiter()
+            return self._limiters[endpoint]
+
+    def limiter_stats(self) -> Dict[str, dict]:
+        """
+        Current in-flight limit, queueing and latency percentiles per endpoint.
+        """
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {endpoint: limiter.stats() for endpoint, limiter in limiters.items()}
+
+    def post_json(self, url: Union[str, EndpointPool], payload: dict, headers: Optional[dict] = None) -> dict:
+        """
+        POST `payload` as JSON and return the decoded JSON body, retrying transient failures.
+        """
+        def read(response: requests.Response, url: str, record: dict) -> dict:
+            try:
+                body = response.json()
+            except ValueError as e:
+                raise ModelResponseError(f"Invalid JSON body: {e}", url) from e
+            _record_usage(record, body.get("usage") if isinstance(body, dict) else None)
+            return body
+
+        return self._with_retries(url, lambda u: self._send(u, payload, headers, read))
+
+    def stream_chat(
+        self,
+        url: Union[str, EndpointPool],
+        payload: dict,
+        headers: Optional[dict] = None,
+        stop_when: Optional[Callable[[str], bool]] = None,
+    ) -> str:
+        """
+        Streamed chat completion (server-sent events). `stop_when(text_so_far)` is checked
+        after every chunk; once it returns True the connection is closed, which makes vLLM
+        abort the generation, and the text so far is returned. Time to first token is
+        recorded per endpoint (`ttft_stats()`).
+        """
+        payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+
+        def read(response: requests.Response, url: str, record: dict) -> str:
+            text = ""
+            chunks = 0
+            for line in response.iter_lines():
+                chunk = _parse_sse(line, url)
+                if chunk is None:
+                    continue
+                if chunk is _SSE_DONE:
+                    break
+                _record_usage(record, chunk.get("usage"))
+                delta = _delta(chunk)
+                if not delta:
+                    continue
+                if not text:
+                    record["ttft"] = time.monotonic() - record["sent"]
+                    self._record_ttft(url, record["ttft"])
+                text += delta
+                chunks += 1
+                if stop_when is not None and stop_when(text):
+                    break
+            if record["completion_tokens"] is None:
+                record["completion_tokens"] = chunks  # stopped before the usage chunk; ~1 token per chunk
+            return text
+
+        return self._with_retries(url, lambda u: self._send(u, payload, headers, read, stream=True))
+
+    def chat(
+        self,
+        url: Union[str, EndpointPool],
+        payload: dict,
+        headers: Optional[dict] = None,
+        stop_when: Optional[Callable[[str], bool]] = None,
+    ) -> str:
+        """
+        Run a chat completion and return the first choice's message content.
+        With `stop_when`, the completion is streamed and cut short (see `stream_chat`).
+        """
+        if self.cache is not None:
+            return self.cache.fetch(
+                {**payload, "stream": True} if stop_when else payload,
+                lambda: self._chat(url, payload, headers, stop_when),
+            )
+        return self._chat(url, payload, headers, stop_when)
+
+    def ttft_stats(self) -> Dict[str, dict]:
+        """
+        Time-to-first-token percentiles of streamed requests per endpoint.
+        """
+        with self._lock:
+            ttfts = {endpoint: list(values) for endpoint, values in self._ttfts.items()}
+        return {endpoint: _percentiles(values) for endpoint, values in ttfts.items()}
+
+    def _chat(self, url, payload: dict, headers: Optional[dict], stop_when) -> str:
+        if stop_when is not None:
+            return self.stream_chat(url, payload, headers, stop_when)
+        body = self.post_json(url, payload, headers)
+        try:
+            return body["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError) as e:
+            raise ModelResponseError(f"Unexpected chat completion body: {str(body)[:200]}", url) from e
+
+    def _with_retries(self, target: Union[str, EndpointPool], attempt_fn: Callable[[str], T]) -> T:
+        attempt = 0
+        while True:
+            url = target.acquire() if isinstance(target, EndpointPool) else target
+            endpoint_ok = True
+            try:
+                return attempt_fn(url)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                endpoint_ok = False
+                error = ModelConnectionError(f"{type(e).__name__}: {e}", url)
+                error.__cause__ = e
+            except ModelHTTPError as e:
+                if not e.retryable:
+                    raise
+                endpoint_ok = False
+                error = e
+            finally:
+                if isinstance(target, EndpointPool):
+                    target.release(url, endpoint_ok)
+
+            if attempt >= self.max_retries:
+                raise error
+            delay = self._backoff(attempt)
+            print(f"\t⚠️ {error} — retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+    def _send(self, url: str, payload: dict, headers: Optional[dict], read: Callable, stream: bool = False):
+        """
+        One attempt: POST inside the endpoint's concurrency slot and `read(response, url, record)`,
+        where `record` is the attempt's telemetry record.
+        """
+        record = _start_record(self.telemetry, url, payload, stream)
+        with self.limiter(url).slot() as slot:
+            record["sent"] = time.monotonic()
+            try:
+                try:
+                    response = self.session(url).post(
+                        url, json=payload, headers=headers, timeout=self.timeout, stream=stream
+                    )
+                except requests.Timeout:
+                    slot.overloaded = True
+                    raise
+                except requests.ConnectionError:
+                    slot.dropped = True
+                    raise
+                with response:
+                    record["status"] = response.status_code
+                    slot.overloaded = response.status_code in OVERLOAD_STATUSES
+                    if response.status_code >= 400:
+                        raise ModelHTTPError(response.status_code, response.text, url)
+                    return read(response, url, record)
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"[:300]
+                raise
+            finally:
+                _emit_record(self.telemetry, record)
+
+    def _record_ttft(self, url: str, seconds: float):
+        with self._lock:
+            self._ttfts.setdefault(_endpoint(url), deque(maxlen=200)).append(seconds)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+def _endpoint(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}/"
+
+
+_SSE_DONE = object()
+
+
+def _parse_sse(line: bytes, url: str = ""):
+    """
+    Chunk (dict) of one server-sent-events line of a streamed chat completion,
+    `_SSE_DONE` at the end of the stream, or None for keep-alives.
+    """
+    if not line or not line.startswith(b"data:"):
+        return None
+    data = line[5:].strip()
+    if data == b"[DONE]":
+        return _SSE_DONE
+    try:
+        chunk = json.loads(data)
+    except ValueError as e:
+        raise ModelResponseError(f"Invalid stream chunk: {data[:200]!r}", url) from e
+    if not isinstance(chunk, dict):
+        raise ModelResponseError(f"Invalid stream chunk: {data[:200]!r}", url)
+    return chunk
+
+
+def _delta(chunk: dict) -> str:
+    choices = chunk.get("choices") or [{}]
+    return ((choices[0] or {}).get("delta") or {}).get("content") or ""
+
+
+def _start_record(telemetry: Optional[Telemetry], url: str, payload: dict, stream: bool) -> dict:
+    if telemetry is None:
+        return {"completion_tokens": None}
+    return telemetry.start(_endpoint(url), payload, stream)
+
+
+def _emit_record(telemetry: Optional[Telemetry], record: dict):
+    record["wall"] = time.monotonic() - record.pop("sent")
+    if telemetry is not None:
+        telemetry.emit(record)
+
+
+def _record_usage(record: dict, usage: Optional[dict]):
+    if usage:
+        record["prompt_tokens"] = usage.get("prompt_tokens")
+        record["completion_tokens"] = usage.get("completion_tokens")
+
+
+def _percentiles(values) -> dict:
+    if not values:
+        return {"count": 0, "p50": None, "p95": None}
+    return {
+        "count": len(values),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+    }
+
+
+_DEFAULT_CLIENT: Optional[ModelClient] = None
+_DEFAULT_CLIENT_PID: Optional[int] = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def get_client() -> ModelClient:
+    """
+    Process-wide shared client. Forked workers (e.g. `ProcessPoolExecutor`) get a fresh
+    one instead of sharing the parent's sockets.
+    """
+    global _DEFAULT_CLIENT, _DEFAULT_CLIENT_PID
+    if _DEFAULT_CLIENT is None or _DEFAULT_CLIENT_PID != os.getpid():
+        with _DEFAULT_LOCK:
+            if _DEFAULT_CLIENT is None or _DEFAULT_CLIENT_PID != os.getpid():
+                _DEFAULT_CLIENT = ModelClient(cache=get_response_cache(), telemetry=get_telemetry())
+                _DEFAULT_CLIENT_PID = os.getpid()
+    return _DEFAULT_CLIENT
+
+
+def chat_completion(
+    url: Union[str, EndpointPool],
+    payload: dict,
+    headers: Optional[dict] = None,
+    stop_when: Optional[Callable[[str], bool]] = None,
+) -> str:
+    return get_client().chat(url, payload, headers, stop_when)
@@ -0,0 +1,97 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from src.utils.frame_resize import resize_frame
+
+
+class FrameTier:
+    """
+    One consumer of a multi-rate extraction: its own sampling interval and target size.
+    """
+    def __init__(
+        self,
+        interval_seconds: float,
+        max_side: Optional[int] = None,
+        pixel_budget: Optional[int] = None,
+        multiple_of: int = 1,
+    ):
+        self.interval_seconds = interval_seconds
+        self.max_side = max_side
+        self.pixel_budget = pixel_budget
+        self.multiple_of = multiple_of
+
+    @property
+    def size_spec(self) -> Tuple:
+        return self.max_side, self.pixel_budget, self.multiple_of
+
+
+class MultiRateExtractor:
+    """
+    Decode a video once and fan the frames out to several named tiers
+    (e.g. "annotation" at VLM resolution, "embedding" at 448px for CLIP), each sampled at
+    its own interval and resized to its own target size.
+
+    Frames are picked like `FrameExtractor` with the "grab" backend, or, for tiers
+    given explicit target timestamps (e.g. an `AdaptiveSampler` plan), like its
+    adaptive sampling. FrameStore runs written from these frames use `MODE` in their
+    run key, so they never stand in for a standalone extractor's runs.
+    """
+    MODE = "multirate"  # FrameStore run key mode of frames extracted here
+    def __init__(self, tiers: Dict[str, FrameTier]):
+        if not tiers:
+            raise ValueError("MultiRateExtractor needs at least one tier")
+        self.tiers = tiers
+
+    def extract(self, video_path: str) -> Dict[str, Tuple[List, List[float]]]:
+        """
+        Returns {tier_name: (frames, timestamps)} for every tier.
+        """
+        out = {name: ([], []) for name in self.tiers}
+        for name, frame, ts in self.iter_frames(video_path):
+            out[name][0].append(frame)
+            out[name][1].append(ts)
+        return out
+
+    def iter_frames(
+        self, video_path: str, targets: Optional[Dict[str, List[float]]] = None
+    ) -> Iterator[Tuple[str, np.ndarray, float]]:
+        """
+        Lazily yield (tier_name, frame, timestamp) in decode order. A frame that
+        several tiers want is decoded once and resized once per distinct size.
+        Tiers in `targets` get the first frame at or after each of their timestamps
+        instead of one every `interval_seconds`.
+        """
+        print(f"\tExtracting frames for tiers {list(self.tiers)}...")
+        cap = cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        targets = {name: iter(sorted(ts)) for name, ts in (targets or {}).items()}
+        pending = {name: next(it, None) for name, it in targets.items()}
+        steps = {
+            name: max(1, int(fps * tier.interval_seconds))
+            for name, tier in self.tiers.items() if name not in targets
+        }
+        try:
+            frame_id = 0
+            while cap.grab():
+                due = [name for name, step in steps.items() if frame_id % step == 0]
+                ts = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                for name in list(pending):
+                    if pending[name] is not None and ts + 1e-6 >= pending[name]:
+                        due.append(name)
+                        while pending[name] is not None and pending[name] <= ts + 1e-6:
+                            pending[name] = next(targets[name], None)
+                if due:
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        break
+                    resized = {}
+                    for name in due:
+                        spec = self.tiers[name].size_spec
+                        if spec not in resized:
+                            resized[spec] = resize_frame(frame, *spec)
+                        yield name, resized[spec], ts
+                frame_id += 1
+        finally:
+            cap.release()
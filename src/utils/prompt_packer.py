@@ -0,0 +1,178 @@
+import re
+from functools import lru_cache
+from typing import List, Optional
+
+from src.config import MAX_MODEL_LEN, PROMPT_OUTPUT_RESERVE_TOKENS, PROMPT_TEMPLATE_OVERHEAD_TOKENS
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(name: str):
+    """
+    Tokenizer of a served model (HF repo id or local path), loaded once per process on
+    first use. Falls back to `EstimatedTokenizer` when transformers is not installed or
+    the tokenizer cannot be loaded (offline, gated repo without a token).
+    """
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(name)
+    except Exception as e:
+        print(f"\t⚠️ Tokenizer {name} unavailable ({type(e).__name__}: {e}); "
+              f"estimating {EstimatedTokenizer.CHARS_PER_TOKEN} characters per token")
+        return EstimatedTokenizer()
+
+
+class EstimatedTokenizer:
+    """
+    Stand-in tokenizer with one "token" per `CHARS_PER_TOKEN` characters, for token
+    budgets when the real tokenizer is unavailable.
+    """
+    CHARS_PER_TOKEN = 4
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> List[str]:
+        n = self.CHARS_PER_TOKEN
+        return [text[i:i + n] for i in range(0, len(text), n)]
+
+    def decode(self, ids: List[str]) -> str:
+        return "".join(ids)
+
+    def apply_chat_template(self, messages: List[dict], tokenize: bool = True, add_generation_prompt: bool = False):
+        text = "".join(f"<|{m['role']}|>\n{m['content']}\n" for m in messages)
+        text += "<|assistant|>\n" if add_generation_prompt else ""
+        return self.encode(text) if tokenize else text
+
+
+class PromptPacker:
+    """
+    Fit annotation context into the model's context window.
+
+    The budget for the context is `max_model_len` minus `reserve_output` tokens for the
+    answer, `overhead` tokens for the system prompt and chat template, and the tokens of
+    the prompt itself (rendered with an empty context). Tokens are counted with the
+    served model's tokenizer, loaded on first use (see `get_tokenizer`).
+
+    When the context does not fit, it is trimmed by priority:
+    summary > whole-video annotation > frame annotations. Frames are kept by relevance
+    to the question (word overlap), then put back in time order.
+
+    `stats` counts packed and truncated prompts; `report()` prints them.
+    """
+    def __init__(
+        self,
+        tokenizer_name: str,
+        max_model_len: int = MAX_MODEL_LEN,
+        reserve_output: int = PROMPT_OUTPUT_RESERVE_TOKENS,
+        overhead: int = PROMPT_TEMPLATE_OVERHEAD_TOKENS,
+    ):
+        self.tokenizer_name = tokenizer_name
+        self.max_model_len = max_model_len
+        self.reserve_output = reserve_output
+        self.overhead = overhead
+        self.stats = {"packed": 0, "truncated": 0, "frames_dropped": 0}
+
+    @property
+    def tokenizer(self):
+        return get_tokenizer(self.tokenizer_name)
+
+    def count(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def budget(self, prompt_without_context: str) -> int:
+        """
+        Tokens left for the context in a prompt that is `prompt_without_context` otherwise.
+        """
+        return max(0, self.max_model_len - self.reserve_output - self.overhead - self.count(prompt_without_context))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        ids = self.tokenizer.encode(text, add_special_tokens=False)
+        if len(ids) <= max_tokens:
+            return text
+        if max_tokens <= 1:
+            return ""
+        return self.tokenizer.decode(ids[:max_tokens - 1]) + "…"
+
+    def pack_annotations(self, annotations: dict, query: str, prompt_without_context: str, reserve: int = 0) -> str:
+        """
+        Context text for a video processor `annotations` dict (summary, whole-video
+        annotation, frame annotations) that fits in the prompt, leaving `reserve` more
+        tokens free for text added to the prompt later.
+        """
+        summary = str(annotations.get("annotations_summary") or "")
+        whole = str(annotations.get("whole_video_annotation") or "")
+        frames = annotations.get("frame_annotations") or []
+        budget = max(0, self.budget(prompt_without_context) - reserve)
+        self.stats["packed"] += 1
+
+        full = self._render(summary, whole, [frame_line(f) for f in frames])
+        full_tokens = self.count(full)
+        if full_tokens <= budget:
+            return full
+
+        left = budget - self.count(self._render("", "", []))
+        summary = self.truncate(summary, left)
+        left -= self.count(summary)
+        whole = self.truncate(whole, left)
+        left -= self.count(whole)
+        kept = self._select(frames, query, left)
+        packed = self._render(summary, whole, [frame_line(frames[i]) for i in kept])
+        self._log_truncation(full_tokens, budget, len(kept), len(frames))
+        return packed
+
+    def pack_frames(self, frame_annotations: List[dict], query: str, prompt_without_context: str,
+                    line_overhead: int = 8) -> List[dict]:
+        """
+        The most relevant `frame_annotations` (in time order) whose lines fit in the prompt;
+        `line_overhead` tokens are allowed per line for the caller's own frame labels.
+        """
+        budget = self.budget(prompt_without_context)
+        self.stats["packed"] += 1
+        costs = [self.count(frame_line(f)) + line_overhead for f in frame_annotations]
+        if sum(costs) <= budget:
+            return list(frame_annotations)
+        kept = self._select(frame_annotations, query, budget, costs)
+        self._log_truncation(sum(costs), budget, len(kept), len(frame_annotations))
+        return [frame_annotations[i] for i in kept]
+
+    def report(self):
+        s = self.stats
+        if s["packed"]:
+            print(f"\t✂️ Prompt packer: truncated {s['truncated']}/{s['packed']} prompts, dropped {s['frames_dropped']} frame annotations")
+        return dict(s)
+
+    def _select(self, frames: List[dict], query: str, budget: int, costs: Optional[List[int]] = None) -> List[int]:
+        """
+        Indices of the frames to keep: most relevant first while they fit, returned in time order.
+        """
+        if costs is None:
+            costs = [self.count(frame_line(f)) + 1 for f in frames]
+        query_words = _words(query)
+        scores = [len(query_words & _words(str(f.get("annotation", "")))) for f in frames]
+        kept = []
+        for i in sorted(range(len(frames)), key=lambda i: (-scores[i], i)):
+            if costs[i] <= budget:
+                kept.append(i)
+                budget -= costs[i]
+        return sorted(kept)
+
+    def _log_truncation(self, full_tokens: int, budget: int, kept: int, total: int):
+        self.stats["truncated"] += 1
+        self.stats["frames_dropped"] += total - kept
+        print(f"\t✂️ Context of {full_tokens} tokens trimmed to a {budget}-token budget (kept {kept}/{total} frames)")
+
+    @staticmethod
+    def _render(summary: str, whole: str, frame_lines: List[str]) -> str:
+        frames = "\n".join(frame_lines)
+        return f"Summary:\n{summary}\n\nWhole-video annotation:\n{whole}\n\nFrame annotations:\n{frames}"
+
+
+_STOPWORDS = {"the", "and", "what", "which", "does", "did", "this", "that", "with", "from", "video", "there", "are", "was", "is"}
+
+
+def _words(text: str) -> set:
+    return {w for w in re.findall(r"[a-z0-9]+", text.lower()) if len(w) > 2 and w not in _STOPWORDS}
+
+
+def frame_line(frame: dict) -> str:
+    """
+    "[12.5s] annotation" line of a frame annotation, as used in packed contexts.
+    """
+    return f"[{float(frame.get('timestamp', 0)):.1f}s] {frame.get('annotation', '')}"
@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional
+
+from src.config import RESPONSE_CACHE_MODE, RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_MAX_MB
+
+CACHE_MODES = ("off", "readwrite", "replay")
+
+# Pipeline stage the current model call belongs to (e.g. "frame_annotation", "zero_shot").
+_STAGE: ContextVar[str] = ContextVar("model_stage", default="default")
+
+
+@contextmanager
+def model_stage(name: str):
+    """
+    `with model_stage("zero_shot"): call_model(...)` — label model calls made in the
+    block (cache hit/miss counters, telemetry). Carried into asyncio tasks created inside.
+    """
+    token = _STAGE.set(name)
+    try:
+        yield
+    finally:
+        _STAGE.reset(token)
+
+
+def current_stage() -> str:
+    return _STAGE.get()
+
+
+class ResponseCacheMiss(Exception):
+    """
+    Replay mode was asked for a response that is not in the cache.
+    """
+
+
+class ResponseCache:
+    """
+    Persistent chat-completion cache in SQLite, keyed by sha256 of the request payload
+    (model, messages including base64 image bytes, sampling parameters).
+
+    - `mode`: "readwrite" serves hits and stores misses; "replay" serves hits only and
+      raises `ResponseCacheMiss` instead of calling the model; "off" bypasses the cache.
+    - Entries older than `ttl_seconds` are ignored and evicted; beyond `max_mb` of stored
+      responses the least recently used entries are evicted.
+    - Concurrent identical requests (threads or asyncio tasks of one process) share a
+      single upstream call.
+    - Hits, misses and deduplicated calls are counted per `model_stage` in memory
+      (`report()`) and added to the cumulative database counters (`--stats` CLI) by
+      `flush()`, which `report()` and interpreter exit call.
+    - A hit only reads the database: `last_used` updates are queued and written in
+      batches of `TOUCH_EVERY`, on eviction and on `flush()`.
+    - The asyncio path runs its database I/O in a worker thread.
+
+    Safe for several processes sharing one file (WAL journal).
+    """
+    EVICT_EVERY = 200  # puts between eviction sweeps
+    TOUCH_EVERY = 100  # queued last_used updates written in one transaction
+
+    def __init__(
+        self,
+        path: Path = RESPONSE_CACHE_PATH,
+        mode: str = RESPONSE_CACHE_MODE,
+        ttl_seconds: Optional[float] = RESPONSE_CACHE_TTL_SECONDS,
+        max_mb: Optional[float] = RESPONSE_CACHE_MAX_MB,
+    ):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, expected one of {CACHE_MODES}")
+        self.path = Path(path)
+        self.mode = mode
+        self.ttl_seconds = ttl_seconds
+        self.max_mb = max_mb
+        self.counters: Dict[str, Dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0, "deduped": 0})
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._ainflight: Dict[str, asyncio.Future] = {}
+        self._puts = 0
+        self._flushed: Dict[str, Dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0, "deduped": 0})
+        self._touched: Dict[str, float] = {}
+        self._db = None
+        if mode != "off":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT, stage TEXT, "
+                "response TEXT, created REAL, last_used REAL, size INTEGER)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS stats (stage TEXT PRIMARY KEY, hits INTEGER DEFAULT 0, "
+                "misses INTEGER DEFAULT 0, deduped INTEGER DEFAULT 0)"
+            )
+            self._db.commit()
+            atexit.register(self.flush)
+
+    @staticmethod
+    def key(payload: dict) -> str:
+        # "stream" stays in the key: streamed calls may be cut short by a stop condition
+        canonical = {k: v for k, v in payload.items() if k != "stream_options"}
+        return hashlib.sha256(json.dumps(canonical, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            response, created = row
+            if self.ttl_seconds and time.time() - created > self.ttl_seconds:
+                return None
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.TOUCH_EVERY:
+                self._write_touched()
+                self._db.commit()
+            return response
+
+    def put(self, key: str, payload: dict, response: str):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, payload.get("model", ""), current_stage(), response, now, now, len(response.encode())),
+            )
+            self._db.commit()
+            self._puts += 1
+            if self._puts % self.EVICT_EVERY == 0:
+                self._write_touched()
+                self._evict()
+
+    def fetch(self, payload: dict, compute: Callable[[], str]) -> str:
+        """
+        Cached `compute()` for `payload` (blocking callers).
+        """
+        if self.mode == "off":
+            return compute()
+        key = self.key(payload)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            pending = self._inflight.get(key)
+            if pending is None:
+                self._inflight[key] = future = Future()
+        if pending is not None:
+            self._count("deduped")
+            return pending.result()
+
+        self._count("misses")
+        try:
+            response = compute()
+            self.put(key, payload, response)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def afetch(self, payload: dict, compute: Callable[[], Awaitable[str]]) -> str:
+        """
+        Cached `await compute()` for `payload` (asyncio callers).
+        """
+        if self.mode == "off":
+            return await compute()
+        key = self.key(payload)
+        cached = await asyncio.to_thread(self._lookup, key)
+        if cached is not None:
+            return cached
+
+        pending = self._ainflight.get(key)
+        if pending is not None:
+            self._count("deduped")
+            return await asyncio.shield(pending)
+        future = self._ainflight[key] = asyncio.get_running_loop().create_future()
+
+        self._count("misses")
+        try:
+            response = await compute()
+            await asyncio.to_thread(self.put, key, payload, response)
+            future.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        finally:
+            self._ainflight.pop(key, None)
+
+    def report(self) -> Dict[str, Dict[str, int]]:
+        if self.mode == "off" or not self.counters:
+            return {}
+        parts = [f"{stage} {c['hits']}/{c['hits'] + c['misses'] + c['deduped']}" for stage, c in sorted(self.counters.items())]
+        print(f"\t🗄️ Response cache hits ({self.mode}): " + ", ".join(parts))
+        self.flush()
+        return dict(self.counters)
+
+    def flush(self):
+        """
+        Write queued `last_used` updates and add the counters gathered since the last
+        flush to the database totals, in one transaction.
+        """
+        if self._db is None:
+            return
+        with self._lock:
+            self._write_touched()
+            for stage, c in self.counters.items():
+                delta = {field: n - self._flushed[stage][field] for field, n in c.items()}
+                if not any(delta.values()):
+                    continue
+                self._db.execute("INSERT OR IGNORE INTO stats (stage) VALUES (?)", (stage,))
+                self._db.execute(
+                    "UPDATE stats SET hits = hits + ?, misses = misses + ?, deduped = deduped + ? WHERE stage = ?",
+                    (delta["hits"], delta["misses"], delta["deduped"], stage),
+                )
+                self._flushed[stage] = dict(c)
+            self._db.commit()
+
+    def totals(self) -> Dict[str, Dict[str, int]]:
+        """
+        Hit/miss counters per stage summed over every process that used this database
+        (this process's as of its last `flush()`).
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT stage, hits, misses, deduped FROM stats ORDER BY stage").fetchall()
+        return {stage: {"hits": h, "misses": m, "deduped": d} for stage, h, m, d in rows}
+
+    def clear(self):
+        with self._lock:
+            self._touched.clear()
+            self._flushed = defaultdict(lambda: {"hits": 0, "misses": 0, "deduped": 0}, {
+                stage: dict(c) for stage, c in self.counters.items()
+            })
+            self._db.execute("DELETE FROM responses")
+            self._db.execute("DELETE FROM stats")
+            self._db.commit()
+            self._db.execute("VACUUM")
+
+    def _lookup(self, key: str) -> Optional[str]:
+        cached = self.get(key)
+        if cached is not None:
+            self._count("hits")
+            return cached
+        if self.mode == "replay":
+            self._count("misses")
+            raise ResponseCacheMiss(f"No cached response for request {key[:12]} (stage {current_stage()})")
+        return None
+
+    def _count(self, field: str):
+        stage = current_stage()
+        with self._lock:
+            self.counters[stage][field] += 1
+
+    def _write_touched(self):
+        """
+        Apply queued `last_used` updates (call with the lock held, then commit).
+        """
+        if self._touched:
+            self._db.executemany("UPDATE responses SET last_used = ? WHERE key = ?",
+                                 [(t, k) for k, t in self._touched.items()])
+            self._touched.clear()
+
+    def _evict(self):
+        if self.ttl_seconds:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl_seconds,))
+        if self.max_mb:
+            budget = int(self.max_mb * 1024 * 1024)
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > budget:
+                # Drop least recently used entries until ~90% of the budget is left
+                excess = total - int(0.9 * budget)
+                self._db.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM ("
+                    "SELECT key, SUM(size) OVER (ORDER BY last_used ROWS UNBOUNDED PRECEDING) - size AS before "
+                    "FROM responses) WHERE before < ?)",
+                    (excess,),
+                )
+        self._db.commit()
+
+
+_CACHE: Optional[ResponseCache] = None
+_CACHE_PID: Optional[int] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    Process-wide cache using the `RESPONSE_CACHE_*` settings (reopened in forked workers).
+    """
+    global _CACHE, _CACHE_PID
+    if _CACHE is None or _CACHE_PID != os.getpid():
+        with _CACHE_LOCK:
+            if _CACHE is None or _CACHE_PID != os.getpid():
+                _CACHE = ResponseCache()
+                _CACHE_PID = os.getpid()
+    return _CACHE
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or clear the model response cache.")
+    parser.add_argument("--stats", action="store_true", help="print cumulative hit/miss counters per stage")
+    parser.add_argument("--clear", action="store_true", help="delete every cached response and counter")
+    args = parser.parse_args()
+
+    cache = ResponseCache(mode="readwrite")
+    if args.clear:
+        cache.clear()
+        print(f"✓ Cleared {cache.path}")
+    if args.stats or not args.clear:
+        print(f"{'stage':<24} {'hits':>8} {'misses':>8} {'deduped':>8} {'hit rate':>9}")
+        for stage, c in cache.totals().items():
+            total = c["hits"] + c["misses"] + c["deduped"]
+            print(f"{stage:<24} {c['hits']:>8} {c['misses']:>8} {c['deduped']:>8} {c['hits'] / max(total, 1):>8.0%}")
@@ -0,0 +1,321 @@
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+from typing import Callable, Optional
+
+from aiohttp import web
+
+FILLER = (
+    "A person in a dark jacket stands near a white car on a city street while another person in a red shirt "
+    "walks past carrying a bag and the camera pans slowly to the left showing shops and parked bicycles"
+).split()
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Latency distribution from a spec string, in seconds:
+    "fixed:0.2", "uniform:0.1,0.5", "exp:0.3" (mean) or "lognormal:0.3,0.5" (median, sigma).
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1 / values[0])
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda rng: median * rng.lognormvariate(0, sigma)
+    raise ValueError(f"Unknown latency spec {spec!r}, expected fixed:, uniform:, exp: or lognormal:")
+
+
+def canned_response(prompt: str, output_tokens: int, rng: random.Random, structured: bool = False) -> str:
+    """
+    Response in the format the pipeline stage that built `prompt` expects, about
+    `output_tokens` words of free text where the format allows it. `structured`
+    (a `response_format` request) returns bare JSON instead of a fenced block.
+    """
+    def filler(n: int) -> str:
+        start = rng.randrange(len(FILLER))
+        return " ".join(FILLER[(start + i) % len(FILLER)] for i in range(max(1, n))) + "."
+
+    if "Return as a JSON array" in prompt:
+        # FrameAnnotator: one entry per "Frame i: <ts>s." line
+        timestamps = [float(ts) for ts in re.findall(r"Frame \d+(?: \([^)]*\))?: ([0-9.]+)s\.", prompt)]
+        per_frame = max(8, output_tokens // max(1, len(timestamps)))
+        annotations = [{"timestamp": ts, "annotation": filler(per_frame)} for ts in timestamps]
+        if structured:
+            return json.dumps(annotations)
+        return "```json\n" + json.dumps(annotations, indent=1) + "\n```"
+    if "Answer=[MCQ / OE]" in prompt:
+        # VideoAnswering zero-shot
+        question = prompt.split("Question=", 1)[-1].split("Follow the following format", 1)[0]
+        is_mcq = re.search(r"\([A-E]\)|^\s*[A-E][.)]\s", question, re.M) is not None
+        return f"Answer={'MCQ' if is_mcq else 'OE'}\nThe question {'lists options' if is_mcq else 'is open-ended'}."
+    if "[OPTION]" in prompt:
+        return f"EXPLANATION:\n{filler(output_tokens)}\nANSWER:\n{rng.choice('ABCDE')}\n"
+    if "[OPEN-ENDED ANSWER]" in prompt:
+        return f"EXPLANATION:\n{filler(output_tokens)}\nANSWER:\n{filler(12)}\n"
+    if "generate sub-questions" in prompt:
+        return "\n".join(f"{i}. What does the {w} do in the video?" for i, w in enumerate(rng.sample(FILLER, 5), 1))
+    return filler(output_tokens)
+
+
+class StubServer:
+    """
+    Stand-in for a vLLM OpenAI-compatible server, for offline load and concurrency tests.
+
+    - POST /v1/chat/completions (JSON or `stream: true` server-sent events, with `usage`),
+      GET /v1/models (health probes) and GET /metrics (vLLM-style counters).
+    - Each request waits for one of `max_num_seqs` running slots (like `--max-num-seqs`),
+      then takes a sampled `latency` plus prompt tokens / `prefill_tokens_per_second`
+      before the first token, and completion tokens / `tokens_per_second` to decode.
+      Per-sequence decode slows by `batch_slowdown` for every other running sequence.
+      `None` speeds skip that delay.
+    - Canned responses follow each stage's expected format (see `canned_response`).
+      `response_format` / `guided_json` requests get bare JSON, or a 400 like a server
+      without structured output support when `structured_output` is False.
+    - Failure injection rates: `error_rate` (500), `overload_rate` (503), `disconnect_rate`
+      (connection dropped) and `hang_rate` (no answer for `hang_seconds`).
+
+    Token counts are approximate: words of text, plus `image_tokens` per image.
+    """
+    def __init__(
+        self,
+        latency: str = "lognormal:0.3,0.4",
+        tokens_per_second: Optional[float] = 40.0,
+        prefill_tokens_per_second: Optional[float] = 4000.0,
+        max_num_seqs: int = 10,
+        batch_slowdown: float = 0.05,
+        output_tokens: int = 120,
+        image_tokens: int = 300,
+        error_rate: float = 0.0,
+        overload_rate: float = 0.0,
+        disconnect_rate: float = 0.0,
+        hang_rate: float = 0.0,
+        hang_seconds: float = 600.0,
+        structured_output: bool = True,
+        seed: Optional[int] = None,
+    ):
+        self.latency = parse_latency(latency)
+        self.tokens_per_second = tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.max_num_seqs = max_num_seqs
+        self.batch_slowdown = batch_slowdown
+        self.output_tokens = output_tokens
+        self.image_tokens = image_tokens
+        self.error_rate = error_rate
+        self.overload_rate = overload_rate
+        self.disconnect_rate = disconnect_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.structured_output = structured_output
+        self.rng = random.Random(seed)
+        self.running = 0
+        self.waiting = 0
+        self.counters = {
+            "requests": 0, "completed": 0, "aborted": 0, "errors_injected": 0,
+            "prompt_tokens": 0, "generation_tokens": 0, "peak_running": 0, "peak_waiting": 0,
+        }
+        self._seqs: Optional[asyncio.Semaphore] = None
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=256 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/v1/models", self.models)
+        app.router.add_get("/metrics", self.metrics)
+        return app
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.counters["requests"] += 1
+        failure = self._draw_failure()
+        if failure == "error":
+            return web.json_response({"object": "error", "message": "Injected failure", "code": 500}, status=500)
+        if failure == "overload":
+            return web.json_response({"object": "error", "message": "Server overloaded", "code": 503}, status=503)
+        if failure == "hang":
+            await asyncio.sleep(self.hang_seconds)
+        if failure == "disconnect":
+            request.transport.close()
+            return web.Response(status=500)
+
+        structured = bool(body.get("response_format") or body.get("guided_json"))
+        if structured and not self.structured_output:
+            return web.json_response(
+                {"object": "error", "message": "response_format json_schema is not supported", "code": 400}, status=400
+            )
+
+        prompt, images = _prompt_of(body)
+        prompt_tokens = len(prompt.split()) + images * self.image_tokens
+        text = canned_response(prompt, self.output_tokens, self.rng, structured)
+        tokens = re.findall(r"\S+\s*", text)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens)}
+
+        if self._seqs is None:
+            self._seqs = asyncio.Semaphore(self.max_num_seqs)
+        queued = self._seqs.locked()
+        if queued:
+            self.waiting += 1
+            self.counters["peak_waiting"] = max(self.counters["peak_waiting"], self.waiting)
+        async with self._seqs:
+            if queued:
+                self.waiting -= 1
+            self.running += 1
+            self.counters["peak_running"] = max(self.counters["peak_running"], self.running)
+            try:
+                await asyncio.sleep(self._prefill_seconds(prompt_tokens))
+                self.counters["prompt_tokens"] += prompt_tokens
+                if body.get("stream"):
+                    return await self._stream(request, body, tokens, usage)
+                await asyncio.sleep(sum(self._token_seconds() for _ in tokens))
+                self.counters["generation_tokens"] += len(tokens)
+                self.counters["completed"] += 1
+                return web.json_response({
+                    "id": f"chatcmpl-stub-{self.counters['requests']}",
+                    "object": "chat.completion",
+                    "model": body.get("model", "stub"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+            finally:
+                self.running -= 1
+
+    async def _stream(self, request: web.Request, body: dict, tokens: list, usage: dict) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        model = body.get("model", "stub")
+        try:
+            for token in tokens:
+                chunk = {"object": "chat.completion.chunk", "model": model,
+                         "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.counters["generation_tokens"] += 1
+                await asyncio.sleep(self._token_seconds())
+            if (body.get("stream_options") or {}).get("include_usage"):
+                chunk = {"object": "chat.completion.chunk", "model": model, "choices": [], "usage": usage}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await response.write(b"data: [DONE]\n\n")
+            self.counters["completed"] += 1
+        except (ConnectionResetError, asyncio.CancelledError):
+            # Client closed the stream (e.g. a stop condition): abort like vLLM does
+            self.counters["aborted"] += 1
+        return response
+
+    async def models(self, request: web.Request) -> web.Response:
+        return web.json_response({"object": "list", "data": [{"id": "stub", "object": "model"}]})
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        c = self.counters
+        lines = [
+            f"vllm:num_requests_running {self.running}",
+            f"vllm:num_requests_waiting {self.waiting}",
+            f"vllm:prompt_tokens_total {c['prompt_tokens']}",
+            f"vllm:generation_tokens_total {c['generation_tokens']}",
+            f"vllm:request_success_total {c['completed']}",
+        ]
+        return web.Response(text="\n".join(lines) + "\n")
+
+    def stats(self) -> dict:
+        return {**self.counters, "running": self.running, "waiting": self.waiting}
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Serve from a daemon thread; returns the chat completions URL.
+        """
+        started = threading.Event()
+        address = {}
+
+        async def main():
+            runner = web.AppRunner(self.app())
+            await runner.setup()
+            site = web.TCPSite(runner, host, port)
+            await site.start()
+            address["port"] = site._server.sockets[0].getsockname()[1]
+            started.set()
+            await asyncio.Event().wait()
+
+        threading.Thread(target=lambda: asyncio.run(main()), daemon=True, name="stub-server").start()
+        started.wait()
+        return f"http://{host}:{address['port']}/v1/chat/completions"
+
+    def _draw_failure(self) -> Optional[str]:
+        roll = self.rng.random()
+        for name, rate in (("error", self.error_rate), ("overload", self.overload_rate),
+                           ("disconnect", self.disconnect_rate), ("hang", self.hang_rate)):
+            if roll < rate:
+                self.counters["errors_injected"] += 1
+                return name
+            roll -= rate
+        return None
+
+    def _prefill_seconds(self, prompt_tokens: int) -> float:
+        seconds = self.latency(self.rng)
+        if self.prefill_tokens_per_second:
+            seconds += prompt_tokens / self.prefill_tokens_per_second
+        return seconds
+
+    def _token_seconds(self) -> float:
+        if not self.tokens_per_second:
+            return 0.0
+        return (1 + self.batch_slowdown * max(0, self.running - 1)) / self.tokens_per_second
+
+
+def _prompt_of(body: dict):
+    """
+    (text of the system and last user message, number of images) of a chat completion
+    request; stages may keep their format instructions in the system message.
+    """
+    messages = body.get("messages", [])
+    system = [m for m in messages if m.get("role") == "system"][:1]
+    user = [m for m in messages if m.get("role") == "user"][-1:]
+    texts, images = [], 0
+    for message in system + user:
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+            continue
+        texts += [part.get("text", "") for part in content if part.get("type") == "text"]
+        images += sum(1 for part in content if part.get("type") == "image_url")
+    return "\n".join(texts), images
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stub of a vLLM OpenAI-compatible server for load testing.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", default="lognormal:0.3,0.4", help="fixed:s | uniform:a,b | exp:mean | lognormal:median,sigma")
+    parser.add_argument("--tokens-per-second", type=float, default=40.0, help="decode speed per sequence, 0 = instant")
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=4000.0, help="0 = instant")
+    parser.add_argument("--max-num-seqs", type=int, default=10)
+    parser.add_argument("--batch-slowdown", type=float, default=0.05, help="decode slowdown per extra running sequence")
+    parser.add_argument("--output-tokens", type=int, default=120)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--overload-rate", type=float, default=0.0)
+    parser.add_argument("--disconnect-rate", type=float, default=0.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--no-structured-output", action="store_true", help="reject response_format requests with a 400")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    stub = StubServer(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second or None,
+        prefill_tokens_per_second=args.prefill_tokens_per_second or None,
+        max_num_seqs=args.max_num_seqs,
+        batch_slowdown=args.batch_slowdown,
+        output_tokens=args.output_tokens,
+        error_rate=args.error_rate,
+        overload_rate=args.overload_rate,
+        disconnect_rate=args.disconnect_rate,
+        hang_rate=args.hang_rate,
+        structured_output=not args.no_structured_output,
+        seed=args.seed,
+    )
+    print(f"Stub server on http://{args.host}:{args.port}/v1/chat/completions")
+    web.run_app(stub.app(), host=args.host, port=args.port, print=None)
@@ -0,0 +1,277 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+
+from src.config import TELEMETRY_PATH, TELEMETRY_MAX_MB, TELEMETRY_BACKUPS, TELEMETRY_PROMETHEUS_PORT, \
+    TELEMETRY_PROMPT_PRICE_PER_1K, TELEMETRY_COMPLETION_PRICE_PER_1K
+from src.utils.response_cache import current_stage
+
+# Question the current model call is made for (set by the pipeline stages per example).
+_QID: ContextVar[str] = ContextVar("model_qid", default="")
+
+
+def set_model_qid(qid: str):
+    """
+    Tag model calls made from now on in this thread / asyncio task with `qid`.
+    """
+    _QID.set(qid)
+
+
+def current_qid() -> str:
+    return _QID.get()
+
+
+class Telemetry:
+    """
+    One record per model request attempt: endpoint, stage, qid, model, image count,
+    wall time, time to first token (streamed calls), prompt / completion tokens from
+    the response's `usage`, HTTP status and error.
+
+    - Records are appended as JSON lines to `path`, rotated beyond `max_mb`
+      (`backups` old files are kept as path.1, path.2, ...).
+    - Counters per (endpoint, stage) are kept in memory; `serve(port)` exposes them in
+      Prometheus text format on /metrics.
+
+    `python -m src.utils.telemetry` aggregates the JSONL files into tokens/s per server
+    and cost per qid.
+    """
+    def __init__(
+        self,
+        path: Optional[Path] = TELEMETRY_PATH,
+        max_mb: float = TELEMETRY_MAX_MB,
+        backups: int = TELEMETRY_BACKUPS,
+    ):
+        self.path = Path(path) if path else None
+        self.counters: Dict[tuple, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.Lock()
+        self._logger = None
+        self._server = None
+        if self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._logger = logging.getLogger(f"model_telemetry.{self.path}")
+            self._logger.propagate = False
+            self._logger.setLevel(logging.INFO)
+            if not self._logger.handlers:
+                handler = RotatingFileHandler(self.path, maxBytes=int(max_mb * 1024 * 1024), backupCount=backups)
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                self._logger.addHandler(handler)
+
+    def start(self, endpoint: str, payload: dict, stream: bool = False) -> dict:
+        """
+        New record for a request to `endpoint`; the client fills in the outcome and calls `emit`.
+        """
+        return {
+            "ts": time.time(),
+            "endpoint": endpoint,
+            "stage": current_stage(),
+            "qid": current_qid(),
+            "model": payload.get("model", ""),
+            "images": count_images(payload),
+            "stream": stream,
+            "status": None,
+            "error": None,
+            "wall": None,
+            "ttft": None,
+            "prompt_tokens": None,
+            "completion_tokens": None,
+        }
+
+    def emit(self, record: dict):
+        key = (record["endpoint"], record["stage"])
+        with self._lock:
+            c = self.counters[key]
+            c["requests"] += 1
+            c["errors"] += record["error"] is not None
+            c["seconds"] += record["wall"] or 0
+            c["prompt_tokens"] += record["prompt_tokens"] or 0
+            c["completion_tokens"] += record["completion_tokens"] or 0
+            c["images"] += record["images"]
+        if self._logger:
+            self._logger.info(json.dumps(record))
+
+    def render_prometheus(self) -> str:
+        metrics = {
+            "requests": ("counter", "Model requests (attempts)"),
+            "errors": ("counter", "Failed model requests"),
+            "seconds": ("counter", "Wall time spent in model requests"),
+            "prompt_tokens": ("counter", "Prompt tokens reported by the server"),
+            "completion_tokens": ("counter", "Completion tokens reported by the server"),
+            "images": ("counter", "Images sent"),
+        }
+        with self._lock:
+            counters = {key: dict(c) for key, c in self.counters.items()}
+        lines = []
+        for name, (kind, help_text) in metrics.items():
+            lines.append(f"# HELP model_{name}_total {help_text}")
+            lines.append(f"# TYPE model_{name}_total {kind}")
+            for (endpoint, stage), c in sorted(counters.items()):
+                lines.append(f'model_{name}_total{{endpoint="{endpoint}",stage="{stage}"}} {c.get(name, 0):g}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int):
+        """
+        Serve `render_prometheus()` on http://0.0.0.0:`port`/metrics from a daemon thread.
+        """
+        telemetry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = telemetry.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        except OSError as e:
+            print(f"\t⚠️ Telemetry metrics endpoint not started on port {port}: {e}")
+            return
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="telemetry-metrics").start()
+        print(f"\t📈 Model telemetry on http://0.0.0.0:{port}/metrics")
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+
+def count_images(payload: dict) -> int:
+    count = 0
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            count += sum(1 for part in content if isinstance(part, dict) and part.get("type") == "image_url")
+    return count
+
+
+_TELEMETRY: Optional[Telemetry] = None
+_TELEMETRY_PID: Optional[int] = None
+_TELEMETRY_LOCK = threading.Lock()
+
+
+def get_telemetry() -> Telemetry:
+    """
+    Process-wide telemetry using the `TELEMETRY_*` settings. The metrics endpoint is only
+    started in the first process (forked workers would collide on the port).
+    """
+    global _TELEMETRY, _TELEMETRY_PID
+    if _TELEMETRY is None or _TELEMETRY_PID != os.getpid():
+        with _TELEMETRY_LOCK:
+            if _TELEMETRY is None or _TELEMETRY_PID != os.getpid():
+                first = _TELEMETRY is None
+                _TELEMETRY = Telemetry()
+                _TELEMETRY_PID = os.getpid()
+                if first and TELEMETRY_PROMETHEUS_PORT:
+                    _TELEMETRY.serve(TELEMETRY_PROMETHEUS_PORT)
+    return _TELEMETRY
+
+
+def read_records(path: Path = TELEMETRY_PATH) -> Iterator[dict]:
+    """
+    Records from `path` and its rotated backups, oldest file first.
+    """
+    backups = sorted(glob.glob(f"{path}.[0-9]*"), key=lambda f: int(f.rsplit(".", 1)[1]), reverse=True)
+    for file in backups + [str(path)]:
+        if not os.path.exists(file):
+            continue
+        with open(file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def summarize_servers(records) -> Dict[str, dict]:
+    """
+    Per endpoint: requests, errors, tokens, generation speed (completion tokens per
+    second of request time) and throughput (all tokens per second of wall-clock span).
+    """
+    by_endpoint = defaultdict(list)
+    for r in records:
+        by_endpoint[r["endpoint"]].append(r)
+    summary = {}
+    for endpoint, rs in by_endpoint.items():
+        ok = [r for r in rs if r["error"] is None]
+        prompt = sum(r["prompt_tokens"] or 0 for r in ok)
+        completion = sum(r["completion_tokens"] or 0 for r in ok)
+        busy = sum(r["wall"] or 0 for r in ok)
+        span = max((r["ts"] + (r["wall"] or 0) for r in rs), default=0) - min((r["ts"] for r in rs), default=0)
+        ttfts = [r["ttft"] for r in ok if r.get("ttft") is not None]
+        summary[endpoint] = {
+            "requests": len(rs),
+            "errors": len(rs) - len(ok),
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "gen_tokens_per_s": completion / busy if busy else 0.0,
+            "throughput_tokens_per_s": (prompt + completion) / span if span > 0 else 0.0,
+            "latency_p50": float(np.percentile([r["wall"] for r in ok], 50)) if ok else None,
+            "ttft_p50": float(np.percentile(ttfts, 50)) if ttfts else None,
+        }
+    return summary
+
+
+def summarize_qids(
+    records,
+    prompt_price: float = TELEMETRY_PROMPT_PRICE_PER_1K,
+    completion_price: float = TELEMETRY_COMPLETION_PRICE_PER_1K,
+) -> Dict[str, dict]:
+    by_qid = defaultdict(lambda: {"requests": 0, "images": 0, "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0})
+    for r in records:
+        q = by_qid[r.get("qid") or "-"]
+        q["requests"] += 1
+        q["images"] += r["images"]
+        q["prompt_tokens"] += r["prompt_tokens"] or 0
+        q["completion_tokens"] += r["completion_tokens"] or 0
+        q["seconds"] += r["wall"] or 0
+    for q in by_qid.values():
+        q["cost"] = q["prompt_tokens"] / 1000 * prompt_price + q["completion_tokens"] / 1000 * completion_price
+    return dict(by_qid)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate model call telemetry.")
+    parser.add_argument("--path", type=Path, default=TELEMETRY_PATH, help="telemetry JSONL file (rotated backups are included)")
+    parser.add_argument("--prompt-price", type=float, default=TELEMETRY_PROMPT_PRICE_PER_1K, help="cost per 1k prompt tokens")
+    parser.add_argument("--completion-price", type=float, default=TELEMETRY_COMPLETION_PRICE_PER_1K, help="cost per 1k completion tokens")
+    parser.add_argument("--top", type=int, default=20, help="qids to list, most expensive first")
+    args = parser.parse_args()
+
+    records = list(read_records(args.path))
+    if not records:
+        raise SystemExit(f"No telemetry records in {args.path}")
+
+    print(f"{'endpoint':<40} {'reqs':>6} {'errs':>5} {'prompt tok':>11} {'compl tok':>10} {'gen tok/s':>10} {'tok/s':>8} {'p50 s':>7} {'ttft s':>7}")
+    for endpoint, s in sorted(summarize_servers(records).items()):
+        latency = f"{s['latency_p50']:.2f}" if s["latency_p50"] is not None else "-"
+        ttft = f"{s['ttft_p50']:.2f}" if s["ttft_p50"] is not None else "-"
+        print(f"{endpoint:<40} {s['requests']:>6} {s['errors']:>5} {s['prompt_tokens']:>11} {s['completion_tokens']:>10} "
+              f"{s['gen_tokens_per_s']:>10.1f} {s['throughput_tokens_per_s']:>8.1f} {latency:>7} {ttft:>7}")
+
+    qids = summarize_qids(records, args.prompt_price, args.completion_price)
+    print(f"\n{'qid':<12} {'reqs':>6} {'images':>7} {'prompt tok':>11} {'compl tok':>10} {'seconds':>8} {'cost':>9}")
+    for qid, q in sorted(qids.items(), key=lambda item: -item[1]["cost"])[:args.top]:
+        print(f"{qid:<12} {q['requests']:>6} {q['images']:>7} {q['prompt_tokens']:>11} {q['completion_tokens']:>10} "
+              f"{q['seconds']:>8.1f} {q['cost']:>9.4f}")
+    total = sum(q["cost"] for q in qids.values())
+    print(f"\n{len(qids)} qids, total cost {total:.4f}, mean {total / len(qids):.4f} per qid")
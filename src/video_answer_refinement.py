@@ -8,7 +8,11 @@ import csv
 from tqdm import tqdm
 
 from src.utils.call_qwen2_model import call_qwen2_model
-from src.config import OUTPUT_DIR, SUBMISSION_DIR
+from src.video_answering import VideoAnswering
+from src.utils.response_cache import model_stage, get_response_cache
+from src.utils.telemetry import set_model_qid
+from src.utils.prompt_packer import PromptPacker
+from src.config import OUTPUT_DIR, SUBMISSION_DIR, QWEN_TOKENIZER, ANSWER_SENSE_CHECK_RESERVE_TOKENS
 
 
 LOWER = 200
@@ -41,9 +45,10 @@ class VideoAnswerRefinement:
       If OE: First, answer the sub-questions. Then, use your answer for the sub-questions to answer the main-question.
     """
 
-    def __init__(self, call_model, annot_data_fpath, _range):
+    def __init__(self, call_model, annot_data_fpath, _range, packer=None):
         self.range = _range
         self.call_model = call_model
+        self.packer = packer or PromptPacker(QWEN_TOKENIZER)
         self.all_pred = {}
         self.annot_data = pd.read_parquet(annot_data_fpath)
         sub_fpath = SUBMISSION_DIR / "submission.csv"
@@ -73,20 +78,21 @@ class VideoAnswerRefinement:
 
         return lst
 
-    def _zero_shot(self, question: str) -> str:
+    def _zero_shot(self, question: str, context: str) -> str:
         """
           0 Shot: figure type of question (open ended or mcq)
             - Is the question Open-Ended or MCQ? If it is Open-Ended, answer 'OE'. If it is MCQ, answer it as 'MCQ'.
         """
         # print("\tZero Shot...")
-        prompt = f"""Goal: Figure out the type of question\n
+        prompt = VideoAnswering._context_prefix(context) + f"""Goal: Figure out the type of question\n
       Is the question Open-Ended or MCQ? If it is Open-Ended, answer 'OE'. If it is MCQ, answer it as 'MCQ'.\n
       Question={question}
 
       Follow the following format strictly. Do not include the square brackets '[' and ']'
       Answer=[MCQ / OE]"""
 
-        response = self.call_model(prompt).strip()
+        with model_stage("refinement_zero_shot"):
+            response = self.call_model(prompt, stop_when=VideoAnswering._zero_shot_done).strip()
         response = response.split('Answer=')[-1].split('\n')[0]
         return response
 
@@ -100,12 +106,12 @@ class VideoAnswerRefinement:
         Step 1: For OE questions — check if it makes sense with the context.
         """
         # print("\tOne Shot...")
-        prompt = f"""Goal: Determine whether this question makes sense in the context of the video.\n
-      Context:\n{context}\n
+        prompt = VideoAnswering._context_prefix(context) + f"""Goal: Determine whether this question makes sense in the context of the video.\n
       Question:\n{question}\n
       Does the question makes sense and does the question ask for exist in the video? If not, what is the most relevant entity that exists in the video instead."""
-        response = self.call_model(prompt).strip()
-        return response
+        with model_stage("refinement_one_shot"):
+            response = self.call_model(prompt).strip()
+        return self.packer.truncate(response, ANSWER_SENSE_CHECK_RESERVE_TOKENS)
 
     def _two_shot(self, keyf, question_type: str, question: str, context: str, sub_questions: str, sense_check: str) -> str:
         """
@@ -116,18 +122,28 @@ class VideoAnswerRefinement:
         If OE: First, answer the sub-questions. Then, use your answer for the sub-questions to answer the main-question.
         """
         # print("\tTwo Shot...")
+        prompt = self._two_shot_prompt(keyf, question_type, question, context, sub_questions, sense_check)
+        if prompt is None:
+            return "Invalid question type."
+
+        with model_stage("refinement_two_shot"):
+            return self.extract_answer(self.call_model(prompt, stop_when=VideoAnswering._answer_done))
+
+    @staticmethod
+    def _two_shot_prompt(keyf, question_type: str, question: str, context: str, sub_questions: str, sense_check: str):
         # MCQ Question
         if question_type == "MCQ":
-            prompt = f"""Context:\n{context}\nMain Question:\n{question}\nSub-Questions:\n{sub_questions}\nKeyFrames:{keyf}\nInstructions: Given the context and keyframes, state your multiple-choice answer and explain in a step-by-step manner in the explanation section. Follow the format strictly when responding:\nEXPLANATION:\n[EXPLANATION]\nANSWER:\n[OPTION]\n"""
+            prompt = f"""Main Question:\n{question}\nSub-Questions:\n{sub_questions}\nKeyFrames:{keyf}\nInstructions: Given the context and keyframes, state your multiple-choice answer and explain in a step-by-step manner in the explanation section. Follow the format strictly when responding:\nEXPLANATION:\n[EXPLANATION]\nANSWER:\n[OPTION]\n"""
 
         # Open-Ended Question
         elif question_type == "OE":
-            prompt = f"""Context:\n{context}\nMain Question:\n{question}\nSense Check:{sense_check}\nSub-Questions:\n{sub_questions}\nKeyFrames:{keyf}\nInstructions: Given the context and keyframes, first answer the sub-questions, then use your answers from the sub-questions to help you answer the main question. Explain your answers in a step by step manner in the explanation section. Follow the format strictly when responding:\nEXPLANATION:\n[EXPLANATION]\nANSWER:\n[OPEN-ENDED ANSWER]\n"""
+            prompt = f"""Main Question:\n{question}\nSense Check:{sense_check}\nSub-Questions:\n{sub_questions}\nKeyFrames:{keyf}\nInstructions: Given the context and keyframes, first answer the sub-questions, then use your answers from the sub-questions to help you answer the main question. Explain your answers in a step by step manner in the explanation section. Follow the format strictly when responding:\nEXPLANATION:\n[EXPLANATION]\nANSWER:\n[OPEN-ENDED ANSWER]\n"""
 
         else:
-            return "Invalid question type."
-
-        return self.extract_answer(self.call_model(prompt))
+            return None
+        # Same shared context prefix as the other stages (see VideoAnswering._context_prefix);
+        # the key frames differ per question, so they go after it.
+        return VideoAnswering._context_prefix(context) + prompt
 
     @staticmethod
     def extract_answer(prompt):
@@ -229,6 +245,7 @@ class VideoAnswerRefinement:
     def process(self, example):
         qid = example["qid"]
         vid = example["video_id"]
+        set_model_qid(qid)
         out_path = OUTPUT_DIR / f"{qid}_{vid}.json"
         keyf = self.annot_data[self.annot_data['qid'] == qid]
         print(f"\nProcessing {qid}, video {vid}…")
@@ -239,13 +256,17 @@ class VideoAnswerRefinement:
                 data = json.load(f)
 
             # Extract required fieldds
-            context = str(data["annotations"])
             sub_questions = data["sub_questions"]
             overall_main_question = example["question"] + "\n" + example[
                 "question_prompt"]  # Combine question and question_prompt
+            # Packed once for the longest stage prompt (open-ended two-shot with key frames)
+            context = VideoAnswering.pack_context(
+                self.packer, data["annotations"], overall_main_question, sub_questions,
+                self._two_shot_prompt(keyf, "OE", overall_main_question, "", sub_questions, ""),
+            )
 
             # Step 0
-            q_type = self._zero_shot(overall_main_question)
+            q_type = self._zero_shot(overall_main_question, context)
             # print(q_type)
             if not self.__validate_zero_shot_output(q_type):
                 raise Exception("Invalid zero shot response. Response should be 'OE' or 'MCQ'.")
@@ -262,6 +283,8 @@ class VideoAnswerRefinement:
         else:
             print(f"\tOutput file does not exist: {out_path}")
             answer = ""
+        get_response_cache().report()
+        self.packer.report()
         return answer
         # self._save_result(qid, answer)
 
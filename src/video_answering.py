@@ -1,3 +1,6 @@
+import asyncio
+import re
+import sys
 from concurrent.futures import as_completed, ProcessPoolExecutor
 
 import pandas as pd
@@ -7,8 +10,13 @@ import csv
 
 from tqdm import tqdm
 
-from src.utils.call_qwen2_model import call_qwen2_model
-from src.config import OUTPUT_DIR, SUBMISSION_DIR
+from src.utils.call_qwen2_model import call_qwen2_model, acall_qwen2_model, call_qwen2_pooled, acall_qwen2_pooled
+from src.utils.async_model_client import run_async
+from src.utils.response_cache import model_stage, get_response_cache
+from src.utils.telemetry import set_model_qid
+from src.utils.prompt_packer import PromptPacker
+from src.config import OUTPUT_DIR, SUBMISSION_DIR, MODEL_MAX_CONCURRENCY_PER_ENDPOINT, QWEN_TOKENIZER, \
+  ANSWER_SENSE_CHECK_RESERVE_TOKENS
 
 class VideoAnswering:
   """ Question and Answering
@@ -31,9 +39,16 @@ class VideoAnswering:
         EXPLAINATION:\n{EXPLANATION}
     If OE: First, answer the sub-questions. Then, use your answer for the sub-questions to answer the main-question.
   """
-  def __init__(self, call_model):
+  def __init__(self, call_model, acall_model=None, packer=None, examples=None):
     self.call_model = call_model
+    self.acall_model = acall_model
+    self.packer = packer or PromptPacker(QWEN_TOKENIZER)
     self.all_pred = {}
+    if examples is not None:
+      # Explicit examples (e.g. load tests): no benchmark download, no submission bookkeeping
+      self.processed = pd.DataFrame({'qid': [], 'pred': []})
+      self.to_test = list(examples)
+      return
     self.processed = pd.read_csv(SUBMISSION_DIR / "submission.csv")
     self.benchmark = load_dataset("lmms-lab/AISG_Challenge", split="test")
     self.to_test = self.get_examples_that_exist()
@@ -55,22 +70,40 @@ class VideoAnswering:
 
     return lst
 
-  def _zero_shot(self, question: str) -> str:
+  def _zero_shot(self, question: str, context: str) -> str:
     """
       0 Shot: figure type of question (open ended or mcq)
         - Is the question Open-Ended or MCQ? If it is Open-Ended, answer 'OE'. If it is MCQ, answer it as 'MCQ'.
     """
     #print("\tZero Shot...")
-    prompt = f"""Goal: Figure out the type of question\n
+    with model_stage("zero_shot"):
+      response = self.call_model(self._zero_shot_prompt(question, context), stop_when=self._zero_shot_done).strip()
+    return self._parse_zero_shot(response)
+
+  @staticmethod
+  def _context_prefix(context: str) -> str:
+    # Every stage prompt starts with exactly this text (after the fixed system prompt), so
+    # vLLM's prefix cache reuses the context's KV blocks across the 0/1/2-shot calls and
+    # across questions on the same video. Stage-specific text must only go after it.
+    return f"Video context:\n{context}\n\n"
+
+  @classmethod
+  def _zero_shot_prompt(cls, question: str, context: str) -> str:
+    return cls._context_prefix(context) + f"""Goal: Figure out the type of question\n
       Is the question Open-Ended or MCQ? If it is Open-Ended, answer 'OE'. If it is MCQ, answer it as 'MCQ'.\n
       Question={question}
       
       Follow the following format strictly. Do not include the square brackets '[' and ']'
       Answer=[MCQ / OE]"""
 
-    response = self.call_model(prompt).strip()
-    response = response.split('Answer=')[-1].split('\n')[0]
-    return response
+  @staticmethod
+  def _parse_zero_shot(response: str) -> str:
+    return response.split('Answer=')[-1].split('\n')[0]
+
+  @staticmethod
+  def _zero_shot_done(text: str) -> bool:
+    # Stop streaming once the question type is out; the rest would be ignored by _parse_zero_shot
+    return re.search(r"Answer=(MCQ|OE)\b", text) is not None
 
   def __validate_zero_shot_output(self, zero_shot_output: str) -> bool:
     if zero_shot_output == "MCQ" or zero_shot_output == "OE":
@@ -82,12 +115,15 @@ class VideoAnswering:
     Step 1: For OE questions — check if it makes sense with the context.
     """
     #print("\tOne Shot...")
-    prompt = f"""Goal: Determine whether this question makes sense in the context of the video.\n
-      Context:\n{context}\n
+    with model_stage("one_shot"):
+      response = self.call_model(self._one_shot_prompt(question, context)).strip()
+    return self.packer.truncate(response, ANSWER_SENSE_CHECK_RESERVE_TOKENS)
+
+  @classmethod
+  def _one_shot_prompt(cls, question: str, context: str) -> str:
+    return cls._context_prefix(context) + f"""Goal: Determine whether this question makes sense in the context of the video.\n
       Question:\n{question}\n
       Does the question makes sense and does the question ask for exist in the video? If not, what is the most relevant entity that exists in the video instead."""
-    response = self.call_model(prompt).strip()
-    return response
 
   def _two_shot(self, question_type: str, question: str, context: str, sub_questions: str, sense_check: str) -> str:
     """
@@ -98,24 +134,63 @@ class VideoAnswering:
     If OE: First, answer the sub-questions. Then, use your answer for the sub-questions to answer the main-question.
     """
     #print("\tTwo Shot...")
+    prompt = self._two_shot_prompt(question_type, question, context, sub_questions, sense_check)
+    if prompt is None:
+      return "Invalid question type."
+    with model_stage("two_shot"):
+      return self.extract_answer(self.call_model(prompt, stop_when=self._answer_done))
+
+  @classmethod
+  def _two_shot_prompt(cls, question_type: str, question: str, context: str, sub_questions: str, sense_check: str):
     # MCQ Question
     if question_type == "MCQ":
-      prompt = f"""Context:\n{context}\nMain Question:\n{question}\nSub-Questions:\n{sub_questions}\nInstructions: State your multiple-choice answer and explain in a step-by-step manner in the explanation section. Follow the format strictly when responding:\nEXPLANATION:\n[EXPLANATION]\nANSWER:\n[OPTION]\n"""
+      prompt = f"""Main Question:\n{question}\nSub-Questions:\n{sub_questions}\nInstructions: State your multiple-choice answer and explain in a step-by-step manner in the explanation section. Follow the format strictly when responding:\nEXPLANATION:\n[EXPLANATION]\nANSWER:\n[OPTION]\n"""
 
     # Open-Ended Question
     elif question_type == "OE":
-      prompt = f"""Context:\n{context}\nMain Question:\n{question}\nSense Check:{sense_check}\nSub-Questions:\n{sub_questions}\nInstructions: First answer the sub-questions, then use your answers from the sub-questions to help you answer the main question. Explain your answers in a step by step manner in the explanation section. Follow the format strictly when responding:\nEXPLANATION:\n[EXPLANATION]\nANSWER:\n[OPEN-ENDED ANSWER]\n"""
+      prompt = f"""Main Question:\n{question}\nSense Check:{sense_check}\nSub-Questions:\n{sub_questions}\nInstructions: First answer the sub-questions, then use your answers from the sub-questions to help you answer the main question. Explain your answers in a step by step manner in the explanation section. Follow the format strictly when responding:\nEXPLANATION:\n[EXPLANATION]\nANSWER:\n[OPEN-ENDED ANSWER]\n"""
 
     else:
-      return "Invalid question type."
+      return None
+
+    return cls._context_prefix(context) + prompt
+
+  def _shared_context(self, annotations: dict, question: str, sub_questions: str) -> str:
+    """
+    Video context packed once per question and reused verbatim by all three stages, sized
+    for the longest stage prompt (open-ended two-shot, including its sense check).
+    """
+    return self.pack_context(
+      self.packer, annotations, question, sub_questions,
+      self._two_shot_prompt("OE", question, "", sub_questions, ""),
+    )
 
-    return self.extract_answer(self.call_model(prompt))
+  @staticmethod
+  def pack_context(packer: PromptPacker, annotations: dict, question: str, sub_questions: str,
+                   longest_prompt: str) -> str:
+    """
+    Context shared by every stage of a question: `annotations` packed to fit
+    `longest_prompt` (the longest stage prompt without context) plus a sense check of
+    at most ANSWER_SENSE_CHECK_RESERVE_TOKENS tokens.
+    """
+    return packer.pack_annotations(
+      annotations,
+      f"{question}\n{sub_questions}",
+      longest_prompt,
+      reserve=ANSWER_SENSE_CHECK_RESERVE_TOKENS,
+    )
 
   @staticmethod
   def extract_answer(prompt):
     lines = prompt.split("\n")
     return lines[lines.index('ANSWER:') + 1]
 
+  @staticmethod
+  def _answer_done(text: str) -> bool:
+    # The line after 'ANSWER:' is complete, which is all extract_answer reads
+    lines = text.split("\n")
+    return 'ANSWER:' in lines and lines.index('ANSWER:') + 1 < len(lines) - 1
+
   def _save_result(self, qid: str, pred: str):
     self.all_pred[qid] = pred
 
@@ -210,6 +285,7 @@ class VideoAnswering:
   def process(self, example):
     qid = example["qid"]
     vid = example["video_id"]
+    set_model_qid(qid)
     out_path = OUTPUT_DIR / f"{qid}_{vid}.json"
     print(f"\nProcessing {qid}, video {vid}…")
 
@@ -219,12 +295,12 @@ class VideoAnswering:
         data = json.load(f)
 
       # Extract required fieldds
-      context = str(data["annotations"])
       sub_questions = data["sub_questions"]
       overall_main_question = example["question"] + "\n" + example["question_prompt"] # Combine question and question_prompt
+      context = self._shared_context(data["annotations"], overall_main_question, sub_questions)
 
       # Step 0
-      q_type = self._zero_shot(overall_main_question)
+      q_type = self._zero_shot(overall_main_question, context)
       #print(q_type)
       if not self.__validate_zero_shot_output(q_type):
         raise Exception("Invalid zero shot response. Response should be 'OE' or 'MCQ'.")
@@ -241,9 +317,81 @@ class VideoAnswering:
     else:
       print(f"\tOutput file does not exist: {out_path}")
       answer = ""
+    get_response_cache().report()
+    self.packer.report()
     return answer
     #self._save_result(qid, answer)
 
+  async def aprocess(self, example):
+    """
+    Async `process` using `acall_model` (same 0/1/2-shot steps).
+    """
+    qid = example["qid"]
+    vid = example["video_id"]
+    set_model_qid(qid)
+    out_path = OUTPUT_DIR / f"{qid}_{vid}.json"
+    print(f"\nProcessing {qid}, video {vid}…")
+
+    if not out_path.exists():
+      print(f"\tOutput file does not exist: {out_path}")
+      return ""
+
+    with open(out_path, "r", encoding="utf-8") as f:
+      data = json.load(f)
+    sub_questions = data["sub_questions"]
+    overall_main_question = example["question"] + "\n" + example["question_prompt"]
+    context = self._shared_context(data["annotations"], overall_main_question, sub_questions)
+
+    with model_stage("zero_shot"):
+      q_type = self._parse_zero_shot((await self.acall_model(
+        self._zero_shot_prompt(overall_main_question, context), stop_when=self._zero_shot_done
+      )).strip())
+    if not self.__validate_zero_shot_output(q_type):
+      raise Exception("Invalid zero shot response. Response should be 'OE' or 'MCQ'.")
+
+    if q_type == "OE":
+      with model_stage("one_shot"):
+        sense_check = (await self.acall_model(self._one_shot_prompt(overall_main_question, context))).strip()
+      sense_check = self.packer.truncate(sense_check, ANSWER_SENSE_CHECK_RESERVE_TOKENS)
+    else:
+      sense_check = 'N/A'
+
+    prompt = self._two_shot_prompt(q_type, overall_main_question, context, sub_questions, sense_check)
+    with model_stage("two_shot"):
+      answer = self.extract_answer(await self.acall_model(prompt, stop_when=self._answer_done))
+    get_response_cache().report()
+    self.packer.report()
+    return answer
+
+  async def abatch_process(self, max_concurrency: int = MODEL_MAX_CONCURRENCY_PER_ENDPOINT):
+    """
+    Async `batch_process`: up to `max_concurrency` examples in flight from one process.
+    """
+    qids = []
+    preds = []
+    errors = []
+    slots = asyncio.Semaphore(max_concurrency)
+
+    async def process_one(ex):
+      async with slots:
+        try:
+          pred = await self.aprocess(ex)
+          qids.append(ex["qid"])
+          preds.append(pred)
+        except Exception as e:
+          errors.append({ex["qid"]: repr(e)})
+
+    await asyncio.gather(*(process_one(ex) for ex in self.to_test))
+
+    df = pd.DataFrame({"qid": qids, "pred": preds})
+    df = pd.concat([self.processed, df], ignore_index=True)
+    df.to_csv(SUBMISSION_DIR / "submission.csv", index=False)
+
+    with open(SUBMISSION_DIR / "errors.json", "w") as f:
+      json.dump(errors, f, indent=2)
+
+    print(f"✓ Done.  {len(qids)} succeeded, {len(errors)} failed.")
+
 if __name__ == "__main__":
     # Dataset
     """print("Loading Dataset...")
@@ -255,4 +403,12 @@ if __name__ == "__main__":
 
     # Video Answering"""
     print("[Video Answering]")
-    VideoAnswering(call_qwen2_model).batch_process(3)
\ No newline at end of file
+    if "--pool" in sys.argv:
+      # Spread the answering calls over every server in QWEN_ENDPOINTS
+      call_model, acall_model = call_qwen2_pooled, acall_qwen2_pooled
+    else:
+      call_model, acall_model = call_qwen2_model, acall_qwen2_model
+    if "--async" in sys.argv:
+      run_async(VideoAnswering(call_model, acall_model).abatch_process())
+    else:
+      VideoAnswering(call_model).batch_process(3)
\ No newline at end of file
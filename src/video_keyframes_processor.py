@@ -11,6 +11,9 @@ from src.config import OUTPUT_DIR, SKIP_PROCESSED_VIDEOS,\
       VLLM_API_URL_5, VLLM_API_URL_6, VLLM_API_URL_7, VLLM_API_URL_8, \
       VLLM_API_URL_9
 from src.utils.call_mistral_model import call_mistral_vllm
+from src.utils.endpoint_pool import get_vllm_pool
+from src.utils.response_cache import get_response_cache
+from src.utils.telemetry import set_model_qid
 from src.utils.downloader import VideoDownloader
 from src.utils.frame_extractor import FrameExtractor
 from src.annotator import (
@@ -20,12 +23,18 @@ from src.annotator import (
 
 class VideoKeyFramesProcessor:
     def __init__(self, call_model, vllm_url):
-        self.frame_annotator = FrameAnnotator(call_model, processBlob=True, vllm_url=vllm_url)
+        self.frame_annotator = FrameAnnotator(call_model, processBlob=True, vllm_url=vllm_url, stage="keyframe_annotation")
 
     def process(self, example: dict, example_keyframes_data, example_current_result: dict, out_path: str):
         qid, vid = example["qid"], example["video_id"]
+        set_model_qid(qid)
         print(f"\nProcessing {qid}, video {vid}…")
 
+        done = "keyframes_annotations" in example_current_result.get("annotations", {})
+        if SKIP_PROCESSED_VIDEOS and done and not self.frame_annotator.retryable_batches(qid, vid):
+            print(f"\t✅ Already done: {out_path}")
+            return
+
         # Extract timestamps and frames
         timestamps = []
         keyframes = []
@@ -42,6 +51,8 @@ class VideoKeyFramesProcessor:
         if keyframes_anns:
             example_current_result["annotations"]["keyframes_annotations"] = keyframes_anns
             self._save_result(example_current_result, out_path)
+            self.frame_annotator.finish_checkpoint(qid, vid)
+        get_response_cache().report()
 
     @staticmethod
     def _save_result(data: dict, path):
@@ -56,6 +67,12 @@ class VideoKeyFramesProcessor:
     
     @staticmethod
     def _map_server_number_to_vllm_url(server_number: str):
+        """
+        "pool" routes every request across all `VLLM_ENDPOINTS` (see EndpointPool);
+        a number pins the run to that one server.
+        """
+        if server_number == "pool":
+            return get_vllm_pool()
         if server_number == "1":
             return VLLM_API_URL_1
         if server_number == "2":
@@ -84,8 +101,9 @@ if __name__ == "__main__":
     dataset = load_dataset("lmms-lab/AISG_Challenge", split="test")
     print(dataset)
 
-    server_number = sys.argv[2] if len(sys.argv) > 2 else 1
+    server_number = sys.argv[2] if len(sys.argv) > 2 else "pool"
     print(f"Using Server {server_number}")
+    vllm_url = VideoKeyFramesProcessor._map_server_number_to_vllm_url(server_number)
 
     # Split into chunks of 60
     total_examples = len(dataset)
@@ -133,7 +151,7 @@ if __name__ == "__main__":
             print("Skipping... No keyframes exist.")
             continue
 
-        VideoKeyFramesProcessor(call_mistral_vllm, VideoKeyFramesProcessor._map_server_number_to_vllm_url(server_number)).process(
+        VideoKeyFramesProcessor(call_mistral_vllm, vllm_url).process(
             example, 
             example_keyframes_data, 
             example_current_result,
@@ -0,0 +1,135 @@
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator, Tuple
+
+from datasets import load_dataset
+
+from src.config import EMBEDDING_FRAME_INTERVAL_SECONDS, EMBEDDING_FRAME_MAX_SIDE, VLLM_API_URL, CLIP_SERVER_URL
+from src.utils.call_mistral_model import call_mistral_vllm
+from src.utils.downloader import VideoDownloader
+from src.utils.frame_encoder import encode_frame
+from src.utils.multi_rate_extractor import MultiRateExtractor, FrameTier
+from src.video_processor import VideoProcessor
+from src.video_vectorizer import FrameVectorizer
+
+
+class SharedDecodePipeline:
+    """
+    Run the Video Processor (annotation tier) and the Video Vectorizer (embedding tier)
+    off a single decode of each video instead of decoding it once per stage.
+
+    Annotation frames are JPEG-encoded once, written to the processor's FrameStore (so
+    the vectorizer's keyframes and reruns are served from it) and streamed to the
+    annotator batch by batch. They follow the processor's extractor settings,
+    including `FRAME_SAMPLING = "adaptive"`. Embedding frames are streamed through a bounded queue to
+    the vectorizer, which runs alongside on its own thread.
+    """
+    EMBEDDING_BUFFER = 256  # embedding frames queued for the vectorizer before decoding waits
+
+    def __init__(self, call_model, vllm_url, clip_server_url: str = CLIP_SERVER_URL):
+        self.downloader = VideoDownloader()
+        self.processor = VideoProcessor(call_model, vllm_url)
+        self.vectorizer = FrameVectorizer(clip_server_url)
+        annotation = self.processor.extractor
+        self.extractor = MultiRateExtractor({
+            "annotation": FrameTier(
+                annotation.interval_seconds, annotation.max_side, annotation.pixel_budget, annotation.multiple_of
+            ),
+            "embedding": FrameTier(EMBEDDING_FRAME_INTERVAL_SECONDS, EMBEDDING_FRAME_MAX_SIDE),
+        })
+
+    def process(self, example: dict):
+        if self.processor.uses_coarse_to_fine(example):
+            # Long video: coarse-to-fine extracts its own frames and writes the keyframe
+            # parquet, so there is no dense annotation or embedding tier to decode.
+            self.processor.process(example)
+            return
+
+        video_path = self.downloader.download(
+            example["youtube_url"], example["qid"], example["video_id"]
+        )
+
+        embedding_frames = queue.Queue(maxsize=self.EMBEDDING_BUFFER)
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="vectorizer") as pool:
+            vectorizing = pool.submit(
+                self.vectorizer.process, example, encoded_frames=_drain(embedding_frames), video_path=video_path
+            )
+            end = _ABORT
+            try:
+                batches = self._route(video_path, embedding_frames, vectorizing)
+                self.processor.process(example, batches=batches)
+                for _ in batches:  # drain if the processor skipped the video
+                    pass
+                end = None
+            finally:
+                _offer(embedding_frames, end, vectorizing)
+        vectorizing.result()
+
+    def _route(self, video_path: str, embedding_frames: queue.Queue, vectorizing: Future):
+        batch_size = self.processor.frame_annotator.frames_per_request
+        extractor = self.processor.extractor
+        store = extractor.store
+        video_hash = store.video_hash(video_path) if store else None
+        if extractor.sampling == "adaptive":
+            targets = {"annotation": extractor.sampler.plan(video_path)}
+            mode = f"{self.extractor.MODE}-{extractor.sampler.key}"
+        else:
+            targets, mode = None, self.extractor.MODE
+        frames, timestamps, stored = [], [], []
+        for tier, frame, ts in self.extractor.iter_frames(video_path, targets):
+            if tier == "embedding":
+                _offer(embedding_frames, (encode_frame(frame, quality=95), ts), vectorizing)
+                continue
+            jpeg = encode_frame(frame, extractor.jpeg_quality)
+            if store:
+                store.put(video_hash, ts, extractor.resolution_key, extractor.jpeg_quality, jpeg)
+                stored.append(ts)
+            frames.append(jpeg)
+            timestamps.append(ts)
+            if len(frames) == batch_size:
+                yield frames, timestamps
+                frames, timestamps = [], []
+        if frames:
+            yield frames, timestamps
+        if store:
+            run_key = store.run_key(video_hash, extractor.interval_seconds, mode, extractor.resolution_key, extractor.jpeg_quality)
+            store.put_run(run_key, stored)
+
+
+# End of the embedding stream when the annotation side failed: the vectorizer stops
+# without saving a partial result.
+_ABORT = object()
+
+
+def _offer(q: queue.Queue, item, consumer: Future):
+    """
+    Put `item` on `q`, unless the consumer has already returned (e.g. skipped the video).
+    """
+    while not consumer.done():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _drain(q: queue.Queue) -> Iterator[Tuple[bytes, float]]:
+    while True:
+        item = q.get()
+        if item is None:
+            return
+        if item is _ABORT:
+            raise RuntimeError("Frame extraction stopped before the end of the video")
+        yield item
+
+
+if __name__ == "__main__":
+    # Dataset
+    print("Loading Dataset...")
+    dataset = load_dataset("lmms-lab/AISG_Challenge", split="test")
+    print(dataset)
+
+    print("[Shared Decode: Video Processing + Vectorizing]")
+    pipeline = SharedDecodePipeline(call_mistral_vllm, VLLM_API_URL)
+    for example in dataset:
+        pipeline.process(example)
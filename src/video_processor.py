@@ -1,45 +1,88 @@
+import asyncio
 import json
-from typing import Callable, Any
+import sys
+import time
+from typing import Callable, Any, Awaitable, Iterable, List, Optional, Tuple
 from datasets import load_dataset
-from src.config import OUTPUT_DIR, SKIP_PROCESSED_VIDEOS, VLLM_API_URL
-from src.utils.call_mistral_model import call_mistral_vllm
+from src.config import OUTPUT_DIR, ERROR_DIR, SKIP_PROCESSED_VIDEOS, VLLM_API_URL, USE_FRAME_STORE, FRAME_DEDUP, FRAME_SAMPLING, \
+    ANNOTATION_FRAME_MAX_SIDE, ANNOTATION_FRAME_PIXEL_BUDGET, VLM_IMAGE_TOKEN_PIXELS, \
+    COARSE_TO_FINE, COARSE_TO_FINE_MIN_DURATION_SECONDS, ANNOTATION_TILES_PER_IMAGE, MODEL_MAX_CONCURRENCY_PER_ENDPOINT, \
+    ANNOTATION_PARALLEL_WINDOWS
+from src.utils.call_mistral_model import call_mistral_vllm, acall_mistral_vllm
+from src.utils.async_model_client import run_async
+from src.utils.model_client import ModelClientError
+from src.utils.response_cache import model_stage, get_response_cache
+from src.utils.telemetry import set_model_qid
 from src.utils.downloader import VideoDownloader
 from src.utils.frame_extractor import FrameExtractor
+from src.utils.frame_store import FrameStore
 from src.annotator import (
     FrameAnnotator, VideoAnnotator,
-    AnnotationSummarizer
+    AnnotationSummarizer, CoarseToFineAnnotator
 )
 
 class SubQuestionGenerator:
-    def __init__(self, call_model: Callable[..., Any], vllm_url):
+    def __init__(self, call_model: Callable[..., Any], vllm_url, acall_model: Optional[Callable[..., Awaitable[str]]] = None):
         self.call_model = call_model
+        self.acall_model = acall_model
         self.vllm_url = vllm_url
 
     def generate(self, main_question: str) -> Any:
         print("\tGenerating sub-questions...")
-        prompt = (
+        with model_stage("sub_questions"):
+            return self.call_model(self.vllm_url, self._build_prompt(main_question))
+
+    async def agenerate(self, main_question: str) -> Any:
+        print("\tGenerating sub-questions...")
+        with model_stage("sub_questions"):
+            return await self.acall_model(self.vllm_url, self._build_prompt(main_question))
+
+    @staticmethod
+    def _build_prompt(main_question: str) -> str:
+        return (
             f"Given the main question: '{main_question}', generate sub-questions to better understand the video. Subquestions generated should be adversarial in nature, to ensure robustness of the model response to the main question."
         )
-        return self.call_model(self.vllm_url, prompt)
 
 
 class VideoProcessor:
-    def __init__(self, call_model, vllm_url):
+    def __init__(
+        self, call_model, vllm_url, sampling: str = FRAME_SAMPLING, coarse_to_fine: bool = COARSE_TO_FINE,
+        acall_model: Optional[Callable[..., Awaitable[str]]] = None
+    ):
         self.downloader = VideoDownloader()
-        self.extractor = FrameExtractor()
-        self.frame_annotator = FrameAnnotator(call_model, vllm_url=vllm_url)
-        self.video_annotator = VideoAnnotator(call_model, vllm_url=vllm_url)
-        self.summarizer = AnnotationSummarizer(call_model, vllm_url=vllm_url)
-        self.subq_gen = SubQuestionGenerator(call_model, vllm_url=vllm_url)
+        self.extractor = FrameExtractor(
+            store=FrameStore() if USE_FRAME_STORE else None,
+            max_side=ANNOTATION_FRAME_MAX_SIDE,
+            pixel_budget=ANNOTATION_FRAME_PIXEL_BUDGET,
+            multiple_of=VLM_IMAGE_TOKEN_PIXELS,
+            sampling=sampling,
+        )
+        self.frame_annotator = FrameAnnotator(
+            call_model, vllm_url=vllm_url, dedup=FRAME_DEDUP, tiles_per_image=ANNOTATION_TILES_PER_IMAGE,
+            acall_model=acall_model, windows=ANNOTATION_PARALLEL_WINDOWS
+        )
+        self.coarse_to_fine = CoarseToFineAnnotator(self.frame_annotator, self.extractor) if coarse_to_fine else None
+        self.video_annotator = VideoAnnotator(call_model, vllm_url=vllm_url, acall_model=acall_model)
+        self.summarizer = AnnotationSummarizer(
+            call_model, vllm_url=vllm_url, acall_model=acall_model, packer=self.video_annotator.packer
+        )
+        self.subq_gen = SubQuestionGenerator(call_model, vllm_url=vllm_url, acall_model=acall_model)
         self.vllm_url = vllm_url
 
-    def process(self, example: dict):
+    def process(self, example: dict, batches: Optional[Iterable[Tuple[List, List[float]]]] = None):
+        """
+        Annotate one example end to end. `batches` are pre-extracted
+        (frames, timestamps) batches (e.g. from a shared `MultiRateExtractor`
+        pass); when omitted the video is decoded here. Long videos go through
+        coarse-to-fine (when enabled) and leave `batches` unread.
+        """
         qid = example["qid"]
         vid = example["video_id"]
+        set_model_qid(qid)
         out_path = OUTPUT_DIR / f"{qid}_{vid}.json"
         print(f"\nProcessing {qid}, video {vid}…")
 
-        if SKIP_PROCESSED_VIDEOS and out_path.exists():
+        if SKIP_PROCESSED_VIDEOS and self._already_done(out_path, qid, vid):
             print(f"\t✅ Already done: {out_path}")
             return
 
@@ -49,28 +92,136 @@ class VideoProcessor:
         )
 
         # 1. Sub-questions
-        subqs = self.subq_gen.generate(example["question"])
+        errors = {}
+        subqs = self._guarded("sub_questions", errors, qid, vid, self.subq_gen.generate, example["question"])
 
-        # 2. Extract frames
-        frames, timestamps = self.extractor.extract(video_path)
+        if self.uses_coarse_to_fine(example):
+            # 2-3a. Coarse pass over the whole video, fine pass over question-relevant segments
+            frame_anns = self.coarse_to_fine.annotate(
+                video_path, example["question"], subqs, qid, vid
+            )
+        else:
+            # 2. Extract frames (lazily, one annotator batch at a time)
+            if batches is None:
+                batches = self.extractor.iter_encoded_batches(video_path, self.frame_annotator.frames_per_request)
 
-        # 3a. Frame-level annotations
-        frame_anns = self.frame_annotator.annotate(
-            frames, timestamps, example["question"], subqs, qid, vid
-        )
+            # 3a. Frame-level annotations
+            frame_anns = self.frame_annotator.annotate_batches(
+                batches, example["question"], subqs, qid, vid
+            )
 
         # 3b. Video-level annotation
-        whole_ann = self.video_annotator.annotate(
-            example["question"], subqs, frame_anns
+        whole_ann = self._guarded(
+            "video_annotation", errors, qid, vid, self.video_annotator.annotate, example["question"], subqs, frame_anns
         )
 
         # 4. Summarize
-        summary = self.summarizer.summarize(frame_anns, whole_ann)
+        summary = self._guarded("summary", errors, qid, vid, self.summarizer.summarize, frame_anns, whole_ann)
 
         # 5. Save everything
+        self._save_result(self._build_result(example, video_path, subqs, frame_anns, whole_ann, summary, errors), out_path)
+        self.frame_annotator.finish_checkpoint(qid, vid)
+        get_response_cache().report()
+        self.video_annotator.packer.report()
+
+    async def aprocess(self, example: dict):
+        """
+        Async `process` using `acall_model`. Frame batches are annotated concurrently;
+        download, decoding and the coarse-to-fine pass run on worker threads.
+        """
+        qid = example["qid"]
+        vid = example["video_id"]
+        set_model_qid(qid)
+        out_path = OUTPUT_DIR / f"{qid}_{vid}.json"
+        print(f"\nProcessing {qid}, video {vid}…")
+
+        if SKIP_PROCESSED_VIDEOS and self._already_done(out_path, qid, vid):
+            print(f"\t✅ Already done: {out_path}")
+            return
+
+        video_path = await asyncio.to_thread(self.downloader.download, example["youtube_url"], qid, vid)
+        errors = {}
+        subqs = await self._aguarded("sub_questions", errors, qid, vid, self.subq_gen.agenerate, example["question"])
+
+        if self.uses_coarse_to_fine(example):
+            frame_anns = await asyncio.to_thread(
+                self.coarse_to_fine.annotate, video_path, example["question"], subqs, qid, vid
+            )
+        else:
+            batches = self.extractor.iter_encoded_batches(video_path, self.frame_annotator.frames_per_request)
+            frame_anns = await self.frame_annotator.aannotate_batches(
+                batches, example["question"], subqs, qid, vid
+            )
+
+        whole_ann = await self._aguarded(
+            "video_annotation", errors, qid, vid, self.video_annotator.aannotate, example["question"], subqs, frame_anns
+        )
+        summary = await self._aguarded("summary", errors, qid, vid, self.summarizer.asummarize, frame_anns, whole_ann)
+        self._save_result(self._build_result(example, video_path, subqs, frame_anns, whole_ann, summary, errors), out_path)
+        self.frame_annotator.finish_checkpoint(qid, vid)
+        get_response_cache().report()
+        self.video_annotator.packer.report()
+
+    async def aprocess_many(self, examples: Iterable[dict], max_videos: int = MODEL_MAX_CONCURRENCY_PER_ENDPOINT):
+        """
+        Process up to `max_videos` examples at once; one failing example does not stop the rest.
+        """
+        videos = asyncio.Semaphore(max_videos)
+
+        async def process_one(example):
+            async with videos:
+                try:
+                    await self.aprocess(example)
+                except Exception as e:
+                    print(f"❌ {example['qid']}: {e}")
+
+        await asyncio.gather(*(process_one(example) for example in examples))
+
+    def _already_done(self, out_path, qid: str, vid: str) -> bool:
+        """
+        True if `out_path` exists with no failed stage and no frame batch left to retry.
+        """
+        if not out_path.exists() or self.frame_annotator.retryable_batches(qid, vid):
+            return False
+        try:
+            with open(out_path, "r", encoding="utf-8") as f:
+                return not json.load(f).get("errors")
+        except ValueError:
+            return False
+
+    def _guarded(self, stage: str, errors: dict, qid: str, vid: str, fn: Callable[..., Any], *args) -> Any:
+        """
+        `fn(*args)`, or "" after recording a failed model request (the other stages go on,
+        and the video is redone on the next run).
+        """
+        try:
+            return fn(*args)
+        except ModelClientError as err:
+            self._write_error(stage, err, errors, qid, vid)
+            return ""
+
+    async def _aguarded(self, stage: str, errors: dict, qid: str, vid: str, fn: Callable[..., Awaitable[Any]], *args) -> Any:
+        try:
+            return await fn(*args)
+        except ModelClientError as err:
+            self._write_error(stage, err, errors, qid, vid)
+            return ""
+
+    @staticmethod
+    def _write_error(stage: str, err: Exception, errors: dict, qid: str, vid: str):
+        """
+        Record a failed stage in `errors` and append it to error/<qid>_<vid>.jsonl.
+        """
+        print(f"\t⚠️ {stage} failed, left empty: {err}")
+        errors[stage] = str(err)
+        with open(ERROR_DIR / f"{qid}_{vid}.jsonl", "a") as f:
+            f.write(json.dumps({"time": time.time(), "stage": stage, "timestamps": [], "error": str(err)}) + "\n")
+
+    @staticmethod
+    def _build_result(example: dict, video_path, subqs, frame_anns, whole_ann, summary, errors: Optional[dict] = None) -> dict:
         result = {
-            "qid": qid,
-            "video_id": vid,
+            "qid": example["qid"],
+            "video_id": example["video_id"],
             "video_path": video_path,
             "main_question": example["question"],
             "sub_questions": subqs,
@@ -80,7 +231,17 @@ class VideoProcessor:
                 "annotations_summary": summary
             }
         }
-        self._save_result(result, out_path)
+        if errors:
+            result["errors"] = errors
+        return result
+
+    def uses_coarse_to_fine(self, example: dict) -> bool:
+        """
+        True if `example` is annotated by the coarse-to-fine pass, which also writes its
+        keyframe parquet (so the dense embedding pass is skipped).
+        """
+        return self.coarse_to_fine is not None and \
+            float(example.get("duration") or 0) >= COARSE_TO_FINE_MIN_DURATION_SECONDS
 
     @staticmethod
     def _save_result(data: dict, path):
@@ -106,6 +267,11 @@ if __name__ == "__main__":
 
     # Video Processor
     print("[Video Processing]")
-    for example in dataset:
-        VideoProcessor(call_mistral_vllm, VLLM_API_URL).process(example)
-        break
\ No newline at end of file
+    if "--async" in sys.argv:
+        # Several videos in flight at once against the same server
+        processor = VideoProcessor(call_mistral_vllm, VLLM_API_URL, acall_model=acall_mistral_vllm)
+        run_async(processor.aprocess_many(dataset))
+    else:
+        for example in dataset:
+            VideoProcessor(call_mistral_vllm, VLLM_API_URL).process(example)
+            break
\ No newline at end of file
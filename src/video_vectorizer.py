@@ -1,13 +1,17 @@
 import json
 from pathlib import Path
-import cv2
+from typing import Iterable, Optional, Tuple
 from docarray import DocumentArray, dataclass, Document
 from clip_client import Client
 from datasets import Dataset, load_dataset
 
-from src.config import OUTPUT_DIR, SKIP_PROCESSED_VIDEOS, ERROR_DIR
+from src.config import OUTPUT_DIR, SKIP_PROCESSED_VIDEOS, ERROR_DIR, USE_FRAME_STORE, \
+    EMBEDDING_FRAME_INTERVAL_SECONDS, EMBEDDING_FRAME_MAX_SIDE, CLIP_SERVER_URL, \
+    COARSE_TO_FINE, COARSE_TO_FINE_MIN_DURATION_SECONDS, FRAME_INTERVAL_SECONDS, \
+    ANNOTATION_FRAME_MAX_SIDE, ANNOTATION_FRAME_PIXEL_BUDGET, VLM_IMAGE_TOKEN_PIXELS
 from src.utils.downloader import VideoDownloader
 from src.utils.frame_extractor import FrameExtractor
+from src.utils.frame_store import FrameStore
 
 
 records = []
@@ -19,14 +23,30 @@ END_ID = 1199
 
 
 class FrameVectorizer:
+    ENCODE_CHUNK = 128  # frames sent to the CLIP server per request; only their embeddings are kept
+
     def __init__(
         self,
-        server_url: str = 'grpc://0.0.0.0:51000',
+        server_url: str = CLIP_SERVER_URL,
         output_dir: Path = OUTPUT_DIR
     ):
-        # video downloader & frame extractor
+        # video downloader & frame extractors: small frames for CLIP, and the matched
+        # keyframes at the VLM resolution the Key Frames Processor annotates them at
         self.downloader = VideoDownloader()
-        self.extractor = FrameExtractor()
+        store = FrameStore() if USE_FRAME_STORE else None
+        self.extractor = FrameExtractor(
+            EMBEDDING_FRAME_INTERVAL_SECONDS,
+            store=store,
+            jpeg_quality=95,
+            max_side=EMBEDDING_FRAME_MAX_SIDE,
+        )
+        self.keyframe_extractor = FrameExtractor(
+            FRAME_INTERVAL_SECONDS,
+            store=store,
+            max_side=ANNOTATION_FRAME_MAX_SIDE,
+            pixel_budget=ANNOTATION_FRAME_PIXEL_BUDGET,
+            multiple_of=VLM_IMAGE_TOKEN_PIXELS,
+        )
         # Jina client for encoding
         self.client = Client(server=server_url)
         # output directories
@@ -34,7 +54,17 @@ class FrameVectorizer:
         self.output_dir.mkdir(parents=True, exist_ok=True)
         ERROR_DIR.mkdir(parents=True, exist_ok=True)
 
-    def process(self, example: dict):
+    def process(
+        self, example: dict, encoded_frames: Optional[Iterable[Tuple[bytes, float]]] = None,
+        video_path: Optional[str] = None,
+    ):
+        """
+        Embed the frames of one example and save the top matches to Parquet.
+        `encoded_frames` are pre-extracted (jpeg_bytes, timestamp) pairs, e.g. the
+        "embedding" tier of a shared `MultiRateExtractor` pass, consumed as they
+        arrive; when omitted the video is decoded here. The matched frames are saved
+        at the annotation resolution (see `keyframe_extractor`).
+        """
         qid = example['qid']
         vid = example['video_id']
         error_path = ERROR_DIR / f"{qid}_{vid}.json"
@@ -49,27 +79,31 @@ class FrameVectorizer:
                 print(f"\t✅ Already vectorized: {parquet_path}")
                 return
 
-            # 0. Download video
-            video_path = self.downloader.download(
-                example['youtube_url'], qid, vid
-            )
-
-            # 1. Extract frames and timestamps
-            frames, timestamps = self.extractor.extract(video_path)
+            if COARSE_TO_FINE and duration >= COARSE_TO_FINE_MIN_DURATION_SECONDS:
+                print("\t⏭️ Long video: keyframes come from the coarse-to-fine pass in video_processor.py")
+                return
 
-            # 2. Build DocumentArray for frames
-            da = DocumentArray()
-            for frame, ts in zip(frames, timestamps):
-                success, buf = cv2.imencode('.jpg', frame)
-                if not success:
-                    continue
-                doc = Document(blob=buf.tobytes())
-                doc.tags['ts'] = ts
-                da.append(doc)
-
-            # 3. Vectorize frames via Jina encoder
+            # 0-1. Download video and stream its frames as JPEG blobs
+            #      (served from the frame store without decoding on reruns)
+            if video_path is None:
+                video_path = self.downloader.download(
+                    example['youtube_url'], qid, vid
+                )
+            if encoded_frames is None:
+                encoded_frames = self.extractor.iter_encoded(video_path)
+
+            # 2-3. Vectorize frames via Jina encoder, a chunk at a time
+            #      (the small JPEGs are dropped once embedded)
             print("\tVectorizing frames via Jina encoder...")
-            da = self.client.encode(da, show_progress=True)
+            da = DocumentArray()
+            chunk = DocumentArray()
+            for blob, ts in encoded_frames:
+                chunk.append(Document(blob=blob, tags={'ts': ts}))
+                if len(chunk) == self.ENCODE_CHUNK:
+                    da.extend(self._embed(chunk))
+                    chunk = DocumentArray()
+            if len(chunk):
+                da.extend(self._embed(chunk))
 
             # 4. Vectorize question as a Document with text
             qn = self.client.encode([question])
@@ -83,16 +117,17 @@ class FrameVectorizer:
                 show_progress=True
             )[0]
 
-            # 6. Collect records from results
+            # 6. Collect records from results, with the matched frames at annotation resolution
+            keyframes = self.keyframe_extractor.encode_at(video_path, [match.tags['ts'] for match in results])
             records = []
-            for match in results:
+            for match, frame in zip(results, keyframes):
                 sim = match.scores['cosine'].value
                 #print("\tFrame:", match.tags['ts'], "Similarity:", sim)
                 records.append({
                     'timestamp': match.tags['ts'],
                     'similarity': sim,
                     'embedding': match.embedding.tolist(),
-                    'frame': match.blob
+                    'frame': frame
                 })
 
             # 6. Save to Parquet via Hugging Face Dataset or write error
@@ -121,10 +156,17 @@ class FrameVectorizer:
             with open(error_path, "w") as f:
                 json.dump(errors_msg, f, indent=2)
 
+    def _embed(self, chunk: DocumentArray) -> DocumentArray:
+        """
+        Embeddings of a chunk of frame Documents, without their blobs.
+        """
+        chunk = self.client.encode(chunk)
+        return DocumentArray(Document(embedding=doc.embedding, tags=doc.tags) for doc in chunk)
+
 
 if __name__ == "__main__":
     # Iterate over the dataset
-    server_url = 'grpc://0.0.0.0:51000'
+    server_url = CLIP_SERVER_URL
     vectorizer = FrameVectorizer(server_url)
     dataset = load_dataset("lmms-lab/AISG_Challenge", split="test")
     for example in dataset: